@@ -1,63 +1,173 @@
-import os
 import json
 import requests # Needed for API calls
+from requests.adapters import HTTPAdapter
 import base64
-from typing import List, Dict, Tuple
-import streamlit as st # Using st for error display and caching
-from PIL import Image
-import io
-
-# LLM (Groq) Libraries
-from groq import Groq
+import threading
+import hashlib
+import copy
+from collections import OrderedDict
+import re
+from typing import List, Dict, Tuple, Iterator
+from concurrent.futures import ThreadPoolExecutor
+
+from config import get_settings
+from rate_limit import get_rate_limiter
+from singleflight import SingleFlight
+from metrics import timed, is_none
+
+# Persistent cache for generated dish images
+from image_cache import dish_image_cache
+
+# Near-duplicate detection for uploaded menus
+from menu_index import menu_index
+from image_utils import detect_mime_type, split_into_tiles
+
+# Optional: HTTP/2 transport for the Together API
+try:
+    import httpx
+    HTTPX_AVAILABLE = True
+except ImportError:
+    HTTPX_AVAILABLE = False
+
+# Optional: Rehost generated images as responsive variants in our own storage
+try:
+    from image_hosting import rehost_image, find_rehosted_image, REHOST_DISH_IMAGES
+    REHOST_AVAILABLE = True
+except ImportError:
+    REHOST_AVAILABLE = False
+    REHOST_DISH_IMAGES = False
 
 # --- Configuration ---
-# Access keys from environment variables
-GROQ_API_KEY = os.environ.get("GROQ_API_KEY") or st.secrets.get("GROQ_API_KEY")
-TOGETHER_API_KEY = os.environ.get("TOGETHER_API_KEY") or st.secrets.get("TOGETHER_API_KEY")
-
-# Groq client setup (using official Groq client)
-if not GROQ_API_KEY:
-    st.error("Groq API Key not set. Please provide it via environment variables or st.secrets.")
-    groq_client = None
-else:
-    try:
-        groq_client = Groq(api_key=GROQ_API_KEY)
-    except Exception as e:
-        st.error(f"Error initializing Groq client: {e}")
-        groq_client = None
+settings = get_settings()
 
-# Function to encode image to base64
-def encode_image(image_bytes):
-    return base64.b64encode(image_bytes).decode('utf-8')
+# Access keys
+GROQ_API_KEY = settings.groq_api_key
+TOGETHER_API_KEY = settings.together_api_key
 
-# --- Functions ---
+# Groq endpoint (None for the SDK default; can point at a local stub)
+GROQ_BASE_URL = settings.groq_base_url
 
-@st.cache_data(show_spinner="Analyzing menu...")
-def extract_menu_text(image_bytes: bytes) -> Tuple[str | None, List[Dict] | None]:
-    """
-    Processes a menu image using Llama 4 via Groq API and extracts structured menu data.
+# Together transport settings (the base URL can point at a local stub)
+TOGETHER_BASE_URL = settings.together_base_url
+TOGETHER_POOL_SIZE = settings.together_pool_size
+TOGETHER_HTTP2 = settings.together_http2
 
-    Args:
-        image_bytes: The image data as bytes.
+# Estimated Groq tokens per extraction (prompt, image and answer), corrected from actual usage
+GROQ_TOKENS_PER_REQUEST = settings.groq_tokens_per_request
+
+# --- Groq Client ---
+# Created on first use, so importing this module stays cheap and free of network setup
+_groq_client = None
+_groq_client_lock = threading.Lock()
+
+def get_groq_client():
+    """
+    Returns the process-wide Groq client, creating it on first use.
 
     Returns:
-        A tuple containing the raw text (or None on error) and a list of dicts
-        representing menu items (or None/empty list on error).
+        The client, or None if GROQ_API_KEY is not set or the client cannot be created.
     """
-    # Create a placeholder for status updates
-    status_placeholder = st.empty()
-    status_placeholder.info("Analyzing menu items...")
+    global _groq_client
+
+    if _groq_client is None and GROQ_API_KEY:
+        with _groq_client_lock:
+            if _groq_client is None:
+                try:
+                    # Imported here: the Groq SDK is slow to import and only needed for extraction
+                    from groq import Groq
+                    # Retries are left to the rate limiter, which sees every caller's throttling
+                    _groq_client = Groq(api_key=GROQ_API_KEY, base_url=GROQ_BASE_URL, max_retries=0)
+                except Exception:
+                    return None
+
+    return _groq_client
+
+# --- HTTP Transport ---
+# One pooled, keep-alive client is shared by every Together call in the process,
+# so repeated image requests reuse connections instead of redoing TCP+TLS handshakes.
+_together_session = None
+_together_session_lock = threading.Lock()
+
+def get_together_session():
+    """
+    Returns the process-wide pooled HTTP client for the Together API.
 
-    if groq_client is None:
-        status_placeholder.error("API connection error. Please try again.")
-        return None, []
+    Uses an HTTP/2 httpx client when TOGETHER_HTTP2 is enabled and httpx (with h2)
+    is installed, and a keep-alive requests session otherwise. Both expose the
+    same post()/raise_for_status()/json() interface used below.
+    """
+    global _together_session
 
-    try:
-        # Encode the image to base64
-        base64_image = encode_image(image_bytes)
+    if _together_session is None:
+        with _together_session_lock:
+            if _together_session is None:
+                _together_session = _create_together_session()
+
+    return _together_session
+
+def _create_together_session():
+    if TOGETHER_HTTP2 and HTTPX_AVAILABLE:
+        try:
+            return httpx.Client(
+                http2=True,
+                limits=httpx.Limits(
+                    max_connections=TOGETHER_POOL_SIZE,
+                    max_keepalive_connections=TOGETHER_POOL_SIZE
+                )
+            )
+        except ImportError:
+            # http2=True needs the optional h2 package; fall back to HTTP/1.1 keep-alive
+            pass
+
+    session = requests.Session()
+    # pool_block keeps the pool bounded: extra callers wait for a free connection
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=TOGETHER_POOL_SIZE, pool_block=True)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+# --- Image Download Session ---
+# Generated images are served from a CDN host, not the API host. Downloading them
+# through the API session would evict its single host pool and drop the API's
+# keep-alive connections, so downloads get their own pooled session.
+_image_download_session = None
+_image_download_session_lock = threading.Lock()
+
+def get_image_download_session() -> requests.Session:
+    """Returns the process-wide pooled HTTP session for downloading generated images."""
+    global _image_download_session
+
+    if _image_download_session is None:
+        with _image_download_session_lock:
+            if _image_download_session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_maxsize=TOGETHER_POOL_SIZE, pool_block=True)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _image_download_session = session
+
+    return _image_download_session
+
+# Function to encode image to base64
+def encode_image(image_bytes):
+    return base64.b64encode(image_bytes).decode('utf-8')
 
-        # Create the prompt for Llama 4
-        prompt = """You are an expert at extracting structured data from restaurant menus.
+# --- Functions ---
+
+# Tiled extraction settings
+MENU_TILED_EXTRACTION = settings.menu_tiled_extraction
+MENU_TILE_COLUMNS = settings.menu_tile_columns
+MENU_TILE_ROWS = settings.menu_tile_rows
+MENU_TILE_OVERLAP = settings.menu_tile_overlap
+MENU_TILE_WORKERS = settings.menu_tile_workers
+
+# Streaming extraction settings
+MENU_STREAMING_EXTRACTION = settings.menu_streaming_extraction
+
+MENU_EXTRACTION_MODEL = "meta-llama/llama-4-scout-17b-16e-instruct"  # Using Llama 4 Scout for multimodal capabilities
+
+# Create the prompt for Llama 4
+MENU_EXTRACTION_PROMPT = """You are an expert at extracting structured data from restaurant menus.
         Look at this menu image and extract a clean list of dish names and short descriptions.
 
         Rules:
@@ -70,105 +180,521 @@ def extract_menu_text(image_bytes: bytes) -> Tuple[str | None, List[Dict] | None
         7. Ensure the JSON is valid and correctly formatted.
         """
 
-        # Call Llama 4 via Groq API with the image
-        response = groq_client.chat.completions.create(
-            model="meta-llama/llama-4-scout-17b-16e-instruct",  # Using Llama 4 Scout for multimodal capabilities
+# Extra instruction for tiles, which overlap their neighbours
+MENU_TILE_PROMPT_SUFFIX = """8. This image is one section of a larger menu. Skip any dish whose name is cut off at the edge of the image; it appears in full in a neighbouring section.
+        """
+
+def parse_menu_items(structured_menu_str: str) -> Tuple[str, List[Dict] | None]:
+    """
+    Parses the model's JSON output into a list of menu items.
+
+    Args:
+        structured_menu_str: The raw model output.
+
+    Returns:
+        A tuple of the cleaned output and the list of valid items
+        (each a dict with "name" and "description"), or None if the JSON is invalid.
+    """
+    # Clean up potential markdown wrapping
+    if structured_menu_str.startswith("```json"):
+        structured_menu_str = structured_menu_str[len("```json"):].strip()
+    if structured_menu_str.endswith("```"):
+        structured_menu_str = structured_menu_str[:-len("```")].strip()
+
+    try:
+        items_data = json.loads(structured_menu_str)
+    except json.JSONDecodeError:
+        return structured_menu_str, None
+
+    # Extract the items array from the JSON object
+    if isinstance(items_data, list):
+        items = items_data
+    elif not isinstance(items_data, dict):
+        items = []
+    elif "items" in items_data:
+        items = items_data["items"]
+    elif "menu_items" in items_data:
+        items = items_data["menu_items"]
+    elif "dishes" in items_data:
+        items = items_data["dishes"]
+    else:
+        # Try to find any array in the response
+        for _, value in items_data.items():
+            if isinstance(value, list) and len(value) > 0:
+                items = value
+                break
+        else:
+            items = []
+
+    if not isinstance(items, list):
+        if isinstance(items, dict):
+            items = [items]  # Wrap single dict in a list
+        else:
+            items = []  # Return empty list
+
+    # Validate the items
+    valid_items = []
+    for item in items:
+        if isinstance(item, dict) and "name" in item and "description" in item:
+            valid_items.append(item)
+
+    return structured_menu_str, valid_items
+
+def request_menu_items(image_bytes: bytes, prompt: str = MENU_EXTRACTION_PROMPT) -> Tuple[str, List[Dict] | None]:
+    """
+    Sends one menu image to Llama 4 via Groq and parses the response, without touching the UI.
+
+    Args:
+        image_bytes: The image data as bytes.
+        prompt: The extraction prompt.
+
+    Returns:
+        A tuple of the raw model output and the parsed items (None if the output was not valid JSON).
+
+    Raises:
+        Exception: If the Groq client is unavailable or the API call fails.
+    """
+    groq_client = get_groq_client()
+    if groq_client is None:
+        raise RuntimeError("Groq client not initialized")
+
+    # Encode the image to base64
+    base64_image = encode_image(image_bytes)
+
+    # Call Llama 4 via Groq API with the image
+    response = get_rate_limiter("groq").call(
+        lambda: groq_client.chat.completions.create(
+            model=MENU_EXTRACTION_MODEL,
             messages=[
                 {"role": "system", "content": "You are a helpful assistant that extracts structured data from images."},
                 {"role": "user", "content": [
                     {"type": "text", "text": prompt},
-                    {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}}
+                    {"type": "image_url", "image_url": {"url": f"data:{detect_mime_type(image_bytes)};base64,{base64_image}"}}
                 ]}
             ],
             temperature=0.0,  # Keep it low for structured output
             response_format={"type": "json_object"}  # Request JSON format
-        )
+        ),
+        tokens=GROQ_TOKENS_PER_REQUEST,
+        usage=lambda response: response.usage.total_tokens
+    )
+
+    # Extract the response content
+    return parse_menu_items(response.choices[0].message.content.strip())
 
-        # Extract the response content
-        structured_menu_str = response.choices[0].message.content.strip()
+def merge_menu_items(item_lists: List[List[Dict]]) -> List[Dict]:
+    """
+    Merges partial item lists, dropping duplicates by normalized dish name.
 
-        # Display a sample of the extracted text
-        with st.expander("Extracted Menu Text", expanded=False):
-            st.text(structured_menu_str[:1000] + "..." if len(structured_menu_str) > 1000 else structured_menu_str)
+    The first occurrence keeps its position; if a duplicate carries a longer
+    description (e.g. the other tile cut it short), that description wins.
 
-        # Parse the JSON response
+    Args:
+        item_lists: Item lists in reading order.
+
+    Returns:
+        The merged list of items.
+    """
+    merged: Dict[str, Dict] = {}
+    for items in item_lists:
+        for item in items:
+            key = normalize_dish_text(item.get("name", ""))
+            if not key:
+                continue
+            if key not in merged:
+                merged[key] = dict(item)
+            elif len(item.get("description") or "") > len(merged[key].get("description") or ""):
+                merged[key]["description"] = item["description"]
+    return list(merged.values())
+
+def extract_menu_items_tiled(
+    image_bytes: bytes,
+    columns: int = MENU_TILE_COLUMNS,
+    rows: int = MENU_TILE_ROWS,
+    overlap: float = MENU_TILE_OVERLAP,
+    max_workers: int = MENU_TILE_WORKERS
+) -> Tuple[str, List[Dict] | None]:
+    """
+    Extracts a large menu by splitting it into overlapping tiles and extracting them concurrently.
+
+    Tiles are cut from the original photo (so each keeps full detail), normalized
+    individually, sent to Groq in parallel and merged in reading order, with
+    duplicates from the overlapping margins removed.
+
+    Args:
+        image_bytes: The original image data as bytes.
+        columns: The number of column strips.
+        rows: The number of row bands per column.
+        overlap: The fraction of each tile shared with its neighbours.
+        max_workers: The maximum number of tile requests in flight.
+
+    The result is all or nothing: a menu missing some tiles would be stored in the
+    menu index and served for every near-duplicate, so a single failed tile fails
+    the whole extraction.
+
+    Returns:
+        A tuple of the combined raw output and the merged items (None if any tile's
+        output was not valid JSON).
+
+    Raises:
+        Exception: The first error of any failed tile request.
+    """
+    tiles = split_into_tiles(image_bytes, columns, rows, overlap)
+    prompt = MENU_EXTRACTION_PROMPT + MENU_TILE_PROMPT_SUFFIX if len(tiles) > 1 else MENU_EXTRACTION_PROMPT
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(tiles)))) as executor:
+        futures = [executor.submit(request_menu_items, tile, prompt) for tile in tiles]
         try:
-            # Clean up potential markdown wrapping
-            if structured_menu_str.startswith("```json"):
-                structured_menu_str = structured_menu_str[len("```json"):].strip()
-            if structured_menu_str.endswith("```"):
-                structured_menu_str = structured_menu_str[:-len("```")].strip()
-
-            items_data = json.loads(structured_menu_str)
-
-            # Extract the items array from the JSON object
-            if "items" in items_data:
-                items = items_data["items"]
-            elif "menu_items" in items_data:
-                items = items_data["menu_items"]
-            elif "dishes" in items_data:
-                items = items_data["dishes"]
-            elif isinstance(items_data, list):
-                items = items_data
-            else:
-                # Try to find any array in the response
-                for _, value in items_data.items():
-                    if isinstance(value, list) and len(value) > 0:
-                        items = value
-                        break
-                else:
-                    items = []
-
-            if not isinstance(items, list):
-                if isinstance(items, dict):
-                    items = [items]  # Wrap single dict in a list
-                else:
-                    items = []  # Return empty list
-
-            # Validate the items
-            valid_items = []
-            for item in items:
-                if isinstance(item, dict) and "name" in item and "description" in item:
-                    valid_items.append(item)
-
-            # Clear the status message if successful
-            status_placeholder.empty()
-
-            return structured_menu_str, valid_items
-
-        except json.JSONDecodeError:
-            status_placeholder.error("Could not process menu. Please try a clearer image.")
-            return structured_menu_str, []  # Return empty list on parse error
+            results = [future.result() for future in futures]
+        except Exception:
+            for future in futures:
+                future.cancel()
+            raise
+
+    raw_text = "\n".join(raw for raw, _ in results)
+    item_lists = [items for _, items in results]
+    if any(items is None for items in item_lists):
+        return raw_text, None
+
+    return raw_text, merge_menu_items(item_lists)
+
+class IncrementalItemParser:
+    """
+    Incremental scanner for a streamed JSON menu.
+
+    Text is fed in arbitrary chunks. Whenever a JSON object closes, it is parsed on its
+    own, and if it is a complete menu item (with "name" and "description") it is returned
+    straight away, long before the enclosing array or object is finished.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self._pos = 0
+        self._in_string = False
+        self._escaped = False
+        self._object_starts: List[int] = []
+
+    def feed(self, chunk: str) -> List[Dict]:
+        """
+        Adds a chunk of model output.
+
+        Args:
+            chunk: The next piece of streamed text.
+
+        Returns:
+            The menu items completed by this chunk, in order.
+        """
+        self.text += chunk
+        items = []
+
+        while self._pos < len(self.text):
+            char = self.text[self._pos]
+
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char == "{":
+                self._object_starts.append(self._pos)
+            elif char == "}" and self._object_starts:
+                start = self._object_starts.pop()
+                try:
+                    candidate = json.loads(self.text[start:self._pos + 1])
+                except json.JSONDecodeError:
+                    candidate = None
+                if isinstance(candidate, dict) and isinstance(candidate.get("name"), str) and "description" in candidate:
+                    items.append(candidate)
+
+            self._pos += 1
+
+        return items
+
+def stream_menu_items(image_bytes: bytes, parser: IncrementalItemParser | None = None) -> Iterator[Dict]:
+    """
+    Streams menu items from Llama 4 via Groq as soon as each one is fully decoded, without touching the UI.
+
+    Near-duplicates of previously extracted menus are answered from the menu index,
+    and completed extractions are added to it.
+
+    Args:
+        image_bytes: The image data as bytes (ideally normalized by image_utils.preprocess_menu_image).
+        parser: An optional parser to use; its `text` holds the raw model output afterwards.
+
+    Yields:
+        Menu items (dicts with "name" and "description"), de-duplicated by normalized name.
+
+    Raises:
+        Exception: If the Groq client is unavailable or the API call fails.
+    """
+    parser = parser or IncrementalItemParser()
 
+    try:
+        fingerprint = menu_index.fingerprint(image_bytes)
     except Exception:
-        status_placeholder.error("Could not process menu. Please try again.")
-        return None, []  # Return empty list on API error
+        fingerprint = None
+
+    if fingerprint is not None:
+        previous = menu_index.lookup(fingerprint)
+        if previous is not None:
+            parser.text = previous[0]
+            yield from previous[1]
+            return
+
+    groq_client = get_groq_client()
+    if groq_client is None:
+        raise RuntimeError("Groq client not initialized")
+
+    # JSON mode cannot be combined with streaming, so the prompt alone asks for JSON.
+    # The limiter holds a concurrency slot until the stream is fully read.
+    stream = get_rate_limiter("groq").stream(
+        lambda: groq_client.chat.completions.create(
+            model=MENU_EXTRACTION_MODEL,
+            messages=[
+                {"role": "system", "content": "You are a helpful assistant that extracts structured data from images."},
+                {"role": "user", "content": [
+                    {"type": "text", "text": MENU_EXTRACTION_PROMPT},
+                    {"type": "image_url", "image_url": {"url": f"data:{detect_mime_type(image_bytes)};base64,{encode_image(image_bytes)}"}}
+                ]}
+            ],
+            temperature=0.0,  # Keep it low for structured output
+            stream=True
+        ),
+        tokens=GROQ_TOKENS_PER_REQUEST,
+        usage=_stream_chunk_usage
+    )
+
+    seen = set()
+    items = []
+    for chunk in stream:
+        if not chunk.choices:
+            continue
+        for item in parser.feed(chunk.choices[0].delta.content or ""):
+            key = normalize_dish_text(item["name"])
+            if not key or key in seen:
+                continue
+            seen.add(key)
+            items.append(item)
+            yield item
+
+    # Remember the result for near-duplicate uploads
+    if fingerprint is not None and items:
+        menu_index.add(fingerprint, parser.text, items)
+
+def _stream_chunk_usage(chunk) -> int | None:
+    """Returns the total tokens Groq reports on the last chunk of a stream, or None for other chunks."""
+    usage = getattr(getattr(chunk, "x_groq", None), "usage", None)
+    return getattr(usage, "total_tokens", None)
+
+# Identical extractions in flight across sessions, keyed by image hash and mode
+_extraction_flight = SingleFlight()
+
+@timed("extract", failed=lambda result: result[1] is None)
+def extract_menu_items(image_bytes: bytes, tiled: bool = False) -> Tuple[str, List[Dict] | None]:
+    """
+    Extracts structured menu data from a menu image without touching the UI.
+
+    Near-duplicates of previously extracted menus are answered from the menu index,
+    and new results are added to it.
+
+    Args:
+        image_bytes: The image data as bytes. In tiled mode this should be the original
+            upload; otherwise ideally normalized by image_utils.preprocess_menu_image.
+        tiled: Whether to extract overlapping tiles concurrently (for large, multi-column menus).
+
+    Returns:
+        A tuple of the raw model output and the menu items (None if the output could not be parsed).
+
+    Raises:
+        RuntimeError: If the Groq client is not initialized.
+        Exception: Any error raised by the Groq API.
+    """
+    # Sessions extracting the same menu at the same time share one request
+    key = (hashlib.sha256(image_bytes).hexdigest(), tiled)
+    result, shared = _extraction_flight.do(key, lambda: _extract_menu_items(image_bytes, tiled))
+    return copy.deepcopy(result) if shared else result
+
+def _extract_menu_items(image_bytes: bytes, tiled: bool) -> Tuple[str, List[Dict] | None]:
+    # Reuse the result of a previously extracted near-duplicate (re-photo, re-compression)
+    try:
+        fingerprint = menu_index.fingerprint(image_bytes)
+    except Exception:
+        fingerprint = None
+
+    if fingerprint is not None:
+        previous = menu_index.lookup(fingerprint)
+        if previous is not None:
+            return previous
+
+    if tiled:
+        structured_menu_str, valid_items = extract_menu_items_tiled(image_bytes)
+    else:
+        structured_menu_str, valid_items = request_menu_items(image_bytes)
+
+    # Remember the result for near-duplicate uploads
+    if fingerprint is not None and valid_items:
+        menu_index.add(fingerprint, structured_menu_str, valid_items)
+
+    return structured_menu_str, valid_items
 
 # Step 5 will add the image generation function here
 # --- Functions (continued) ---
 
-# @st.cache_data # Careful caching image generation calls, you might hit API limits or want fresh images
-def generate_dish_image(dish_name: str, description: str) -> str | None:
+# Image generation settings (part of the image cache key)
+IMAGE_MODEL = "black-forest-labs/FLUX.1-schnell"
+IMAGE_STEPS = 5  # Reduced steps for faster generation
+IMAGE_WIDTH = 1024
+IMAGE_HEIGHT = 768
+
+# Progressive mode: a small, few-step preview is shown first and replaced by the full render
+PROGRESSIVE_DISH_IMAGES = settings.progressive_dish_images
+PREVIEW_IMAGE_STEPS = settings.preview_image_steps
+PREVIEW_IMAGE_WIDTH = settings.preview_image_width
+PREVIEW_IMAGE_HEIGHT = settings.preview_image_height
+
+# Concurrent image generation settings
+CONCURRENT_IMAGE_GENERATION = settings.concurrent_image_generation
+IMAGE_GENERATION_WORKERS = settings.image_generation_workers
+
+# Background writer for cache fills, so storing an image never delays showing it
+_cache_fill_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="image-cache-fill")
+
+def normalize_dish_text(text: str) -> str:
+    """Normalizes a dish name or description for comparison (case and whitespace insensitive)."""
+    return re.sub(r"\s+", " ", (text or "").strip().lower())
+
+def dish_image_cache_key(dish_name: str, description: str, model: str = IMAGE_MODEL, steps: int = IMAGE_STEPS, width: int = IMAGE_WIDTH, height: int = IMAGE_HEIGHT) -> str:
     """
-    Generates an image for a dish using Flux via Together AI.
+    Builds the content key of a dish image from everything that determines its look.
 
     Args:
         dish_name: The name of the dish.
         description: A short description of the dish.
+        model: The image model.
+        steps: The number of diffusion steps.
+        width: The image width in pixels.
+        height: The image height in pixels.
 
     Returns:
-        The URL of the generated image, or None if generation failed.
+        A SHA-256 hex digest.
     """
-    if not TOGETHER_API_KEY:
-         st.error("Together AI API Key not set.")
-         return None
+    material = json.dumps([normalize_dish_text(dish_name), normalize_dish_text(description), model, steps, width, height])
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+def _fetch_image_bytes(img_url: str) -> bytes:
+    """Downloads a generated image, or decodes it if it was returned inline as a data URI."""
+    if img_url.startswith("data:"):
+        return base64.b64decode(img_url.split(",", 1)[1])
+    response = get_image_download_session().get(img_url, timeout=60)
+    response.raise_for_status()
+    return response.content
+
+def _fill_image_cache(cache_key: str, img_url: str) -> None:
+    """Fetches a freshly generated image and stores its bytes in the image cache."""
+    try:
+        dish_image_cache.put(cache_key, _fetch_image_bytes(img_url))
+    except Exception:
+        # A failed cache fill only means the next request generates the image again
+        pass
+
+def _rehost_enabled() -> bool:
+    return REHOST_AVAILABLE and REHOST_DISH_IMAGES
+
+# Rehosted URLs already known in this process: cache key -> URL, least recently used first.
+# Variants are immutable, so a known URL never needs another storage lookup.
+_REHOSTED_URLS_MAX = 4096
+_rehosted_urls: "OrderedDict[str, str]" = OrderedDict()
+_rehosted_urls_lock = threading.Lock()
+
+def _known_rehosted_url(cache_key: str) -> str | None:
+    with _rehosted_urls_lock:
+        url = _rehosted_urls.get(cache_key)
+        if url is not None:
+            _rehosted_urls.move_to_end(cache_key)
+        return url
+
+def _remember_rehosted_url(cache_key: str, url: str | None) -> str | None:
+    if url:
+        with _rehosted_urls_lock:
+            _rehosted_urls[cache_key] = url
+            _rehosted_urls.move_to_end(cache_key)
+            while len(_rehosted_urls) > _REHOSTED_URLS_MAX:
+                _rehosted_urls.popitem(last=False)
+    return url
+
+def _rehost_dish_image(cache_key: str, image_data: bytes) -> str | None:
+    """Rehosts image bytes, returning None (so callers fall back to the original image) on failure."""
+    try:
+        return _remember_rehosted_url(cache_key, rehost_image(image_data, cache_key))
+    except Exception:
+        return None
+
+# Identical generations in flight across sessions, keyed by dish image cache key
+_image_flight = SingleFlight()
+
+@timed("generate", failed=is_none)
+def request_dish_image(dish_name: str, description: str) -> str | None:
+    """
+    Requests an image for a dish from Flux via Together AI without touching the UI.
+
+    Images are looked up in the persistent image cache first; new images are added to it
+    in the background. Concurrent requests for the same dish share one generation.
+    With REHOST_DISH_IMAGES on, the returned URL points at a grid-size WebP variant
+    in our own storage instead of the provider's temporary URL.
+
+    Args:
+        dish_name: The name of the dish.
+        description: A short description of the dish.
 
-    # Create a placeholder for status updates
-    status_placeholder = st.empty()
-    status_placeholder.info(f"Generating image for '{dish_name}'...")
+    Returns:
+        The URL (or local cache path) of the generated image, or None if generation failed.
+    """
+    cache_key = dish_image_cache_key(dish_name, description)
+    img_url, _ = _image_flight.do(cache_key, lambda: _request_dish_image(dish_name, description, cache_key))
+    return img_url
+
+def _find_cached_dish_image(cache_key: str) -> str | None:
+    """Returns the stored image for a cache key (rehosted URL or local cache path), or None."""
+    if not _rehost_enabled():
+        return dish_image_cache.get(cache_key)
+
+    # URLs rehosted or found earlier in this process need no storage round trip
+    rehosted_url = _known_rehosted_url(cache_key)
+    if rehosted_url:
+        return rehosted_url
+
+    # Images that were rehosted before need no download, encode or upload
+    rehosted_url = _remember_rehosted_url(cache_key, find_rehosted_image(cache_key))
+    if rehosted_url:
+        return rehosted_url
+
+    cached_path = dish_image_cache.get(cache_key)
+    if cached_path:
+        try:
+            with open(cached_path, "rb") as f:
+                return _rehost_dish_image(cache_key, f.read()) or cached_path
+        except OSError:
+            return cached_path
+
+    return None
+
+def _dish_image_prompt(dish_name: str, description: str) -> str:
+    return f"A high-quality, photorealistic image of '{dish_name}', which is described as: {description}. Focus on the dish itself, beautifully presented on a plate. The style should be like a professional food photograph."
+
+def _generate_image_url(prompt: str, steps: int = IMAGE_STEPS, width: int = IMAGE_WIDTH, height: int = IMAGE_HEIGHT) -> str | None:
+    """
+    Asks Together AI for one image.
 
-    prompt = f"A high-quality, photorealistic image of '{dish_name}', which is described as: {description}. Focus on the dish itself, beautifully presented on a plate. The style should be like a professional food photograph."
+    Returns:
+        The provider's URL of the image (or a data URI), or None if the response had no image.
 
+    Raises:
+        Exception: Timeouts, HTTP errors and malformed responses.
+    """
     headers = {
         "Authorization": f"Bearer {TOGETHER_API_KEY}",
         "Content-Type": "application/json"
@@ -176,53 +702,107 @@ def generate_dish_image(dish_name: str, description: str) -> str | None:
 
     # Updated payload based on the TypeScript example
     payload = {
-        "model": "black-forest-labs/FLUX.1-schnell",  # Updated model name
+        "model": IMAGE_MODEL,  # Updated model name
         "prompt": prompt,
         "n": 1,  # Number of images to generate
-        "steps": 5,  # Reduced steps for faster generation
-        "height": 768,
-        "width": 1024,
+        "steps": steps,
+        "height": height,
+        "width": width,
         "response_format": "url"  # Explicitly request URL format
     }
 
-    api_url = "https://api.together.xyz/v1/images/generations"
+    api_url = f"{TOGETHER_BASE_URL}/images/generations"
 
-    try:
-        response = requests.post(
+    def post_generation():
+        response = get_together_session().post(
             api_url,
             json=payload,
             headers=headers,
             timeout=60  # Add a timeout
         )
         response.raise_for_status()  # Raise an HTTPError for bad responses (4xx or 5xx)
+        return response
 
-        result = response.json()
+    # 429s and transient errors are retried by the limiter, honoring Retry-After
+    response = get_rate_limiter("together").call(post_generation)
 
-        # Expected structure: {'data': [{'url': '...', 'seed': ...}], 'created': ...}
-        if result and 'data' in result and isinstance(result['data'], list) and len(result['data']) > 0:
-            if 'url' in result['data'][0]:
-                img_url = result['data'][0]['url']
-                status_placeholder.empty()  # Clear the status message
-                return img_url
-            elif 'b64_json' in result['data'][0]:
-                # Handle base64 response if that's what we get
-                b64_data = result['data'][0]['b64_json']
-                img_url = f"data:image/jpeg;base64,{b64_data}"
-                status_placeholder.empty()  # Clear the status message
-                return img_url
-            else:
-                status_placeholder.error(f"Could not generate image for '{dish_name}'")
-                return None
-        else:
-            status_placeholder.error(f"Could not generate image for '{dish_name}'")
-            return None
+    result = response.json()
 
-    except requests.exceptions.Timeout:
-        status_placeholder.error(f"Could not generate image for '{dish_name}'")
-        return None
-    except requests.exceptions.RequestException:
-        status_placeholder.error(f"Could not generate image for '{dish_name}'")
+    # Expected structure: {'data': [{'url': '...', 'seed': ...}], 'created': ...}
+    img_url = None
+    if result and 'data' in result and isinstance(result['data'], list) and len(result['data']) > 0:
+        if 'url' in result['data'][0]:
+            img_url = result['data'][0]['url']
+        elif 'b64_json' in result['data'][0]:
+            # Handle base64 response if that's what we get
+            b64_data = result['data'][0]['b64_json']
+            img_url = f"data:image/jpeg;base64,{b64_data}"
+
+    return img_url
+
+def _request_dish_image(dish_name: str, description: str, cache_key: str) -> str | None:
+    cached_url = _find_cached_dish_image(cache_key)
+    if cached_url:
+        return cached_url
+
+    if not TOGETHER_API_KEY:
         return None
+
+    try:
+        img_url = _generate_image_url(_dish_image_prompt(dish_name, description))
+
+        if img_url and _rehost_enabled():
+            # Download once, then cache and rehost the same bytes
+            try:
+                image_data = _fetch_image_bytes(img_url)
+            except Exception:
+                return img_url
+            _cache_fill_executor.submit(dish_image_cache.put, cache_key, image_data)
+            return _rehost_dish_image(cache_key, image_data) or img_url
+
+        if img_url:
+            _cache_fill_executor.submit(_fill_image_cache, cache_key, img_url)
+
+        return img_url
+
     except Exception:
-        status_placeholder.error(f"Could not generate image for '{dish_name}'")
-        return None
\ No newline at end of file
+        # Timeouts, HTTP errors and malformed responses are all reported as a missing image
+        return None
+
+# Identical previews in flight across sessions, keyed by dish text and preview size
+_preview_flight = SingleFlight()
+
+@timed("preview", failed=lambda result: result[0] is None)
+def request_dish_preview(dish_name: str, description: str) -> Tuple[str | None, bool]:
+    """
+    Requests a fast, low-resolution preview of a dish image without touching the UI.
+
+    The preview uses PREVIEW_IMAGE_STEPS at PREVIEW_IMAGE_WIDTH x PREVIEW_IMAGE_HEIGHT
+    and is neither cached nor rehosted; request_dish_image produces the image that
+    replaces it. If the full image is already stored, it is returned instead, so the
+    caller can skip the full request.
+
+    Args:
+        dish_name: The name of the dish.
+        description: A short description of the dish.
+
+    Returns:
+        A tuple of the image URL (None if the preview failed) and whether it is the final image.
+    """
+    cached_url = _find_cached_dish_image(dish_image_cache_key(dish_name, description))
+    if cached_url:
+        return cached_url, True
+
+    if not TOGETHER_API_KEY:
+        return None, False
+
+    preview_key = dish_image_cache_key(dish_name, description, steps=PREVIEW_IMAGE_STEPS, width=PREVIEW_IMAGE_WIDTH, height=PREVIEW_IMAGE_HEIGHT)
+
+    def generate_preview():
+        try:
+            return _generate_image_url(_dish_image_prompt(dish_name, description), PREVIEW_IMAGE_STEPS, PREVIEW_IMAGE_WIDTH, PREVIEW_IMAGE_HEIGHT)
+        except Exception:
+            return None
+
+    preview_url, _ = _preview_flight.do(preview_key, generate_preview)
+    return preview_url, False
@@ -1,16 +1,30 @@
 import streamlit as st
-import os
-import time
+import math
+import hashlib
+from concurrent.futures import as_completed
 from datetime import datetime
 # Optional: Load environment variables from .env file for local development
 from dotenv import load_dotenv
 load_dotenv()
 
-import uuid # To create unique identifiers for uploads
-
 # Import our utility functions
-from supabase_utils import upload_image_to_supabase
-from ai_utils import extract_menu_text, generate_dish_image
+from supabase_utils import upload_image_in_background, USE_SUPABASE_S3
+from streamlit_adapters import extract_menu_text, generate_dish_image, report_configuration_errors
+from ai_utils import (
+    request_dish_image,
+    stream_menu_items,
+    IncrementalItemParser,
+    request_dish_preview,
+    CONCURRENT_IMAGE_GENERATION,
+    PROGRESSIVE_DISH_IMAGES,
+    MENU_TILED_EXTRACTION,
+    MENU_STREAMING_EXTRACTION,
+)
+from image_utils import preprocess_menu_image
+from pipeline import MenuPipeline
+from image_scheduler import ImageScheduler, PAGINATED_GALLERY, GALLERY_PAGE_SIZE, GALLERY_PREFETCH_PAGES
+from results_store import ResultsStore, READY
+from metrics import timed, start_metrics_server
 from logo import logo_html
 
 # --- Configuration and Setup Checks ---
@@ -27,9 +41,308 @@ st.set_page_config(
 with open("style.css") as f:
     st.markdown(f"<style>{f.read()}</style>", unsafe_allow_html=True)
 
-# You can add checks for API keys here if you didn't add them to the utility files,
-# but adding them to the utils is cleaner as those functions rely on them.
-# Let's assume the utility functions handle reporting missing keys upon call.
+# Report missing API keys up front; the utility modules themselves never render anything
+report_configuration_errors()
+
+# Serve /metrics when METRICS_PORT is set (once per process; the script re-runs on every interaction)
+start_metrics_server()
+
+# --- Helpers ---
+
+def show_dish_image(slot, img_url, caption=None):
+    """Render a generated dish image (or an error notice) into a card's image slot."""
+    if img_url:
+        with slot.container():
+            # Image container at the top of the card
+            st.markdown('<div class="dish-image-container">', unsafe_allow_html=True)
+            st.image(img_url, caption=caption, use_container_width=True)
+            st.markdown('</div>', unsafe_allow_html=True)
+    else:
+        slot.markdown('<div class="image-error">Could not generate image</div>', unsafe_allow_html=True)
+
+def render_dish_card(item):
+    """Render a dish card in the current column and return the (still loading) image slot."""
+    name = item.get("name", "N/A")
+    description = item.get("description", "No description provided.")
+
+    # Create a fixed-height card with proper spacing
+    st.markdown('<div class="dish-card">', unsafe_allow_html=True)
+
+    # Reserve the image area; it is filled once the image is ready
+    image_slot = st.empty()
+    image_slot.markdown('<div class="image-loading"><p class="loading-animation">Generating image...</p></div>', unsafe_allow_html=True)
+
+    # Content container for title and description
+    st.markdown('<div class="dish-content">', unsafe_allow_html=True)
+
+    # Display dish name
+    st.markdown(f'<h4 class="dish-name">{name}</h4>', unsafe_allow_html=True)
+
+    # Display dish description
+    st.markdown(f'<p class="dish-description">{description}</p>', unsafe_allow_html=True)
+
+    st.markdown('</div>', unsafe_allow_html=True)
+    st.markdown('</div>', unsafe_allow_html=True)
+
+    return image_slot
+
+class DishGrid:
+    """Lays out dish cards in rows of num_cols, one card at a time as items become known."""
+
+    def __init__(self, num_cols=2):
+        self.num_cols = num_cols
+        self.image_slots = []
+        self._cols = None
+
+        # Add a container for better grid styling
+        st.markdown('<div class="menu-grid">', unsafe_allow_html=True)
+
+    def add(self, item):
+        """Add a card for the item and return its image slot."""
+        position = len(self.image_slots) % self.num_cols
+        if position == 0:
+            if self._cols is not None:
+                # Close the previous dish-row div
+                st.markdown('</div>', unsafe_allow_html=True)
+            self._cols = st.columns(self.num_cols)
+            # Add a custom class to remove vertical spacing
+            st.markdown('<style>.dish-row { margin: 0 !important; padding: 0 !important; }</style>', unsafe_allow_html=True)
+            st.markdown('<div class="dish-row">', unsafe_allow_html=True)
+
+        with self._cols[position]:
+            image_slot = render_dish_card(item)
+        self.image_slots.append(image_slot)
+        return image_slot
+
+    def close(self):
+        """Close the open row and the grid container."""
+        if self._cols is not None:
+            st.markdown('</div>', unsafe_allow_html=True)
+        st.markdown('</div>', unsafe_allow_html=True)
+
+def render_results_header():
+    """Render the compact results heading and return the slot for the item count."""
+    st.markdown('<div class="results-header">', unsafe_allow_html=True)
+    st.markdown('<h3 style="margin:0; font-size:1.1rem; line-height:1.1;">🍽️ Discovered Menu Items</h3>', unsafe_allow_html=True)
+    count_slot = st.empty()
+    st.markdown('</div>', unsafe_allow_html=True)
+    return count_slot
+
+def show_results_header(count_slot, count, done=True):
+    """Render the discovered-items count into its slot."""
+    suffix = "" if done else " so far"
+    count_slot.markdown(f'<p class="results-count">Found <span class="highlight">{count}</span> items on the menu{suffix}</p>', unsafe_allow_html=True)
+
+def show_extraction_failure(extracted_text):
+    """Explain that no menu items could be extracted, showing the raw model output if there is any."""
+    if extracted_text:
+        st.markdown('<div class="warning-container">', unsafe_allow_html=True)
+        st.warning("Could not extract structured menu items. Here's the raw text:")
+        st.markdown('</div>', unsafe_allow_html=True)
+
+        with st.expander("Extracted Text", expanded=True):
+            st.markdown('<div class="extracted-text">', unsafe_allow_html=True)
+            st.text(extracted_text[:1000] + "..." if len(extracted_text) > 1000 else extracted_text)
+            st.markdown('</div>', unsafe_allow_html=True)
+    else:
+        st.markdown('<div class="error-container">', unsafe_allow_html=True)
+        st.error("Could not process the menu image. Please try a clearer photo.")
+        st.markdown('</div>', unsafe_allow_html=True)
+
+def report_upload(upload_slot, upload_future, wait=False):
+    """
+    Report the outcome of the background menu upload once it has finished.
+
+    Args:
+        upload_slot: The placeholder for the upload status.
+        upload_future: The Future returned by upload_image_in_background.
+        wait: Block until the upload finishes instead of returning while it is still running.
+
+    Returns:
+        True if the upload has finished (and was reported), False otherwise.
+    """
+    if not wait and not upload_future.done():
+        return False
+
+    try:
+        upload_future.result()
+        upload_slot.empty()
+    except Exception as e:
+        # The results do not depend on the stored copy, so a failed upload is only a warning
+        upload_slot.warning(f"Menu image could not be saved to storage: {e}")
+    return True
+
+@timed("render")
+def render_pipeline(items, count_slot, status_text=None, on_event=None, results=None):
+    """
+    Render dish cards and images from a MenuPipeline run.
+
+    Cards appear as the extraction stage publishes items and images fill in as the
+    generation stage finishes them, so extraction and generation overlap. With
+    PROGRESSIVE_DISH_IMAGES on, each card first shows a quick preview that the full
+    image replaces.
+
+    Args:
+        items: A callable returning the menu items (e.g. a streaming extraction).
+        count_slot: The placeholder for the discovered-items count.
+        status_text: An optional status placeholder, cleared when extraction ends.
+        on_event: An optional callable run after every event (e.g. to poll background work).
+        results: Optional MenuResults to record items and images in. Dishes it already
+            has images for are shown from memory instead of being generated again.
+
+    Returns:
+        The number of items rendered.
+    """
+    grid = DishGrid()
+    extraction_error = None
+    previewed = set()
+
+    if results is None:
+        pipeline = MenuPipeline(preview=request_dish_preview if PROGRESSIVE_DISH_IMAGES else None)
+    else:
+        pipeline = MenuPipeline(
+            generate=results.cached_generate(request_dish_image),
+            preview=results.cached_preview(request_dish_preview) if PROGRESSIVE_DISH_IMAGES else None
+        )
+
+    for event in pipeline.run(items):
+        if event.kind == "item":
+            grid.add(event.item)
+            if results is not None and not results.complete:
+                # Streaming: the items are recorded as they arrive
+                results.add_item(event.item)
+            show_results_header(count_slot, len(grid.image_slots), done=False)
+        elif event.kind == "preview":
+            show_dish_image(grid.image_slots[event.index], event.image_url, caption="Preview · full image on its way")
+            previewed.add(event.index)
+            if results is not None:
+                results.record_preview(event.index, event.image_url)
+        elif event.kind == "image":
+            # A failed full render keeps its preview rather than turning into an error
+            if event.image_url or event.index not in previewed:
+                show_dish_image(grid.image_slots[event.index], event.image_url)
+            if results is not None:
+                results.record_image(event.index, event.image_url)
+        elif event.kind == "error":
+            extraction_error = event.error
+        if on_event is not None:
+            on_event()
+
+    grid.close()
+    if status_text is not None:
+        status_text.empty()
+
+    if grid.image_slots:
+        show_results_header(count_slot, len(grid.image_slots))
+        if extraction_error is not None:
+            # Keep what was read; the caller reports a failure only when nothing was found
+            st.warning("Menu reading stopped early; some items may be missing.")
+
+    return len(grid.image_slots)
+
+def image_scheduler():
+    """Return the session's image scheduler, kept in session state so its images survive reruns."""
+    if "image_scheduler" not in st.session_state:
+        st.session_state.image_scheduler = ImageScheduler()
+    return st.session_state.image_scheduler
+
+def session_results():
+    """Return the session's results store, kept in session state so results survive reruns."""
+    if "results" not in st.session_state:
+        st.session_state.results = ResultsStore()
+    return st.session_state.results
+
+def gallery_page_count(results):
+    return max(1, math.ceil(len(results.dishes) / GALLERY_PAGE_SIZE))
+
+def change_gallery_page(results, step):
+    """Button callback: move the gallery by step pages (it runs before the rerun renders the new page)."""
+    results.page = max(0, min(results.page + step, gallery_page_count(results) - 1))
+
+@timed("render")
+def render_gallery(results, on_event=None):
+    """
+    Render one page of dish cards, generating images only for what is on screen.
+
+    The visible cards are requested first, in display order so the top rows fill in
+    first, and the next GALLERY_PREFETCH_PAGES pages are queued behind them. Paging
+    reruns the script; finished images come from the results store and queued ones
+    from the session's scheduler, so nothing is requested twice.
+
+    Args:
+        results: The MenuResults of the menu on screen (its page is the one shown).
+        on_event: An optional callable run after every image (e.g. to poll background work).
+    """
+    dishes = results.dishes
+    page_count = gallery_page_count(results)
+    page = min(results.page, page_count - 1)
+    start = page * GALLERY_PAGE_SIZE
+    visible = dishes[start:start + GALLERY_PAGE_SIZE]
+    scheduler = image_scheduler()
+
+    # Identical dishes share a future, so a future may fill several cards
+    positions = {}
+    for position, dish in enumerate(visible):
+        if dish.status != READY:
+            future = scheduler.request(*dish.key, priority=(0, position))
+            positions.setdefault(future, []).append(position)
+
+    for distance in range(1, GALLERY_PREFETCH_PAGES + 1):
+        offset = start + distance * GALLERY_PAGE_SIZE
+        for position, dish in enumerate(dishes[offset:offset + GALLERY_PAGE_SIZE]):
+            if dish.status != READY:
+                scheduler.request(*dish.key, priority=(distance, position))
+
+    grid = DishGrid()
+    image_slots = [grid.add(dish.item) for dish in visible]
+    grid.close()
+
+    for position, dish in enumerate(visible):
+        if dish.status == READY:
+            show_dish_image(image_slots[position], dish.image_url)
+
+    if page_count > 1:
+        prev_col, page_col, next_col = st.columns([1, 2, 1])
+        with prev_col:
+            st.button("← Previous", key="gallery_prev", disabled=page == 0, on_click=change_gallery_page, args=(results, -1))
+        with page_col:
+            st.markdown(f'<p class="results-count">Page {page + 1} of {page_count}</p>', unsafe_allow_html=True)
+        with next_col:
+            st.button("Next →", key="gallery_next", disabled=page == page_count - 1, on_click=change_gallery_page, args=(results, 1))
+
+    for future in as_completed(positions):
+        img_url = future.result() if future.exception() is None else None
+        for position in positions[future]:
+            show_dish_image(image_slots[position], img_url)
+            results.record_image(start + position, img_url)
+        if on_event is not None:
+            on_event()
+
+def render_results(results, count_slot, on_event=None):
+    """
+    Render the dishes of a menu, generating only the images that are missing or failed.
+
+    Args:
+        results: The MenuResults of the menu.
+        count_slot: The placeholder for the discovered-items count.
+        on_event: An optional callable run after every image (e.g. to poll background work).
+    """
+    if PAGINATED_GALLERY:
+        render_gallery(results, on_event=on_event)
+    elif CONCURRENT_IMAGE_GENERATION:
+        # Queue every dish for the generation workers and fill each card as its image arrives
+        render_pipeline(lambda: results.items, count_slot, on_event=on_event, results=results)
+    else:
+        # Display items in a grid
+        grid = DishGrid(num_cols=2)  # Adjust based on screen size
+        for index, dish in enumerate(results.dishes):
+            image_slot = grid.add(dish.item)
+            if dish.status != READY:
+                results.record_image(index, generate_dish_image(*dish.key))
+            show_dish_image(image_slot, dish.image_url if dish.status == READY else None)
+            if on_event is not None:
+                on_event()
+        grid.close()
 
 # --- Streamlit App ---
 
@@ -51,11 +364,8 @@ with col1:
     uploaded_file = st.file_uploader("", type=["jpg", "jpeg", "png"], key="menu_upload")
 
     if uploaded_file:
-        # Use a unique identifier for the upload session
-        session_id = uuid.uuid4()
-        original_filename = uploaded_file.name
-        # Create a unique filename for Supabase
-        supabase_filename = f"menu_uploads/{session_id}_{original_filename}"
+        # Menus are stored under the hash of their content, so reruns and repeat uploads reuse one object
+        supabase_folder = "menu_uploads"
 
         # Display the uploaded image with improved styling
         st.markdown('<div class="uploaded-image-container">', unsafe_allow_html=True)
@@ -100,9 +410,17 @@ with col1:
     st.markdown('<div class="footer">© 2025 MenuViz | Powered by AI</div>', unsafe_allow_html=True)
 
 with col2:
-    if uploaded_file and 'process_button' in locals() and process_button:
+    # Results of menus processed in this session survive reruns (widget interactions, page buttons, resizes)
+    menu_hash = hashlib.sha256(uploaded_file.getvalue()).hexdigest() if uploaded_file else None
+    stored_results = session_results().get(menu_hash) if menu_hash else None
+    if stored_results is not None and not stored_results.complete:
+        # A streaming extraction was cut short by a rerun; the menu is processed again
+        stored_results = None
+
+    if uploaded_file and 'process_button' in locals() and process_button and stored_results is None:
         # Read the file bytes
         image_bytes = uploaded_file.getvalue()
+        results = session_results().start(menu_hash)
 
         # Create a container for the processing section
         with st.container():
@@ -119,119 +437,86 @@ with col2:
                 # Initialize progress
                 progress = progress_placeholder.progress(0)
                 status_text.markdown('<p class="loading-animation">Initializing...</p>', unsafe_allow_html=True)
-                time.sleep(0.5)  # Small delay for better UX
 
-                # Step 1: Upload to Supabase
+                # Step 1: Store the menu in the background; extraction does not need the stored copy
+                upload_future = upload_image_in_background(image_bytes, supabase_folder, use_s3=USE_SUPABASE_S3, content_addressed=True)
                 progress.progress(10)
-                status_text.markdown('<p class="loading-animation">Uploading menu image...</p>', unsafe_allow_html=True)
-
-                # Check if S3 API should be used
-                use_s3_env = os.environ.get("USE_SUPABASE_S3", "").lower()
-                use_s3_secret = st.secrets.get("USE_SUPABASE_S3", "").lower()
-                use_s3 = use_s3_env == "true" or use_s3_secret == "true"
-
-                if use_s3:
-                    status_text.markdown('<p class="loading-animation">Using Supabase S3 API for storage...</p>', unsafe_allow_html=True)
-
-                # Upload the image
-                public_url = upload_image_to_supabase(image_bytes, supabase_filename, use_s3=use_s3)
-                progress.progress(30)
 
                 # Step 2: Extract menu items
                 status_text.markdown('<p class="loading-animation">Analyzing menu with AI...</p>', unsafe_allow_html=True)
-                extracted_text, structured_menu_items = extract_menu_text(image_bytes)
+                if MENU_STREAMING_EXTRACTION and not PAGINATED_GALLERY:
+                    # Items are extracted below, while their cards are being rendered
+                    menu_image_bytes = preprocess_menu_image(image_bytes)
+                    extracted_text, structured_menu_items = None, None
+                elif MENU_TILED_EXTRACTION:
+                    # Tiles are cut from the full-resolution upload and normalized one by one
+                    extracted_text, structured_menu_items = extract_menu_text(image_bytes, tiled=True)
+                else:
+                    # Orient, downscale and re-encode the photo so the extraction payload stays small
+                    menu_image_bytes = preprocess_menu_image(image_bytes)
+                    extracted_text, structured_menu_items = extract_menu_text(menu_image_bytes)
                 progress.progress(100)
 
                 # Clear progress indicators
-                time.sleep(0.5)  # Small delay for better UX
                 st.markdown('</div>', unsafe_allow_html=True)
                 progress_placeholder.empty()
                 status_text.empty()
 
+            # The upload may still be running; its outcome is reported here once known
+            upload_slot = st.empty()
+            report_upload(upload_slot, upload_future)
+            poll_upload = lambda: report_upload(upload_slot, upload_future)
+
             # Show results
-            if structured_menu_items:
+            if MENU_STREAMING_EXTRACTION and not PAGINATED_GALLERY:
+                # Create a compact header; the count updates as items stream in
+                count_slot = render_results_header()
+                stream_status = st.empty()
+                stream_status.markdown('<p class="loading-animation">Reading menu items...</p>', unsafe_allow_html=True)
+
+                # Create a container for the menu items with minimal spacing
+                parser = IncrementalItemParser()
+                with st.container():
+                    item_count = render_pipeline(lambda: stream_menu_items(menu_image_bytes, parser=parser), count_slot, stream_status, on_event=poll_upload, results=results)
+                extracted_text = parser.text
+
+                if item_count == 0:
+                    session_results().discard(menu_hash)
+                    count_slot.empty()
+                    show_extraction_failure(extracted_text)
+                else:
+                    results.extracted_text = extracted_text
+                    results.complete = True
+            elif structured_menu_items:
                 # Filter out invalid items first for accurate count
                 valid_items = [item for item in structured_menu_items if item.get("name") and item.get("name") != "Dish Name"]
+                results.set_items(valid_items, extracted_text)
 
                 # Create a compact header
-                st.markdown('<div class="results-header">', unsafe_allow_html=True)
-                st.markdown('<h3 style="margin:0; font-size:1.1rem; line-height:1.1;">🍽️ Discovered Menu Items</h3>', unsafe_allow_html=True)
-                st.markdown(f'<p class="results-count">Found <span class="highlight">{len(valid_items)}</span> items on the menu</p>', unsafe_allow_html=True)
-                st.markdown('</div>', unsafe_allow_html=True)
+                count_slot = render_results_header()
+                show_results_header(count_slot, len(valid_items))
 
                 # Create a container for the menu items with minimal spacing
-                menu_items_container = st.container()
-
-                with menu_items_container:
-                    # Display items in a grid
-                    num_cols = 2  # Adjust based on screen size
-
-                    # Filter out invalid items first
-                    valid_items = [item for item in structured_menu_items if item.get("name") and item.get("name") != "Dish Name"]
-
-                    # Create rows for the grid layout
-                    rows = [valid_items[i:i + num_cols] for i in range(0, len(valid_items), num_cols)]
-
-                    # Add a container for better grid styling
-                    st.markdown('<div class="menu-grid">', unsafe_allow_html=True)
-
-                    for row in rows:
-                        cols = st.columns(num_cols)
-                        # Add a custom class to remove vertical spacing
-                        st.markdown('<style>.dish-row { margin: 0 !important; padding: 0 !important; }</style>', unsafe_allow_html=True)
-                        st.markdown('<div class="dish-row">', unsafe_allow_html=True)
-                        for i, item in enumerate(row):
-                            name = item.get("name", "N/A")
-                            description = item.get("description", "No description provided.")
-
-                            with cols[i]:
-                                # Generate image silently without showing loading message
-                                img_url = generate_dish_image(name, description)
-
-                                # Create a fixed-height card with proper spacing
-                                st.markdown('<div class="dish-card">', unsafe_allow_html=True)
-
-                                if img_url:
-                                    # Image container at the top of the card
-                                    st.markdown('<div class="dish-image-container">', unsafe_allow_html=True)
-                                    st.image(img_url, use_container_width=True)
-                                    st.markdown('</div>', unsafe_allow_html=True)
-                                else:
-                                    st.markdown('<div class="image-error">Could not generate image</div>', unsafe_allow_html=True)
-
-                                # Content container for title and description
-                                st.markdown('<div class="dish-content">', unsafe_allow_html=True)
-
-                                # Display dish name
-                                st.markdown(f'<h4 class="dish-name">{name}</h4>', unsafe_allow_html=True)
-
-                                # Display dish description
-                                st.markdown(f'<p class="dish-description">{description}</p>', unsafe_allow_html=True)
-
-                                st.markdown('</div>', unsafe_allow_html=True)
-                                st.markdown('</div>', unsafe_allow_html=True)
-
-                        # Close the dish-row div
-                        st.markdown('</div>', unsafe_allow_html=True)
-
-                    # Close the menu grid container
-                    st.markdown('</div>', unsafe_allow_html=True)
+                with st.container():
+                    render_results(results, count_slot, on_event=poll_upload)
             else:
-                if extracted_text:
-                    st.markdown('<div class="warning-container">', unsafe_allow_html=True)
-                    st.warning("Could not extract structured menu items. Here's the raw text:")
-                    st.markdown('</div>', unsafe_allow_html=True)
-
-                    with st.expander("Extracted Text", expanded=True):
-                        st.markdown('<div class="extracted-text">', unsafe_allow_html=True)
-                        st.text(extracted_text[:1000] + "..." if len(extracted_text) > 1000 else extracted_text)
-                        st.markdown('</div>', unsafe_allow_html=True)
-                else:
-                    st.markdown('<div class="error-container">', unsafe_allow_html=True)
-                    st.error("Could not process the menu image. Please try a clearer photo.")
-                    st.markdown('</div>', unsafe_allow_html=True)
+                # Nothing to keep; pressing the button again retries the extraction
+                session_results().discard(menu_hash)
+                show_extraction_failure(extracted_text)
+
+            # Make sure the upload has finished before the run ends
+            report_upload(upload_slot, upload_future, wait=True)
 
             st.markdown('</div>', unsafe_allow_html=True)
+    elif stored_results is not None:
+        # A rerun: show the stored results, generating only the images still missing or failed
+        with st.container():
+            st.markdown('<div class="menu-card results-card">', unsafe_allow_html=True)
+            count_slot = render_results_header()
+            show_results_header(count_slot, len(stored_results.dishes))
+            with st.container():
+                render_results(stored_results, count_slot)
+            st.markdown('</div>', unsafe_allow_html=True)
     else:
         # Show a placeholder when no file is uploaded
         # Display an illustration or placeholder image
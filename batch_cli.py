@@ -0,0 +1,346 @@
+"""
+Headless batch processing of menu photos.
+
+Runs the same extraction, image generation and storage steps as the Streamlit app
+over a directory or manifest of menu images, and appends one JSON line per menu to
+an output manifest. The output doubles as the checkpoint: rerunning the same command
+after an interruption skips every menu that already completed.
+
+Usage:
+    python batch_cli.py menus/ --output results.jsonl --workers 4
+    python batch_cli.py manifest.txt --output results.jsonl --no-images
+"""
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import threading
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Dict, List, Optional, Set
+
+# Optional: Load environment variables from .env file for local development
+from dotenv import load_dotenv
+load_dotenv()
+
+from ai_utils import extract_menu_items, request_dish_image
+from image_utils import preprocess_menu_image
+from pipeline import MenuPipeline
+from supabase_utils import upload_image_in_background, USE_SUPABASE_S3
+from metrics import render_prometheus, start_metrics_server
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+
+# --- Inputs ---
+
+def collect_inputs(source: str) -> List[str]:
+    """
+    Lists the menu images to process.
+
+    Args:
+        source: A directory (searched recursively for images), or a manifest file with
+            one path per line, or JSON lines with a "path" key. Relative manifest paths
+            are resolved against the manifest's directory.
+
+    Returns:
+        The image paths, in a stable order.
+    """
+    if os.path.isdir(source):
+        paths = []
+        for root, _, files in os.walk(source):
+            for name in files:
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    paths.append(os.path.join(root, name))
+        return sorted(paths)
+
+    base_dir = os.path.dirname(os.path.abspath(source))
+    paths = []
+    with open(source, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            path = json.loads(line)["path"] if line.startswith("{") else line
+            paths.append(path if os.path.isabs(path) else os.path.join(base_dir, path))
+    return paths
+
+def load_completed(output_path: str, retry_failed: bool) -> Set[str]:
+    """
+    Reads the content hashes of menus already recorded in the output manifest.
+
+    Args:
+        output_path: The JSONL output (and checkpoint) file.
+        retry_failed: Whether failed menus, and menus with missing dish images,
+            should be processed again.
+
+    Returns:
+        The SHA-256 digests of menus to skip.
+    """
+    completed = set()
+    if not os.path.exists(output_path):
+        return completed
+
+    with open(output_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # A line cut short by an interruption; that menu is simply processed again
+                continue
+            if record.get("status") == "ok" or not retry_failed:
+                completed.add(record.get("sha256"))
+    return completed
+
+# --- Output ---
+
+class ManifestWriter:
+    """Appends JSON records to the output manifest, one flushed line per menu, from any thread."""
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._file = open(path, "a", encoding="utf-8")
+        self._lock = threading.Lock()
+
+    def write(self, record: Dict) -> None:
+        line = json.dumps(record, ensure_ascii=False)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+            # Each completed menu must survive a crash, since it will not be processed again
+            os.fsync(self._file.fileno())
+
+    def close(self) -> None:
+        self._file.close()
+
+# --- Processing ---
+
+class BatchAborted(KeyboardInterrupt):
+    """Raised when a second interruption abandons the menus still in progress."""
+
+def process_menu(
+    path: str,
+    image_bytes: bytes,
+    digest: str,
+    generate_images: bool,
+    image_workers: int,
+    upload: bool,
+    tiled: bool
+) -> Dict:
+    """
+    Runs one menu through extraction, image generation and storage.
+
+    Args:
+        path: The source path (recorded in the output).
+        image_bytes: The menu image data as bytes.
+        digest: The SHA-256 of image_bytes.
+        generate_images: Whether to generate an image for every dish.
+        image_workers: The number of concurrent image requests for this menu.
+        upload: Whether to store the menu image in Supabase.
+        tiled: Whether to extract overlapping tiles (for large, multi-column menus).
+
+    Returns:
+        The output record for the menu; its status is "ok", "partial" (some dish
+        images failed) or "error".
+    """
+    started = time.monotonic()
+    record = {"source": path, "sha256": digest, "status": "ok", "menu_url": None, "items": [], "image_errors": 0, "error": None}
+
+    try:
+        # Store the menu while it is being extracted, as the app does
+        upload_future = upload_image_in_background(image_bytes, "menu_uploads", use_s3=USE_SUPABASE_S3, content_addressed=True) if upload else None
+
+        try:
+            extraction_bytes = image_bytes if tiled else preprocess_menu_image(image_bytes)
+            _, items = extract_menu_items(extraction_bytes, tiled=tiled)
+            if not items:
+                raise ValueError("no menu items could be extracted" + (" (unparseable model output)" if items is None else ""))
+
+            items = [dict(item) for item in items]
+            if generate_images:
+                for event in MenuPipeline(generate=request_dish_image, generation_workers=image_workers).run(lambda: items):
+                    if event.kind == "item":
+                        record["items"].append(event.item)
+                    elif event.kind == "image":
+                        record["items"][event.index]["image_url"] = event.image_url
+                        if event.image_url is None:
+                            record["image_errors"] += 1
+                    elif event.kind == "error":
+                        raise event.error
+                if record["image_errors"]:
+                    # Kept, but retried with --retry-failed so the missing images get filled in
+                    record["status"] = "partial"
+            else:
+                record["items"] = [item for item in items if item.get("name") and item.get("name") != "Dish Name"]
+        finally:
+            if upload_future is not None:
+                try:
+                    record["menu_url"] = upload_future.result()
+                except Exception as e:
+                    # Results do not depend on the stored copy; note the failure and keep them
+                    record["upload_error"] = str(e)
+    except Exception as e:
+        record["status"] = "error"
+        record["error"] = f"{type(e).__name__}: {e}"
+
+    record["elapsed"] = round(time.monotonic() - started, 3)
+    record["processed_at"] = datetime.now(timezone.utc).isoformat()
+    return record
+
+def run_batch(
+    paths: List[str],
+    writer: ManifestWriter,
+    completed: Set[str],
+    workers: int,
+    generate_images: bool,
+    image_workers: int,
+    upload: bool,
+    tiled: bool,
+    limit: Optional[int] = None
+) -> Dict[str, int]:
+    """
+    Processes menus concurrently, skipping those already completed.
+
+    Returns:
+        Counts of "ok", "partial", "error" and "skipped" menus.
+    """
+    counts = {"ok": 0, "partial": 0, "error": 0, "skipped": 0}
+    workers = max(1, workers)
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="batch-menu")
+    # Only a couple of menus per worker are read ahead, so memory stays flat for any batch size
+    max_pending = workers * 2
+    pending = {}
+    finished = 0
+
+    def collect(return_when) -> None:
+        nonlocal finished
+        done, _ = wait(pending, return_when=return_when)
+        for future in done:
+            path = pending.pop(future)
+            record = future.result()
+            writer.write(record)
+            counts[record["status"]] += 1
+            finished += 1
+            if record["status"] == "ok":
+                detail = f"{len(record['items'])} items"
+            elif record["status"] == "partial":
+                detail = f"{len(record['items'])} items, {record['image_errors']} images failed"
+            else:
+                detail = record["error"]
+            print(f"[{finished}] {record['status']:7} {path} ({detail}, {record['elapsed']}s)", file=sys.stderr)
+
+    try:
+        submitted = 0
+        for path in paths:
+            if limit is not None and submitted >= limit:
+                break
+
+            try:
+                with open(path, "rb") as f:
+                    image_bytes = f.read()
+            except OSError as e:
+                writer.write({"source": path, "sha256": None, "status": "error", "error": f"{type(e).__name__}: {e}"})
+                counts["error"] += 1
+                continue
+
+            # Menus are identified by content, so renamed or duplicated files are skipped too
+            digest = hashlib.sha256(image_bytes).hexdigest()
+            if digest in completed:
+                counts["skipped"] += 1
+                continue
+            completed.add(digest)
+
+            if len(pending) >= max_pending:
+                collect(FIRST_COMPLETED)
+            pending[executor.submit(process_menu, path, image_bytes, digest, generate_images, image_workers, upload, tiled)] = path
+            submitted += 1
+
+        while pending:
+            collect(FIRST_COMPLETED)
+    except KeyboardInterrupt:
+        # Drop queued menus; they are picked up again on the next run
+        for future in list(pending):
+            if future.cancel():
+                del pending[future]
+        if not pending:
+            raise
+        # Menus already being processed are finished and recorded, so their work is not lost
+        print(f"Interrupted; finishing {len(pending)} menus in progress (press Ctrl-C again to abort them)...", file=sys.stderr)
+        try:
+            while pending:
+                collect(FIRST_COMPLETED)
+        except KeyboardInterrupt:
+            raise BatchAborted() from None
+        raise
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    return counts
+
+# --- Entry Point ---
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Extract dishes and generate images for a batch of menu photos.")
+    parser.add_argument("source", help="A directory of menu images, or a manifest listing one image path per line (or JSON lines with a \"path\" key)")
+    parser.add_argument("-o", "--output", default="menuviz_results.jsonl", help="JSONL output manifest; also the checkpoint for resuming (default: %(default)s)")
+    parser.add_argument("-w", "--workers", type=int, default=4, help="Menus processed concurrently (default: %(default)s)")
+    parser.add_argument("--image-workers", type=int, default=4, help="Concurrent image requests per menu (default: %(default)s)")
+    parser.add_argument("--no-images", action="store_true", help="Only extract menu items; do not generate dish images")
+    parser.add_argument("--no-upload", action="store_true", help="Do not store menu images in Supabase")
+    parser.add_argument("--tiled", action="store_true", help="Extract overlapping tiles (for large, multi-column menus)")
+    parser.add_argument("--retry-failed", action="store_true", help="Process menus recorded as failed or partial (missing dish images) again")
+    parser.add_argument("--limit", type=int, default=None, help="Process at most this many new menus")
+    parser.add_argument("--metrics", default=None, help="Write per-stage latency metrics in Prometheus text format to this file when done")
+    return parser.parse_args(argv)
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+
+    try:
+        paths = collect_inputs(args.source)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Could not read inputs from {args.source}: {e}", file=sys.stderr)
+        return 2
+
+    # Long batches can be scraped while running when METRICS_PORT is set
+    start_metrics_server()
+
+    completed = load_completed(args.output, args.retry_failed)
+    writer = ManifestWriter(args.output)
+    print(f"Found {len(paths)} menu images; {len(completed)} already recorded in {args.output}", file=sys.stderr)
+
+    interrupted = None
+    try:
+        counts = run_batch(
+            paths,
+            writer,
+            completed,
+            workers=args.workers,
+            generate_images=not args.no_images,
+            image_workers=args.image_workers,
+            upload=not args.no_upload,
+            tiled=args.tiled,
+            limit=args.limit
+        )
+    except KeyboardInterrupt as e:
+        interrupted = e
+    finally:
+        writer.close()
+        if args.metrics:
+            with open(args.metrics, "w", encoding="utf-8") as f:
+                f.write(render_prometheus())
+
+    if interrupted is not None:
+        print("Interrupted; rerun the same command to resume.", file=sys.stderr)
+        if isinstance(interrupted, BatchAborted):
+            # Abandoned menus keep running on worker threads that would hold the process open
+            sys.stderr.flush()
+            os._exit(130)
+        return 130
+
+    print(f"Done: {counts['ok']} ok, {counts['partial']} partial, {counts['error']} failed, {counts['skipped']} skipped", file=sys.stderr)
+    return 1 if counts["error"] or counts["partial"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,267 @@
+"""
+Offline end-to-end benchmark of the menu pipeline.
+
+Starts local Groq, Together AI and S3 stubs, points the app's settings at them and
+drives menu extraction, dish image generation and storage at several concurrency
+levels and menu sizes. Results (throughput and latency percentiles per run) are
+written as JSON, so runs can be compared to catch regressions.
+
+Usage (from the repository root):
+    python -m benchmarks.run --concurrency 1,4,16 --menu-sizes 10,40 --output bench.json
+"""
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+from PIL import Image
+
+from benchmarks.stubs import StubBehavior, start_groq_stub, start_together_stub, start_s3_stub
+
+SCENARIOS = ("extract", "generate", "storage", "menu")
+
+# --- Environment ---
+
+def configure_environment(groq_url: str, together_url: str, s3_url: str, work_dir: str, rehost: bool) -> None:
+    """
+    Points every setting at the stubs. Must run before the app modules are imported,
+    since settings are read once on first use.
+    """
+    os.environ.update({
+        "GROQ_API_KEY": "bench",
+        "GROQ_BASE_URL": groq_url,
+        "TOGETHER_API_KEY": "bench",
+        "TOGETHER_BASE_URL": f"{together_url}/v1",
+        "SUPABASE_URL": s3_url,
+        "SUPABASE_ANON_KEY": "bench",
+        "S3_ENDPOINT": s3_url,
+        "S3_ACCESS_KEY_ID": "bench",
+        "S3_SECRET_ACCESS_KEY": "bench",
+        "USE_SUPABASE_S3": "true",
+        "IMAGE_CACHE_DIR": os.path.join(work_dir, "dish_images"),
+        "MENU_INDEX_PATH": os.path.join(work_dir, "menu_index.jsonl"),
+        "REHOST_DISH_IMAGES": "true" if rehost else "false",
+        "METRICS_PORT": "0",
+    })
+    # The stubs have no quotas; lift the provider budgets unless explicitly set
+    for name, value in (("GROQ_RPM", "1000000"), ("GROQ_TPM", "1000000000"), ("TOGETHER_RPM", "1000000")):
+        os.environ.setdefault(name, value)
+
+# --- Measurement ---
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """Nearest-rank percentile, or None for no values."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+def summarize(latencies: List[float]) -> Dict:
+    return {
+        "p50": percentile(latencies, 0.5),
+        "p95": percentile(latencies, 0.95),
+        "p99": percentile(latencies, 0.99),
+        "mean": sum(latencies) / len(latencies) if latencies else None,
+        "max": max(latencies) if latencies else None,
+    }
+
+def run_concurrently(operations: List[Callable[[], bool]], concurrency: int) -> Dict:
+    """
+    Runs operations on `concurrency` threads and measures each one.
+
+    Each operation returns True on success; exceptions count as errors.
+    """
+    def measure(operation) -> tuple:
+        started = time.perf_counter()
+        try:
+            ok = bool(operation())
+        except Exception:
+            ok = False
+        return time.perf_counter() - started, ok
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        outcomes = list(executor.map(measure, operations))
+    elapsed = time.perf_counter() - started
+
+    latencies = [latency for latency, ok in outcomes if ok]
+    return {
+        "operations": len(outcomes),
+        "errors": sum(1 for _, ok in outcomes if not ok),
+        "duration_s": elapsed,
+        "throughput_ops_s": len(latencies) / elapsed if elapsed else None,
+        "latency_s": summarize(latencies),
+    }
+
+# --- Inputs ---
+
+def menu_photo(size: int = 768) -> bytes:
+    """A random photo-sized image; every call differs, so the near-duplicate index never answers."""
+    image = Image.frombytes("L", (size, size), os.urandom(size * size)).convert("RGB")
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=85)
+    return buffer.getvalue()
+
+def unique_dishes(count: int, run_id: str) -> List[Dict]:
+    return [{"name": f"Bench dish {run_id}-{i}", "description": "Slow-roasted with herbs and a lemon glaze"} for i in range(count)]
+
+# --- Scenarios ---
+
+def bench_extract(concurrency: int, menus: int) -> Dict:
+    from ai_utils import extract_menu_items
+    from image_utils import preprocess_menu_image
+
+    photos = [menu_photo() for _ in range(menus)]
+
+    def extract(photo: bytes) -> bool:
+        _, items = extract_menu_items(preprocess_menu_image(photo))
+        return bool(items)
+
+    return run_concurrently([lambda photo=photo: extract(photo) for photo in photos], concurrency)
+
+def bench_generate(concurrency: int, menu_size: int, run_id: str) -> Dict:
+    from ai_utils import request_dish_image
+
+    dishes = unique_dishes(menu_size, run_id)
+    return run_concurrently(
+        [lambda dish=dish: request_dish_image(dish["name"], dish["description"]) is not None for dish in dishes],
+        concurrency
+    )
+
+def bench_storage(concurrency: int, operations: int, object_bytes: int) -> Dict:
+    from supabase_utils import store_image
+
+    payloads = [os.urandom(object_bytes) for _ in range(operations)]
+    return run_concurrently(
+        [lambda data=data: bool(store_image(data, "bench", use_s3=True, content_addressed=True)) for data in payloads],
+        concurrency
+    )
+
+def bench_menu(concurrency: int, menus: int) -> Dict:
+    """Full menus: extract, then generate every dish through the app's pipeline with `concurrency` image workers."""
+    from ai_utils import extract_menu_items
+    from image_utils import preprocess_menu_image
+    from pipeline import MenuPipeline
+
+    first_image_latencies = []
+    image_errors = 0
+
+    def process(photo: bytes) -> bool:
+        nonlocal image_errors
+        started = time.perf_counter()
+        _, items = extract_menu_items(preprocess_menu_image(photo))
+        if not items:
+            return False
+        first = None
+        for event in MenuPipeline(generation_workers=concurrency).run(lambda: items):
+            if event.kind != "image":
+                continue
+            if first is None:
+                first = time.perf_counter() - started
+            if event.image_url is None:
+                image_errors += 1
+        first_image_latencies.append(first)
+        return True
+
+    # Menus run one after another, as a single session would
+    result = run_concurrently([lambda photo=menu_photo(): process(photo) for _ in range(menus)], 1)
+    result["image_errors"] = image_errors
+    result["time_to_first_image_s"] = summarize([latency for latency in first_image_latencies if latency is not None])
+    return result
+
+# --- Entry Point ---
+
+def _int_list(value: str) -> List[int]:
+    return [int(part) for part in value.split(",") if part.strip()]
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark the menu pipeline against local provider stubs.")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="Comma-separated scenarios to run: %(default)s")
+    parser.add_argument("--concurrency", type=_int_list, default=[1, 4, 16], help="Comma-separated concurrency levels (default: 1,4,16)")
+    parser.add_argument("--menu-sizes", type=_int_list, default=[10, 40], help="Comma-separated dishes per menu (default: 10,40)")
+    parser.add_argument("--menus", type=int, default=8, help="Menus extracted per extract run (default: %(default)s)")
+    parser.add_argument("--storage-ops", type=int, default=50, help="Objects stored per storage run (default: %(default)s)")
+    parser.add_argument("--object-bytes", type=int, default=200_000, help="Size of each stored object (default: %(default)s)")
+    parser.add_argument("--groq-latency", default="lognormal:0.4,0.4", help="Groq stub latency spec (default: %(default)s)")
+    parser.add_argument("--together-latency", default="lognormal:0.6,0.3", help="Together stub latency spec (default: %(default)s)")
+    parser.add_argument("--s3-latency", default="lognormal:0.02,0.5", help="S3 stub latency spec (default: %(default)s)")
+    parser.add_argument("--groq-error-rate", type=float, default=0.02, help="Fraction of failed Groq requests (default: %(default)s)")
+    parser.add_argument("--together-error-rate", type=float, default=0.02, help="Fraction of failed Together requests (default: %(default)s)")
+    parser.add_argument("--s3-error-rate", type=float, default=0.0, help="Fraction of failed S3 requests (default: %(default)s)")
+    parser.add_argument("--error-status", type=int, default=429, help="HTTP status of injected failures (default: %(default)s)")
+    parser.add_argument("--no-rehost", action="store_true", help="Return provider URLs instead of rehosting generated images")
+    parser.add_argument("-o", "--output", default=None, help="Write the JSON report here instead of stdout")
+    return parser.parse_args(argv)
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        print(f"Unknown scenarios: {', '.join(sorted(unknown))}", file=sys.stderr)
+        return 2
+
+    try:
+        groq_stub = start_groq_stub(StubBehavior(args.groq_latency, args.groq_error_rate, args.error_status))
+        together_stub = start_together_stub(StubBehavior(args.together_latency, args.together_error_rate, args.error_status))
+        s3_stub = start_s3_stub(StubBehavior(args.s3_latency, args.s3_error_rate, args.error_status))
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 2
+
+    work_dir = tempfile.mkdtemp(prefix="menuviz-bench-")
+    configure_environment(groq_stub.url, together_stub.url, s3_stub.url, work_dir, rehost=not args.no_rehost)
+
+    # Imported only now, so the settings pick up the stub endpoints
+    import metrics
+
+    results = []
+    run_number = 0
+    for scenario in scenarios:
+        sizes = args.menu_sizes if scenario in ("generate", "menu") else [None]
+        for menu_size in sizes:
+            for concurrency in args.concurrency:
+                run_number += 1
+                if menu_size is not None:
+                    groq_stub.handler.menu_size = menu_size
+                print(f"{scenario}: concurrency={concurrency} menu_size={menu_size}", file=sys.stderr)
+
+                if scenario == "extract":
+                    result = bench_extract(concurrency, args.menus)
+                elif scenario == "generate":
+                    result = bench_generate(concurrency, menu_size, str(run_number))
+                elif scenario == "storage":
+                    result = bench_storage(concurrency, args.storage_ops, args.object_bytes)
+                else:
+                    result = bench_menu(concurrency, max(1, args.menus // 4))
+                results.append({"scenario": scenario, "concurrency": concurrency, "menu_size": menu_size, **result})
+
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        "stubs": {"groq": groq_stub.behavior.stats(), "together": together_stub.behavior.stats(), "s3": s3_stub.behavior.stats()},
+        "results": results,
+        "stage_metrics": metrics.snapshot(),
+    }
+
+    for stub in (groq_stub, together_stub, s3_stub):
+        stub.stop()
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
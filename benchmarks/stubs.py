@@ -0,0 +1,414 @@
+"""
+Local stand-ins for the Groq, Together AI and S3 endpoints the pipeline talks to.
+
+Each stub is a threaded HTTP server on 127.0.0.1 that answers with realistic
+payloads after a sampled delay, and fails a configurable fraction of requests
+(429 with a retry-after-ms header by default, so the rate limiter's retry path
+is exercised too).
+"""
+import io
+import json
+import math
+import random
+import threading
+import time
+import uuid
+from email.utils import formatdate
+from hashlib import md5
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+from xml.sax.saxutils import escape
+
+from PIL import Image
+
+# --- Latency and Errors ---
+
+def parse_latency(spec: str) -> Callable[[], float]:
+    """
+    Builds a delay sampler (in seconds) from a spec string.
+
+    Supported specs:
+        fixed:<seconds>
+        uniform:<low>,<high>
+        lognormal:<median>,<sigma>   (long-tailed, like real API latency)
+        normal:<mean>,<stddev>       (clipped at zero)
+
+    Raises:
+        ValueError: If the spec is malformed or the distribution is unknown.
+    """
+    kind, _, args = spec.partition(":")
+    try:
+        values = [float(value) for value in args.split(",") if value.strip()]
+    except ValueError:
+        raise ValueError(f"Invalid latency spec: {spec}")
+
+    if kind == "fixed" and len(values) == 1:
+        return lambda: values[0]
+    if kind == "uniform" and len(values) == 2:
+        return lambda: random.uniform(values[0], values[1])
+    if kind == "lognormal" and len(values) == 2:
+        mu = math.log(values[0]) if values[0] > 0 else 0.0
+        return lambda: random.lognormvariate(mu, values[1]) if values[0] > 0 else 0.0
+    if kind == "normal" and len(values) == 2:
+        return lambda: max(0.0, random.gauss(values[0], values[1]))
+    raise ValueError(f"Invalid latency spec: {spec}")
+
+
+class StubBehavior:
+    """
+    Latency and failure settings of one stub.
+
+    Args:
+        latency: A latency spec (see parse_latency).
+        error_rate: The fraction of requests (0-1) answered with error_status.
+        error_status: The HTTP status of injected failures.
+        retry_after: The retry-after-ms sent with injected 429s, in seconds (None for no header).
+    """
+
+    def __init__(self, latency: str = "fixed:0", error_rate: float = 0.0, error_status: int = 429, retry_after: Optional[float] = 0.05):
+        self.latency = latency
+        self.sample_latency = parse_latency(latency)
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.retry_after = retry_after
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+
+    def next_outcome(self) -> Tuple[float, bool]:
+        """Returns the delay and whether to fail, for one request."""
+        failed = random.random() < self.error_rate
+        with self._lock:
+            self.requests += 1
+            if failed:
+                self.errors += 1
+        return self.sample_latency(), failed
+
+    def stats(self) -> Dict:
+        return {"latency": self.latency, "error_rate": self.error_rate, "requests": self.requests, "injected_errors": self.errors}
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive, as the real endpoints allow
+    behavior: StubBehavior
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_body(self) -> bytes:
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _send(self, status: int, body: bytes = b"", content_type: str = "application/json", headers: Optional[Dict[str, str]] = None) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _send_json(self, status: int, payload) -> None:
+        self._send(status, json.dumps(payload).encode("utf-8"))
+
+    def _simulate(self) -> bool:
+        """Sleeps for the sampled latency; answers with the injected error and returns False if this request fails."""
+        delay, failed = self.behavior.next_outcome()
+        time.sleep(delay)
+        if not failed:
+            return True
+
+        headers = {}
+        if self.behavior.error_status == 429 and self.behavior.retry_after is not None:
+            headers["retry-after-ms"] = str(int(self.behavior.retry_after * 1000))
+        body = json.dumps({"error": {"message": "Injected failure", "type": "stub_error"}}).encode("utf-8")
+        self._send(self.behavior.error_status, body, headers=headers)
+        return False
+
+# --- Groq ---
+
+def _menu_items(count: int) -> list:
+    return [
+        {"name": f"Dish {uuid.uuid4().hex[:8]}", "description": f"House special number {i + 1} with seasonal vegetables"}
+        for i in range(count)
+    ]
+
+
+class _GroqHandler(_StubHandler):
+    """OpenAI-compatible /openai/v1/chat/completions, with and without streaming."""
+
+    menu_size = 20
+
+    def do_POST(self):
+        request = json.loads(self._read_body() or b"{}")
+        if not self._simulate():
+            return
+
+        # Fresh dish names per request, so downstream image caches never short-circuit the benchmark
+        content = json.dumps({"items": _menu_items(self.menu_size)})
+        created = int(time.time())
+        model = request.get("model", "stub")
+
+        if not request.get("stream"):
+            self._send_json(200, {
+                "id": f"chatcmpl-{uuid.uuid4().hex}",
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 1500, "completion_tokens": len(content) // 4, "total_tokens": 1500 + len(content) // 4},
+            })
+            return
+
+        # Server-sent events, a few dozen characters per chunk like the real API
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def write_event(data: str) -> None:
+            event = f"data: {data}\n\n".encode("utf-8")
+            self.wfile.write(f"{len(event):x}\r\n".encode("ascii") + event + b"\r\n")
+
+        for start in range(0, len(content), 48):
+            write_event(json.dumps({
+                "id": "chatcmpl-stub",
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": {"content": content[start:start + 48]}, "finish_reason": None}],
+            }))
+        write_event("[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+
+# --- Together AI ---
+
+def _sample_image(width: int = 1024, height: int = 768) -> bytes:
+    """A photo-sized JPEG with enough detail that re-encoding it costs about what a real one does."""
+    image = Image.effect_mandelbrot((width, height), (-2.0, -1.2, 1.0, 1.2), 60).convert("RGB")
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=90)
+    return buffer.getvalue()
+
+
+class _TogetherHandler(_StubHandler):
+    """/v1/images/generations, returning URLs that this stub also serves."""
+
+    image_bytes = b""
+
+    def do_POST(self):
+        self._read_body()
+        if not self.path.rstrip("/").endswith("/images/generations"):
+            self._send_json(404, {"error": {"message": "Not found"}})
+            return
+        if not self._simulate():
+            return
+
+        host, port = self.server.server_address[:2]
+        self._send_json(200, {
+            "id": uuid.uuid4().hex,
+            "object": "list",
+            "data": [{"index": 0, "url": f"http://{host}:{port}/images/{uuid.uuid4().hex}.jpg"}],
+        })
+
+    def do_GET(self):
+        if not self.path.startswith("/images/"):
+            self._send_json(404, {"error": {"message": "Not found"}})
+            return
+        self._send(200, self.image_bytes, content_type="image/jpeg")
+
+# --- S3 ---
+
+def _decode_aws_chunked(body: bytes) -> bytes:
+    """Strips the aws-chunked framing (and trailing checksums) newer botocore versions send."""
+    data = bytearray()
+    position = 0
+    while position < len(body):
+        line_end = body.index(b"\r\n", position)
+        size = int(body[position:line_end].split(b";")[0], 16)
+        if size == 0:
+            break
+        start = line_end + 2
+        data += body[start:start + size]
+        position = start + size + 2
+    return bytes(data)
+
+
+class _S3Handler(_StubHandler):
+    """Path-style S3 subset used by s3_utils: buckets, objects, listing and bulk delete."""
+
+    buckets: Dict[str, Dict[str, Tuple[bytes, str, float]]] = {}
+    lock = threading.Lock()
+
+    def _location(self) -> Tuple[str, str, Dict]:
+        parts = urlsplit(self.path)
+        bucket, _, key = parts.path.lstrip("/").partition("/")
+        return bucket, key, parse_qs(parts.query, keep_blank_values=True)
+
+    def _object_headers(self, data: bytes, content_type: str, modified: float) -> Dict[str, str]:
+        return {
+            "ETag": f'"{md5(data).hexdigest()}"',
+            "Last-Modified": formatdate(modified, usegmt=True),
+            "X-Stub-Content-Type": content_type,
+        }
+
+    def _no_such(self, code: str) -> None:
+        body = f"<?xml version=\"1.0\"?><Error><Code>{code}</Code><Message>Not found</Message></Error>".encode("utf-8")
+        self._send(404, body, content_type="application/xml")
+
+    def do_HEAD(self):
+        bucket, key, _ = self._location()
+        if not self._simulate():
+            return
+        with self.lock:
+            objects = self.buckets.get(bucket)
+            stored = objects.get(key) if objects is not None and key else None
+        if objects is None or (key and stored is None):
+            self._send(404, content_type="application/xml")
+            return
+        if not key:
+            self._send(200, content_type="application/xml")
+            return
+        data, content_type, modified = stored
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in self._object_headers(data, content_type, modified).items():
+            self.send_header(name, value)
+        self.end_headers()
+
+    def do_GET(self):
+        bucket, key, query = self._location()
+        if not self._simulate():
+            return
+        with self.lock:
+            objects = self.buckets.get(bucket)
+            if objects is None:
+                self._no_such("NoSuchBucket")
+                return
+            if key:
+                stored = objects.get(key)
+            else:
+                listing = sorted((name, len(value[0]), value[2]) for name, value in objects.items())
+
+        if key:
+            if stored is None:
+                self._no_such("NoSuchKey")
+                return
+            data, content_type, modified = stored
+            self._send(200, data, content_type=content_type, headers=self._object_headers(data, content_type, modified))
+            return
+
+        prefix = query.get("prefix", [""])[0]
+        after = query.get("continuation-token", query.get("start-after", [""]))[0]
+        max_keys = int(query.get("max-keys", ["1000"])[0])
+        matching = [entry for entry in listing if entry[0].startswith(prefix) and entry[0] > after]
+        page, truncated = matching[:max_keys], len(matching) > max_keys
+
+        contents = "".join(
+            f"<Contents><Key>{escape(name)}</Key><Size>{size}</Size>"
+            f"<LastModified>{time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime(modified))}</LastModified>"
+            f"<ETag>&quot;stub&quot;</ETag><StorageClass>STANDARD</StorageClass></Contents>"
+            for name, size, modified in page
+        )
+        token = f"<NextContinuationToken>{escape(page[-1][0])}</NextContinuationToken>" if truncated else ""
+        body = (
+            f'<?xml version="1.0" encoding="UTF-8"?><ListBucketResult xmlns="http://s3.amazonaws.com/doc/2006-03-01/">'
+            f"<Name>{escape(bucket)}</Name><Prefix>{escape(prefix)}</Prefix><KeyCount>{len(page)}</KeyCount>"
+            f"<MaxKeys>{max_keys}</MaxKeys><IsTruncated>{'true' if truncated else 'false'}</IsTruncated>{token}{contents}"
+            f"</ListBucketResult>"
+        ).encode("utf-8")
+        self._send(200, body, content_type="application/xml")
+
+    def do_PUT(self):
+        bucket, key, query = self._location()
+        body = self._read_body()
+        if "aws-chunked" in (self.headers.get("Content-Encoding") or "") or \
+                (self.headers.get("x-amz-content-sha256") or "").startswith("STREAMING-"):
+            body = _decode_aws_chunked(body)
+        if not self._simulate():
+            return
+
+        with self.lock:
+            if not key:
+                if "policy" not in query:
+                    self.buckets.setdefault(bucket, {})
+                self._send(200, content_type="application/xml")
+                return
+            objects = self.buckets.get(bucket)
+            if objects is None:
+                self._no_such("NoSuchBucket")
+                return
+            content_type = self.headers.get("Content-Type") or "application/octet-stream"
+            objects[key] = (body, content_type, time.time())
+        self._send(200, content_type="application/xml", headers={"ETag": f'"{md5(body).hexdigest()}"'})
+
+    def do_DELETE(self):
+        bucket, key, _ = self._location()
+        if not self._simulate():
+            return
+        with self.lock:
+            self.buckets.get(bucket, {}).pop(key, None)
+        self._send(204, content_type="application/xml")
+
+    def do_POST(self):
+        bucket, _, query = self._location()
+        body = self._read_body()
+        if "delete" not in query:
+            self._send(501, content_type="application/xml")
+            return
+        if not self._simulate():
+            return
+
+        keys = [part.split("</Key>")[0] for part in body.decode("utf-8").split("<Key>")[1:]]
+        with self.lock:
+            objects = self.buckets.get(bucket, {})
+            for key in keys:
+                objects.pop(key, None)
+        deleted = "".join(f"<Deleted><Key>{key}</Key></Deleted>" for key in keys)
+        result = f'<?xml version="1.0" encoding="UTF-8"?><DeleteResult xmlns="http://s3.amazonaws.com/doc/2006-03-01/">{deleted}</DeleteResult>'
+        self._send(200, result.encode("utf-8"), content_type="application/xml")
+
+# --- Servers ---
+
+class StubServer:
+    """
+    One stub running on a free local port in a daemon thread.
+
+    Attributes:
+        url: The base URL of the stub (http://127.0.0.1:<port>).
+        behavior: Its latency and failure settings, with request counts.
+        handler: Its request handler class; class attributes such as menu_size
+            can be changed between runs.
+    """
+
+    def __init__(self, handler: type, behavior: StubBehavior, **attributes):
+        # Every stub gets its own handler subclass, so settings never leak between stubs
+        self.behavior = behavior
+        self.handler = type(handler.__name__, (handler,), {"behavior": behavior, **attributes})
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self.handler)
+        self._server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self._server.server_address[1]}"
+        self._thread = threading.Thread(target=self._server.serve_forever, name=f"stub-{handler.__name__}", daemon=True)
+
+    def start(self) -> "StubServer":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+def start_groq_stub(behavior: StubBehavior, menu_size: int = 20) -> StubServer:
+    """Starts a Groq chat completions stub answering with menu_size dishes."""
+    return StubServer(_GroqHandler, behavior, menu_size=menu_size).start()
+
+def start_together_stub(behavior: StubBehavior) -> StubServer:
+    """Starts a Together AI image generation stub that also serves the generated images."""
+    return StubServer(_TogetherHandler, behavior, image_bytes=_sample_image()).start()
+
+def start_s3_stub(behavior: StubBehavior, buckets=("menuviz",)) -> StubServer:
+    """Starts an in-memory, path-style S3 stub with the given buckets already created."""
+    return StubServer(_S3Handler, behavior, buckets={name: {} for name in buckets}, lock=threading.Lock()).start()
@@ -0,0 +1,267 @@
+"""
+Application settings.
+
+Every setting is read once, on first use, from the environment and then from
+Streamlit secrets. Secrets are only consulted when Streamlit is already loaded
+(i.e. inside the app), so batch jobs and worker processes never import it.
+"""
+import os
+import sys
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Optional, Tuple
+
+# --- Lookup Helpers ---
+
+def _secret(name: str):
+    streamlit = sys.modules.get("streamlit")
+    if streamlit is None:
+        return None
+    try:
+        return streamlit.secrets.get(name)
+    except Exception:
+        # No secrets file; only the environment applies
+        return None
+
+def _value(name: str, default=None):
+    """Returns a setting from the environment, then Streamlit secrets, then the default."""
+    value = os.environ.get(name) or _secret(name)
+    return default if value in (None, "") else value
+
+def _str(name: str, default: Optional[str] = None) -> Optional[str]:
+    value = _value(name, default)
+    return None if value is None else str(value)
+
+def _int(name: str, default: int) -> int:
+    return int(_value(name, default))
+
+def _float(name: str, default: float) -> float:
+    return float(_value(name, default))
+
+def _bool(name: str, default: bool) -> bool:
+    value = _value(name, default)
+    return value if isinstance(value, bool) else str(value).lower() == "true"
+
+def _list(name: str, default: str) -> Tuple[str, ...]:
+    return tuple(part.strip() for part in str(_value(name, default)).split(",") if part.strip())
+
+def project_ref(supabase_url: Optional[str]) -> str:
+    """Extracts the project reference from a Supabase URL (https://<ref>.supabase.co)."""
+    if not supabase_url:
+        return ""
+    return supabase_url.replace("https://", "").split(".")[0]
+
+# --- Settings ---
+
+@dataclass(frozen=True)
+class Settings:
+    """All configuration of the app, the batch CLI and their helpers."""
+
+    # Credentials
+    groq_api_key: Optional[str]
+    together_api_key: Optional[str]
+    supabase_url: Optional[str]
+    supabase_key: Optional[str]
+    s3_access_key_id: str
+    s3_secret_access_key: str
+    use_supabase_s3: bool
+
+    # Provider endpoints (can point at local stubs, e.g. for benchmarks)
+    groq_base_url: Optional[str]
+
+    # Together AI connection
+    together_base_url: str
+    together_pool_size: int
+    together_http2: bool
+
+    # Provider rate limits
+    groq_rpm: float
+    groq_tpm: float
+    groq_tokens_per_request: int
+    groq_max_concurrency: int
+    together_rpm: float
+    together_max_concurrency: int
+    rate_limit_max_retries: int
+    rate_limit_base_delay: float
+    rate_limit_max_delay: float
+
+    # Menu extraction
+    menu_tiled_extraction: bool
+    menu_tile_columns: int
+    menu_tile_rows: int
+    menu_tile_overlap: float
+    menu_tile_workers: int
+    menu_streaming_extraction: bool
+
+    # Menu photo normalization
+    menu_max_edge: int
+    menu_grayscale: bool
+    menu_image_format: str
+    menu_image_quality: int
+    menu_max_payload_bytes: int
+
+    # Near-duplicate menu index
+    menu_index_path: str
+    menu_hash_max_distance: int
+    menu_index_max_entries: int
+    menu_match_min_correlation: float
+
+    # Dish image generation
+    concurrent_image_generation: bool
+    image_generation_workers: int
+    progressive_dish_images: bool
+    preview_image_steps: int
+    preview_image_width: int
+    preview_image_height: int
+
+    # Paginated gallery
+    paginated_gallery: bool
+    gallery_page_size: int
+    gallery_prefetch_pages: int
+
+    # Per-session results
+    session_results_max_menus: int
+
+    # Dish image cache
+    image_cache_dir: str
+    image_cache_max_bytes: int
+    image_cache_ttl: int
+    image_cache_remote: bool
+
+    # Rehosted dish images
+    rehost_dish_images: bool
+    image_variant_widths: Tuple[int, ...]
+    image_variant_formats: Tuple[str, ...]
+    image_variant_quality: int
+    grid_image_width: int
+
+    # Extract -> generate pipeline
+    pipeline_queue_size: int
+    pipeline_generation_workers: int
+    pipeline_max_extractions: int
+    pipeline_max_generations: int
+
+    # Storage
+    bucket_cache_ttl: int
+    upload_workers: int
+
+    # Metrics
+    metrics_port: int
+    metrics_window: int
+
+    # S3 client
+    s3_endpoint: str
+    s3_region: str
+    s3_max_pool_connections: int
+    s3_max_attempts: int
+    s3_retry_mode: str
+    s3_connect_timeout: float
+    s3_read_timeout: float
+    s3_tcp_keepalive: bool
+    s3_client_registry_size: int
+    s3_multipart_part_size: int
+    s3_multipart_concurrency: int
+    s3_delete_concurrency: int
+
+    @classmethod
+    def load(cls) -> "Settings":
+        """Reads every setting from the environment and Streamlit secrets."""
+        supabase_url = _str("SUPABASE_URL")
+        image_generation_workers = _int("IMAGE_GENERATION_WORKERS", 8)
+
+        return cls(
+            groq_api_key=_str("GROQ_API_KEY"),
+            together_api_key=_str("TOGETHER_API_KEY"),
+            supabase_url=supabase_url,
+            supabase_key=_str("SUPABASE_ANON_KEY"),
+            s3_access_key_id=_str("S3_ACCESS_KEY_ID", ""),
+            s3_secret_access_key=_str("S3_SECRET_ACCESS_KEY", ""),
+            use_supabase_s3=_bool("USE_SUPABASE_S3", False),
+
+            groq_base_url=_str("GROQ_BASE_URL"),
+
+            together_base_url=_str("TOGETHER_BASE_URL", "https://api.together.xyz/v1").rstrip("/"),
+            together_pool_size=_int("TOGETHER_POOL_SIZE", 16),
+            together_http2=_bool("TOGETHER_HTTP2", False),
+
+            groq_rpm=_float("GROQ_RPM", 30),
+            groq_tpm=_float("GROQ_TPM", 30000),
+            groq_tokens_per_request=_int("GROQ_TOKENS_PER_REQUEST", 3000),
+            groq_max_concurrency=_int("GROQ_MAX_CONCURRENCY", 4),
+            together_rpm=_float("TOGETHER_RPM", 60),
+            together_max_concurrency=_int("TOGETHER_MAX_CONCURRENCY", 16),
+            rate_limit_max_retries=_int("RATE_LIMIT_MAX_RETRIES", 5),
+            rate_limit_base_delay=_float("RATE_LIMIT_BASE_DELAY", 0.5),
+            rate_limit_max_delay=_float("RATE_LIMIT_MAX_DELAY", 30),
+
+            menu_tiled_extraction=_bool("MENU_TILED_EXTRACTION", False),
+            menu_tile_columns=_int("MENU_TILE_COLUMNS", 2),
+            menu_tile_rows=_int("MENU_TILE_ROWS", 2),
+            menu_tile_overlap=_float("MENU_TILE_OVERLAP", 0.15),
+            menu_tile_workers=_int("MENU_TILE_WORKERS", 4),
+            menu_streaming_extraction=_bool("MENU_STREAMING_EXTRACTION", False),
+
+            menu_max_edge=_int("MENU_MAX_EDGE", 2048),
+            menu_grayscale=_bool("MENU_GRAYSCALE", False),
+            menu_image_format=_str("MENU_IMAGE_FORMAT", "JPEG").upper(),
+            menu_image_quality=_int("MENU_IMAGE_QUALITY", 85),
+            menu_max_payload_bytes=_int("MENU_MAX_PAYLOAD_BYTES", 3 * 1024 * 1024),
+
+            menu_index_path=_str("MENU_INDEX_PATH", ".cache/menu_index.jsonl"),
+            menu_hash_max_distance=_int("MENU_HASH_MAX_DISTANCE", 8),
+            menu_index_max_entries=_int("MENU_INDEX_MAX_ENTRIES", 5000),
+            menu_match_min_correlation=_float("MENU_MATCH_MIN_CORRELATION", 0.97),
+
+            concurrent_image_generation=_bool("CONCURRENT_IMAGE_GENERATION", True),
+            image_generation_workers=image_generation_workers,
+            progressive_dish_images=_bool("PROGRESSIVE_DISH_IMAGES", False),
+            preview_image_steps=_int("PREVIEW_IMAGE_STEPS", 1),
+            preview_image_width=_int("PREVIEW_IMAGE_WIDTH", 512),
+            preview_image_height=_int("PREVIEW_IMAGE_HEIGHT", 384),
+
+            paginated_gallery=_bool("PAGINATED_GALLERY", False),
+            gallery_page_size=_int("GALLERY_PAGE_SIZE", 6),
+            gallery_prefetch_pages=_int("GALLERY_PREFETCH_PAGES", 1),
+
+            session_results_max_menus=_int("SESSION_RESULTS_MAX_MENUS", 5),
+
+            image_cache_dir=_str("IMAGE_CACHE_DIR", ".cache/dish_images"),
+            image_cache_max_bytes=_int("IMAGE_CACHE_MAX_BYTES", 512 * 1024 * 1024),
+            image_cache_ttl=_int("IMAGE_CACHE_TTL", 30 * 24 * 3600),
+            image_cache_remote=_bool("IMAGE_CACHE_REMOTE", True),
+
+            rehost_dish_images=_bool("REHOST_DISH_IMAGES", True),
+            image_variant_widths=tuple(int(width) for width in _list("IMAGE_VARIANT_WIDTHS", "320,640,1024")),
+            image_variant_formats=tuple(fmt.upper() for fmt in _list("IMAGE_VARIANT_FORMATS", "WEBP")),
+            image_variant_quality=_int("IMAGE_VARIANT_QUALITY", 80),
+            grid_image_width=_int("GRID_IMAGE_WIDTH", 640),
+
+            pipeline_queue_size=_int("PIPELINE_QUEUE_SIZE", 16),
+            pipeline_generation_workers=_int("PIPELINE_GENERATION_WORKERS", image_generation_workers),
+            pipeline_max_extractions=_int("PIPELINE_MAX_EXTRACTIONS", 4),
+            pipeline_max_generations=_int("PIPELINE_MAX_GENERATIONS", 32),
+
+            bucket_cache_ttl=_int("BUCKET_CACHE_TTL", 300),
+            upload_workers=_int("UPLOAD_WORKERS", 4),
+
+            metrics_port=_int("METRICS_PORT", 0),
+            metrics_window=_int("METRICS_WINDOW", 1024),
+
+            s3_endpoint=_str("S3_ENDPOINT", f"https://{project_ref(supabase_url)}.supabase.co/storage/v1/s3"),
+            s3_region=_str("S3_REGION", "us-east-1"),
+            s3_max_pool_connections=_int("S3_MAX_POOL_CONNECTIONS", 50),
+            s3_max_attempts=_int("S3_MAX_ATTEMPTS", 5),
+            s3_retry_mode=_str("S3_RETRY_MODE", "adaptive"),
+            s3_connect_timeout=_float("S3_CONNECT_TIMEOUT", 5),
+            s3_read_timeout=_float("S3_READ_TIMEOUT", 60),
+            s3_tcp_keepalive=_bool("S3_TCP_KEEPALIVE", True),
+            s3_client_registry_size=_int("S3_CLIENT_REGISTRY_SIZE", 64),
+            s3_multipart_part_size=_int("S3_MULTIPART_PART_SIZE", 8 * 1024 * 1024),
+            s3_multipart_concurrency=_int("S3_MULTIPART_CONCURRENCY", 8),
+            s3_delete_concurrency=_int("S3_DELETE_CONCURRENCY", 4),
+        )
+
+@lru_cache(maxsize=None)
+def get_settings() -> Settings:
+    """Returns the process-wide settings, reading them on first use."""
+    return Settings.load()
@@ -0,0 +1,234 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from config import get_settings
+from image_utils import detect_mime_type
+from supabase_utils import get_storage_s3_client, SUPABASE_BUCKET_NAME
+
+# Optional: Import S3 utilities for the shared remote tier
+try:
+    import s3_utils
+    S3_AVAILABLE = True
+except ImportError:
+    S3_AVAILABLE = False
+
+# --- Configuration ---
+settings = get_settings()
+
+IMAGE_CACHE_DIR = settings.image_cache_dir
+IMAGE_CACHE_MAX_BYTES = settings.image_cache_max_bytes
+IMAGE_CACHE_TTL = settings.image_cache_ttl  # Seconds
+IMAGE_CACHE_REMOTE = settings.image_cache_remote
+IMAGE_CACHE_PREFIX = "dish_image_cache"  # Object prefix in the storage bucket
+
+
+class ImageCache:
+    """
+    Content-addressed, two-tier cache for generated image bytes.
+
+    Entries are keyed by a hex digest chosen by the caller. The local tier is a
+    directory on disk, bounded by total size with least-recently-used eviction.
+    The remote tier is the Supabase bucket (via s3_utils), shared by every
+    instance of the app; a remote hit is copied to disk for the next lookup.
+    Entries older than the TTL are treated as misses in both tiers.
+    """
+
+    def __init__(
+        self,
+        cache_dir: str = IMAGE_CACHE_DIR,
+        max_bytes: int = IMAGE_CACHE_MAX_BYTES,
+        ttl: int = IMAGE_CACHE_TTL,
+        remote: bool = IMAGE_CACHE_REMOTE
+    ):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.remote = remote and S3_AVAILABLE
+        self._lock = threading.Lock()
+        # key -> size in bytes, ordered from least to most recently used
+        self._entries: Optional[OrderedDict] = None
+        self._total_bytes = 0
+
+    # --- Public API ---
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Looks up an entry in the local tier, then the remote tier.
+
+        Args:
+            key: The content key of the entry.
+
+        Returns:
+            The local file path of the cached image, or None on a miss.
+        """
+        path = self._get_local(key)
+        if path:
+            return path
+
+        data = self._get_remote(key)
+        if data:
+            return self._put_local(key, data)
+
+        return None
+
+    def put(self, key: str, data: bytes) -> Optional[str]:
+        """
+        Stores an entry in both tiers.
+
+        Args:
+            key: The content key of the entry.
+            data: The image bytes.
+
+        Returns:
+            The local file path of the stored image, or None if it could not be written.
+        """
+        path = self._put_local(key, data)
+        self._put_remote(key, data)
+        return path
+
+    # --- Local tier ---
+
+    def _path(self, key: str) -> str:
+        # Fan out into subdirectories so no single directory grows too large
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def _load_index(self) -> None:
+        """Builds the in-memory LRU index from the files already on disk (called with the lock held)."""
+        if self._entries is not None:
+            return
+
+        found = []
+        if os.path.isdir(self.cache_dir):
+            for root, _, files in os.walk(self.cache_dir):
+                for name in files:
+                    if name.endswith(".tmp"):
+                        continue
+                    try:
+                        stat = os.stat(os.path.join(root, name))
+                    except OSError:
+                        continue
+                    found.append((stat.st_atime, name, stat.st_size))
+
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+        for _, name, size in sorted(found):
+            self._entries[name] = size
+            self._total_bytes += size
+
+    def _get_local(self, key: str) -> Optional[str]:
+        path = self._path(key)
+
+        with self._lock:
+            self._load_index()
+            if key not in self._entries:
+                return None
+
+            try:
+                stat = os.stat(path)
+            except OSError:
+                self._forget(key)
+                return None
+
+            # The modification time is the creation time; only the access time moves on hits
+            if time.time() - stat.st_mtime > self.ttl:
+                self._remove(key)
+                return None
+
+            os.utime(path, (time.time(), stat.st_mtime))
+            self._entries.move_to_end(key)
+            return path
+
+    def _put_local(self, key: str, data: bytes) -> Optional[str]:
+        path = self._path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+
+        with self._lock:
+            self._load_index()
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                # Write to a temporary file first so readers never see a partial image
+                with open(tmp_path, "wb") as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+            except OSError:
+                return None
+
+            self._forget(key)
+            self._entries[key] = len(data)
+            self._total_bytes += len(data)
+            self._evict()
+            return path if key in self._entries else None
+
+    def _evict(self) -> None:
+        """Drops least-recently-used entries until the tier fits its size budget (called with the lock held)."""
+        while self._total_bytes > self.max_bytes and self._entries:
+            oldest_key = next(iter(self._entries))
+            self._remove(oldest_key)
+
+    def _forget(self, key: str) -> None:
+        size = self._entries.pop(key, None)
+        if size is not None:
+            self._total_bytes -= size
+
+    def _remove(self, key: str) -> None:
+        self._forget(key)
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    # --- Remote tier ---
+
+    def _remote_client(self):
+        if not self.remote:
+            return None
+
+        return get_storage_s3_client()
+
+    def _remote_location(self, key: str) -> Tuple[str, str]:
+        return SUPABASE_BUCKET_NAME, f"{IMAGE_CACHE_PREFIX}/{key}"
+
+    def _get_remote(self, key: str) -> Optional[bytes]:
+        client = self._remote_client()
+        if client is None:
+            return None
+
+        bucket_name, object_name = self._remote_location(key)
+        try:
+            # A HEAD request tells us both whether the entry exists and how old it is
+            head = client.head_object(Bucket=bucket_name, Key=object_name)
+        except Exception:
+            return None
+
+        if time.time() - head["LastModified"].timestamp() > self.ttl:
+            return None
+
+        return s3_utils.download_file(
+            object_name=object_name,
+            bucket_name=bucket_name,
+            s3_client=client,
+            quiet=True
+        )
+
+    def _put_remote(self, key: str, data: bytes) -> None:
+        client = self._remote_client()
+        if client is None:
+            return
+
+        bucket_name, object_name = self._remote_location(key)
+        s3_utils.upload_file(
+            file_data=data,
+            object_name=object_name,
+            bucket_name=bucket_name,
+            s3_client=client,
+            # Whatever format the provider returned (often PNG or WebP), not always JPEG
+            content_type=detect_mime_type(data),
+            quiet=True
+        )
+
+
+# Process-wide cache shared by all sessions
+dish_image_cache = ImageCache()
@@ -0,0 +1,168 @@
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from config import get_settings
+from image_utils import encode_image_variants, image_format_supported
+from supabase_utils import (
+    store_image,
+    find_stored_image,
+    storage_available,
+    SUPABASE_BUCKET_NAME,
+    USE_SUPABASE_S3,
+)
+
+# --- Configuration ---
+settings = get_settings()
+
+# Generated images are re-encoded at several widths and served from our own bucket
+REHOST_DISH_IMAGES = settings.rehost_dish_images
+IMAGE_VARIANT_WIDTHS = list(settings.image_variant_widths)
+IMAGE_VARIANT_FORMATS = list(settings.image_variant_formats)
+IMAGE_VARIANT_QUALITY = settings.image_variant_quality
+# Width of the variant shown in a dish card (cards are roughly 300-450 CSS pixels wide)
+GRID_IMAGE_WIDTH = settings.grid_image_width
+
+REHOST_PREFIX = "dish_images"  # Object prefix in the storage bucket
+
+_EXTENSIONS = {"WEBP": "webp", "AVIF": "avif", "JPEG": "jpg", "PNG": "png"}
+
+# Images whose rehosting failed recently (cache key -> when), so each is not re-encoded on every request
+REHOST_RETRY_AFTER = 600  # Seconds
+_FAILED_KEYS_MAX = 4096
+_failed_keys: "OrderedDict[str, float]" = OrderedDict()
+_failed_keys_lock = threading.Lock()
+
+# The variants other than the grid one are encoded and uploaded here, after the grid URL is returned
+_variant_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="image-variants")
+
+# --- Functions ---
+
+def variant_formats() -> List[str]:
+    """Returns the configured variant formats that the installed Pillow can encode, in preference order."""
+    return [fmt for fmt in IMAGE_VARIANT_FORMATS if fmt in _EXTENSIONS and image_format_supported(fmt)]
+
+def variant_path(image_key: str, width: int, image_format: str) -> str:
+    """
+    Builds the storage path of one variant.
+
+    Paths are derived from the image's cache key, so the content behind a path
+    never changes and it can be cached by browsers and CDNs indefinitely.
+    """
+    return f"{REHOST_PREFIX}/{image_key}/{width}w.{_EXTENSIONS[image_format]}"
+
+def grid_width(widths: List[int]) -> int:
+    """Picks the smallest variant width that still covers GRID_IMAGE_WIDTH (or the largest available)."""
+    covering = [width for width in widths if width >= GRID_IMAGE_WIDTH]
+    return min(covering) if covering else max(widths)
+
+def grid_variant_path(image_key: str, image_format: str) -> str:
+    """
+    Builds the storage path of the grid variant.
+
+    The path depends only on the configuration, never on the source size, so a
+    lookup finds the variant however wide the original was. A source narrower than
+    the grid width is stored at its own size under this path.
+    """
+    return variant_path(image_key, grid_width(IMAGE_VARIANT_WIDTHS), image_format)
+
+def _recently_failed(image_key: str) -> bool:
+    with _failed_keys_lock:
+        failed_at = _failed_keys.get(image_key)
+        return failed_at is not None and time.monotonic() - failed_at < REHOST_RETRY_AFTER
+
+def _mark_failed(image_key: str) -> None:
+    with _failed_keys_lock:
+        _failed_keys[image_key] = time.monotonic()
+        _failed_keys.move_to_end(image_key)
+        while len(_failed_keys) > _FAILED_KEYS_MAX:
+            _failed_keys.popitem(last=False)
+
+def find_rehosted_image(image_key: str) -> Optional[str]:
+    """
+    Looks up the grid variant of an already rehosted image.
+
+    Args:
+        image_key: The cache key of the image (see ai_utils.dish_image_cache_key).
+
+    Returns:
+        The public URL of the grid variant, or None if it is not stored.
+    """
+    formats = variant_formats()
+    if not formats or not IMAGE_VARIANT_WIDTHS:
+        return None
+
+    path = grid_variant_path(image_key, formats[0])
+    try:
+        return find_stored_image(path, SUPABASE_BUCKET_NAME, use_s3=USE_SUPABASE_S3)
+    except Exception:
+        return None
+
+def rehost_image(image_bytes: bytes, image_key: str) -> Optional[str]:
+    """
+    Stores responsive variants of a generated image and returns the one that fits the grid.
+
+    Only the grid variant is encoded and uploaded before returning, so its URL is
+    valid immediately; every other configured width and format is encoded and
+    uploaded in the background. All variants get an immutable Cache-Control header.
+
+    Nothing is encoded when no storage is configured, and an image whose rehosting
+    failed is not tried again for REHOST_RETRY_AFTER seconds.
+
+    Args:
+        image_bytes: The generated image data as bytes.
+        image_key: The cache key of the image, used to name the variants.
+
+    Returns:
+        The public URL of the grid variant, or None if rehosting failed or was skipped.
+    """
+    formats = variant_formats()
+    if not formats or not IMAGE_VARIANT_WIDTHS or not storage_available(USE_SUPABASE_S3):
+        return None
+    if _recently_failed(image_key):
+        return None
+
+    primary = formats[0]
+    display_width = grid_width(IMAGE_VARIANT_WIDTHS)
+    try:
+        # A source narrower than the grid width comes back at its own width
+        grid_data = next(iter(encode_image_variants(image_bytes, [display_width], primary, IMAGE_VARIANT_QUALITY).values()))
+        url = store_image(
+            grid_data,
+            grid_variant_path(image_key, primary),
+            SUPABASE_BUCKET_NAME,
+            use_s3=USE_SUPABASE_S3,
+            skip_if_exists=True,
+            immutable=True
+        )
+    except Exception:
+        _mark_failed(image_key)
+        return None
+
+    _variant_executor.submit(_store_other_variants, image_bytes, image_key, formats, display_width)
+    return url
+
+def _store_other_variants(image_bytes: bytes, image_key: str, formats: List[str], display_width: int) -> None:
+    """Encodes and uploads every variant except the grid one, which is already stored."""
+    for fmt in formats:
+        try:
+            variants = encode_image_variants(image_bytes, IMAGE_VARIANT_WIDTHS, fmt, IMAGE_VARIANT_QUALITY)
+        except Exception:
+            continue
+        for width, data in variants.items():
+            if fmt == formats[0] and width == display_width:
+                continue
+            try:
+                store_image(
+                    data,
+                    variant_path(image_key, width, fmt),
+                    SUPABASE_BUCKET_NAME,
+                    use_s3=USE_SUPABASE_S3,
+                    skip_if_exists=True,
+                    immutable=True
+                )
+            except Exception:
+                # Only the grid variant is shown; missing extra sizes are not worth failing for
+                pass
@@ -0,0 +1,113 @@
+import heapq
+import itertools
+import threading
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional, Tuple
+
+from ai_utils import request_dish_image, dish_image_cache_key, IMAGE_GENERATION_WORKERS
+from config import get_settings
+
+# --- Configuration ---
+settings = get_settings()
+
+# Paginated gallery: only the page on screen (and the next GALLERY_PREFETCH_PAGES) is generated
+PAGINATED_GALLERY = settings.paginated_gallery
+GALLERY_PAGE_SIZE = max(1, settings.gallery_page_size)
+GALLERY_PREFETCH_PAGES = max(0, settings.gallery_prefetch_pages)
+
+# Priority of a request: lower sorts first, e.g. (page distance, position on the page)
+Priority = Tuple[int, ...]
+
+
+class ImageScheduler:
+    """
+    Generates dish images on demand, most urgent first.
+
+    Requests go into a priority queue served by up to max_workers threads, which are
+    started when work arrives and exit when the queue is empty, so an idle scheduler
+    (e.g. one kept in a finished session's state) holds no threads.
+
+    Each dish is generated once per scheduler: requesting it again returns the same
+    Future (unless generation failed, which queues a retry), and a more urgent
+    request for a dish that is still queued moves it up.
+    This lets the gallery request the visible page first, prefetch the next one at a
+    lower priority, and promote prefetched dishes when the user pages ahead.
+    """
+
+    def __init__(self, generate: Callable[[str, str], Optional[str]] = request_dish_image, max_workers: int = IMAGE_GENERATION_WORKERS):
+        self.generate = generate
+        self.max_workers = max(1, max_workers)
+        self._futures: Dict[str, Future] = {}
+        self._queued: Dict[str, Priority] = {}  # Best priority of each dish still waiting
+        self._heap: List[tuple] = []
+        self._order = itertools.count()  # Ties go to the earlier request
+        self._workers = 0
+        self._lock = threading.Lock()
+
+    def request(self, dish_name: str, description: str, priority: Priority = (0,)) -> Future:
+        """
+        Requests the image of a dish.
+
+        Args:
+            dish_name: The name of the dish.
+            description: A short description of the dish.
+            priority: Lower values are generated first.
+
+        Returns:
+            A Future resolving to the image URL (None if generation failed).
+        """
+        key = dish_image_cache_key(dish_name, description)
+
+        with self._lock:
+            future = self._futures.get(key)
+            if future is None or (future.done() and self._failed(future)):
+                future = self._futures[key] = Future()
+            elif future.done() or future.running() or priority >= self._queued[key]:
+                return future
+
+            # New or promoted; an older heap entry for the same dish is skipped when popped
+            self._queued[key] = priority
+            heapq.heappush(self._heap, (priority, next(self._order), key, dish_name, description))
+
+            if self._workers < self.max_workers:
+                self._workers += 1
+                threading.Thread(target=self._work, name="image-scheduler", daemon=True).start()
+
+        return future
+
+    @staticmethod
+    def _failed(future: Future) -> bool:
+        return future.cancelled() or future.exception() is not None or future.result() is None
+
+    def pending(self) -> int:
+        """Returns the number of dishes waiting for a worker."""
+        with self._lock:
+            return len(self._queued)
+
+    def _next(self) -> Optional[tuple]:
+        """Pops the most urgent queued dish, or returns None (and retires the worker) when none is left."""
+        with self._lock:
+            while self._heap:
+                priority, _, key, dish_name, description = heapq.heappop(self._heap)
+                if self._queued.get(key) != priority:
+                    continue  # Superseded by a promotion, or already taken
+                del self._queued[key]
+                # Marked running while still locked, so request() never sees it neither queued nor running
+                future = self._futures[key]
+                if not future.set_running_or_notify_cancel():
+                    continue
+                return future, dish_name, description
+            self._workers -= 1
+            return None
+
+    def _work(self) -> None:
+        while True:
+            work = self._next()
+            if work is None:
+                return
+
+            future, dish_name, description = work
+            try:
+                future.set_result(self.generate(dish_name, description))
+            except Exception as e:
+                future.set_exception(e)
@@ -0,0 +1,220 @@
+import io
+from typing import Dict, Iterable, List
+from PIL import Image, ImageOps
+
+from config import get_settings
+from metrics import timed
+
+# --- Configuration ---
+settings = get_settings()
+
+# Menu photos are normalized before extraction so requests carry a small, predictable payload
+MENU_MAX_EDGE = settings.menu_max_edge
+MENU_GRAYSCALE = settings.menu_grayscale
+MENU_IMAGE_FORMAT = settings.menu_image_format
+MENU_IMAGE_QUALITY = settings.menu_image_quality
+MENU_MAX_PAYLOAD_BYTES = settings.menu_max_payload_bytes
+
+MIN_IMAGE_QUALITY = 40  # Never re-encode below this quality to meet the payload budget
+
+# --- Functions ---
+
+def detect_mime_type(image_bytes: bytes) -> str:
+    """
+    Detects the MIME type of an image from its leading bytes.
+
+    Args:
+        image_bytes: The image data as bytes.
+
+    Returns:
+        The MIME type, defaulting to "image/jpeg" for unrecognized data.
+    """
+    if image_bytes.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if image_bytes[:4] == b"RIFF" and image_bytes[8:12] == b"WEBP":
+        return "image/webp"
+    if image_bytes[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    if image_bytes[4:12] in (b"ftypavif", b"ftypavis"):
+        return "image/avif"
+    return "image/jpeg"
+
+def _open_oriented(image_bytes: bytes, max_edge: int) -> Image.Image:
+    """Decodes an image and applies its EXIF orientation."""
+    img = Image.open(io.BytesIO(image_bytes))
+    # Let the JPEG decoder downscale while decoding instead of materializing the full photo
+    img.draft("RGB", (max_edge, max_edge))
+    return ImageOps.exif_transpose(img)
+
+def _encode_normalized(
+    img: Image.Image,
+    max_edge: int,
+    grayscale: bool,
+    image_format: str,
+    quality: int,
+    max_bytes: int
+) -> bytes:
+    """Downscales, converts and re-encodes a decoded image within the payload budget."""
+    img.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+
+    if grayscale:
+        img = img.convert("L")
+    elif img.mode != "RGB":
+        # JPEG has no alpha channel; flatten transparency onto white
+        if img.mode in ("RGBA", "LA", "P"):
+            img = img.convert("RGBA")
+            background = Image.new("RGB", img.size, (255, 255, 255))
+            background.paste(img, mask=img.getchannel("A"))
+            img = background
+        else:
+            img = img.convert("RGB")
+
+    image_format = "WEBP" if image_format == "WEBP" else "JPEG"
+
+    while True:
+        buffer = io.BytesIO()
+        img.save(buffer, format=image_format, quality=quality, optimize=True)
+        encoded = buffer.getvalue()
+        if len(encoded) <= max_bytes or quality <= MIN_IMAGE_QUALITY:
+            return encoded
+        quality = max(MIN_IMAGE_QUALITY, quality - 10)
+
+@timed("preprocess")
+def preprocess_menu_image(
+    image_bytes: bytes,
+    max_edge: int = MENU_MAX_EDGE,
+    grayscale: bool = MENU_GRAYSCALE,
+    image_format: str = MENU_IMAGE_FORMAT,
+    quality: int = MENU_IMAGE_QUALITY,
+    max_bytes: int = MENU_MAX_PAYLOAD_BYTES
+) -> bytes:
+    """
+    Normalizes a menu photo before it is sent for extraction.
+
+    Applies the EXIF orientation, downscales so the longest edge is at most max_edge,
+    optionally converts to grayscale, and re-encodes as JPEG or WebP. The quality is
+    lowered step by step (down to MIN_IMAGE_QUALITY) until the result fits max_bytes.
+
+    Args:
+        image_bytes: The original image data as bytes.
+        max_edge: The maximum width or height in pixels.
+        grayscale: Whether to drop color information.
+        image_format: The output format, "JPEG" or "WEBP".
+        quality: The starting encoder quality (1-95).
+        max_bytes: The payload budget for the encoded image.
+
+    Returns:
+        The re-encoded image bytes, or the original bytes if they cannot be decoded.
+    """
+    try:
+        img = _open_oriented(image_bytes, max_edge)
+        return _encode_normalized(img, max_edge, grayscale, image_format, quality, max_bytes)
+    except Exception:
+        # Leave undecodable uploads untouched; extraction reports the problem
+        return image_bytes
+
+def split_into_tiles(
+    image_bytes: bytes,
+    columns: int,
+    rows: int,
+    overlap: float,
+    max_edge: int = MENU_MAX_EDGE,
+    grayscale: bool = MENU_GRAYSCALE,
+    image_format: str = MENU_IMAGE_FORMAT,
+    quality: int = MENU_IMAGE_QUALITY,
+    max_bytes: int = MENU_MAX_PAYLOAD_BYTES
+) -> List[bytes]:
+    """
+    Cuts a menu photo into an overlapping grid of tiles, each normalized like preprocess_menu_image.
+
+    Tiles are ordered column by column (top to bottom, then left to right), which is
+    the reading order of multi-column menus. Neighbouring tiles share `overlap` of their
+    size, so a dish split by one boundary appears whole in the adjacent tile.
+
+    Args:
+        image_bytes: The original image data as bytes.
+        columns: The number of column strips.
+        rows: The number of row bands per column.
+        overlap: The fraction of each tile shared with its neighbours (0 to 0.5).
+        max_edge, grayscale, image_format, quality, max_bytes: As for preprocess_menu_image.
+
+    Returns:
+        The encoded tiles, or a single normalized image if the photo cannot be decoded or split.
+    """
+    columns = max(1, columns)
+    rows = max(1, rows)
+    overlap = min(max(overlap, 0.0), 0.5)
+
+    try:
+        # Decode at up to full tile resolution so every tile keeps its detail
+        img = _open_oriented(image_bytes, max_edge * max(columns, rows))
+    except Exception:
+        return [preprocess_menu_image(image_bytes, max_edge, grayscale, image_format, quality, max_bytes)]
+
+    width, height = img.size
+    tile_width = width / columns
+    tile_height = height / rows
+    pad_x = tile_width * overlap
+    pad_y = tile_height * overlap
+
+    tiles = []
+    for col in range(columns):
+        for row in range(rows):
+            box = (
+                int(max(0, col * tile_width - pad_x)),
+                int(max(0, row * tile_height - pad_y)),
+                int(min(width, (col + 1) * tile_width + pad_x)),
+                int(min(height, (row + 1) * tile_height + pad_y))
+            )
+            tiles.append(_encode_normalized(img.crop(box), max_edge, grayscale, image_format, quality, max_bytes))
+    return tiles
+
+def image_format_supported(image_format: str) -> bool:
+    """Returns whether the installed Pillow can encode the given format (AVIF needs Pillow 11.2+ or a plugin)."""
+    Image.init()
+    return image_format.upper() in Image.SAVE
+
+def encode_image_variants(
+    image_bytes: bytes,
+    widths: Iterable[int],
+    image_format: str = "WEBP",
+    quality: int = 80
+) -> Dict[int, bytes]:
+    """
+    Encodes resized copies of an image for responsive display.
+
+    Each variant keeps the aspect ratio of the original; widths larger than the
+    original are skipped, since upscaling only adds bytes.
+
+    Args:
+        image_bytes: The original image data as bytes.
+        widths: The target widths in pixels.
+        image_format: The output format, e.g. "WEBP" or "AVIF".
+        quality: The encoder quality (1-100).
+
+    Returns:
+        A dict of width -> encoded bytes (the original width is always included
+        if every requested width is larger).
+
+    Raises:
+        ValueError: If the format cannot be encoded by the installed Pillow.
+        OSError: If the image cannot be decoded.
+    """
+    image_format = image_format.upper()
+    if not image_format_supported(image_format):
+        raise ValueError(f"Pillow cannot encode {image_format} images")
+
+    img = ImageOps.exif_transpose(Image.open(io.BytesIO(image_bytes)))
+    if img.mode not in ("RGB", "RGBA"):
+        img = img.convert("RGBA" if "A" in img.getbands() else "RGB")
+
+    targets = sorted({width for width in widths if 0 < width <= img.width}) or [img.width]
+
+    variants = {}
+    for width in targets:
+        height = max(1, round(img.height * width / img.width))
+        resized = img if width == img.width else img.resize((width, height), Image.Resampling.LANCZOS)
+        buffer = io.BytesIO()
+        resized.save(buffer, format=image_format, quality=quality)
+        variants[width] = buffer.getvalue()
+    return variants
@@ -0,0 +1,252 @@
+import os
+import io
+import json
+import math
+import time
+import base64
+import hashlib
+import threading
+from typing import List, Dict, NamedTuple, Tuple, Optional
+from PIL import Image
+
+from config import get_settings
+
+# --- Configuration ---
+settings = get_settings()
+
+MENU_INDEX_PATH = settings.menu_index_path
+MENU_HASH_MAX_DISTANCE = settings.menu_hash_max_distance
+MENU_INDEX_MAX_ENTRIES = settings.menu_index_max_entries
+
+MENU_MATCH_MIN_CORRELATION = settings.menu_match_min_correlation
+
+HASH_SIZE = 16  # Hashes are HASH_SIZE x HASH_SIZE = 256 bits
+THUMBNAIL_SIZE = 64  # Side of the grayscale thumbnail that confirms a match
+
+# Rewrite the append-only index file once it holds this many stale lines
+_COMPACT_AFTER = 256
+
+# --- Perceptual Hashes ---
+
+def _load_grayscale(image_bytes: bytes, size: Tuple[int, int]) -> List[int]:
+    """Decodes an image and returns its grayscale pixels resized to the given size."""
+    img = Image.open(io.BytesIO(image_bytes))
+    # Let the JPEG decoder downscale while decoding; large phone photos decode much faster
+    img.draft("L", (size[0] * 4, size[1] * 4))
+    img = img.convert("L").resize(size, Image.Resampling.LANCZOS)
+    return list(img.tobytes())
+
+def compute_phash(image_bytes: bytes, hash_size: int = HASH_SIZE, highfreq_factor: int = 4) -> int:
+    """
+    Computes the DCT-based perceptual hash of an image.
+
+    The image is reduced to a (hash_size * highfreq_factor)-pixel square, transformed
+    with a 2D DCT-II, and each of the lowest hash_size x hash_size frequencies is
+    compared against their median.
+
+    Args:
+        image_bytes: The image data as bytes.
+        hash_size: The hash grid size.
+        highfreq_factor: How much larger than the hash grid the transformed image is.
+
+    Returns:
+        The hash as an integer of hash_size * hash_size bits.
+    """
+    n = hash_size * highfreq_factor
+    pixels = _load_grayscale(image_bytes, (n, n))
+
+    # Only the low-frequency corner is needed, so compute the separable DCT for those rows/columns
+    cosines = [[math.cos((2 * x + 1) * k * math.pi / (2 * n)) for x in range(n)] for k in range(hash_size)]
+
+    row_dct = []
+    for y in range(n):
+        row = pixels[y * n:(y + 1) * n]
+        row_dct.append([sum(p * c for p, c in zip(row, cosines[k])) for k in range(hash_size)])
+
+    coefficients = []
+    for u in range(hash_size):
+        for v in range(hash_size):
+            coefficients.append(sum(row_dct[y][v] * cosines[u][y] for y in range(n)))
+
+    median = sorted(coefficients)[len(coefficients) // 2]
+
+    value = 0
+    for coefficient in coefficients:
+        value = (value << 1) | (1 if coefficient > median else 0)
+    return value
+
+def hamming_distance(a: int, b: int) -> int:
+    """Returns the number of differing bits between two hashes."""
+    return bin(a ^ b).count("1")
+
+def correlation(a: bytes, b: bytes) -> float:
+    """Returns the Pearson correlation of two equally sized grayscale thumbnails (0.0 if either is flat)."""
+    n = len(a)
+    if n == 0 or n != len(b):
+        return 0.0
+    mean_a = sum(a) / n
+    mean_b = sum(b) / n
+    covariance = sum((x - mean_a) * (y - mean_b) for x, y in zip(a, b))
+    variance_a = sum((x - mean_a) ** 2 for x in a)
+    variance_b = sum((y - mean_b) ** 2 for y in b)
+    if not variance_a or not variance_b:
+        return 0.0
+    return covariance / math.sqrt(variance_a * variance_b)
+
+class MenuFingerprint(NamedTuple):
+    """What the index knows about an uploaded image."""
+    sha256: str
+    phash: int
+    thumbnail: bytes  # THUMBNAIL_SIZE x THUMBNAIL_SIZE grayscale pixels
+
+# --- Menu Index ---
+
+class MenuIndex:
+    """
+    Perceptual-hash index over previously extracted menus.
+
+    The index is shared by every user, so a false match serves one restaurant's
+    dishes for another restaurant's menu. Matching is therefore strict:
+
+    1. The same bytes always match.
+    2. Otherwise a candidate must have a 256-bit pHash within max_distance bits,
+    3. and its grayscale thumbnail must correlate with the upload's by at least
+       min_correlation.
+
+    Menus printed from the same template share their coarse layout, which is all
+    a small hash sees; the thumbnail also compares where the text lines fall. A
+    re-compressed or lightly re-photographed menu passes both checks; anything
+    doubtful is extracted again.
+
+    Entries are appended to a JSON Lines file, so they survive restarts and an
+    insert does not rewrite the index. The file is compacted once it holds enough
+    entries beyond max_entries.
+    """
+
+    def __init__(
+        self,
+        path: str = MENU_INDEX_PATH,
+        max_distance: int = MENU_HASH_MAX_DISTANCE,
+        max_entries: int = MENU_INDEX_MAX_ENTRIES,
+        min_correlation: float = MENU_MATCH_MIN_CORRELATION
+    ):
+        self.path = path
+        self.max_distance = max_distance
+        self.max_entries = max_entries
+        self.min_correlation = min_correlation
+        self._lock = threading.Lock()
+        self._entries: Optional[List[Dict]] = None
+        self._file_lines = 0
+
+    def _load(self) -> None:
+        """Reads the index from disk (called with the lock held)."""
+        if self._entries is not None:
+            return
+
+        self._entries = []
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    self._file_lines += 1
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # A line cut short by a crash
+                        continue
+                    # Entries written with an older hash layout are never matched
+                    if isinstance(entry, dict) and len(entry.get("phash", "")) == HASH_SIZE * HASH_SIZE // 4 and entry.get("thumbnail"):
+                        self._entries.append(entry)
+        except OSError:
+            pass
+        self._entries = self._entries[-self.max_entries:]
+
+    def _append(self, entry: Dict) -> None:
+        """Appends one entry to the index file (called with the lock held)."""
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry) + "\n")
+            self._file_lines += 1
+        except OSError:
+            pass
+
+    def _compact(self) -> None:
+        """Rewrites the index file with only the kept entries, atomically (called with the lock held)."""
+        try:
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                for entry in self._entries:
+                    f.write(json.dumps(entry) + "\n")
+            os.replace(tmp_path, self.path)
+            self._file_lines = len(self._entries)
+        except OSError:
+            pass
+
+    @staticmethod
+    def fingerprint(image_bytes: bytes) -> MenuFingerprint:
+        """Computes the fingerprint of an uploaded image."""
+        return MenuFingerprint(
+            hashlib.sha256(image_bytes).hexdigest(),
+            compute_phash(image_bytes),
+            bytes(_load_grayscale(image_bytes, (THUMBNAIL_SIZE, THUMBNAIL_SIZE)))
+        )
+
+    def lookup(self, fingerprint: MenuFingerprint) -> Optional[Tuple[str, List[Dict]]]:
+        """
+        Finds a stored menu that is the same as the uploaded one.
+
+        Args:
+            fingerprint: The fingerprint of the uploaded image.
+
+        Returns:
+            The stored (raw_text, items) tuple, or None if no stored menu matches.
+        """
+        with self._lock:
+            self._load()
+            entries = list(self._entries)
+
+        for entry in reversed(entries):
+            if entry["sha256"] == fingerprint.sha256:
+                return entry["raw_text"], entry["items"]
+
+        candidates = []
+        for entry in entries:
+            distance = hamming_distance(fingerprint.phash, int(entry["phash"], 16))
+            if distance <= self.max_distance:
+                candidates.append((distance, entry))
+
+        for _, entry in sorted(candidates, key=lambda candidate: candidate[0]):
+            if correlation(fingerprint.thumbnail, base64.b64decode(entry["thumbnail"])) >= self.min_correlation:
+                return entry["raw_text"], entry["items"]
+        return None
+
+    def add(self, fingerprint: MenuFingerprint, raw_text: str, items: List[Dict]) -> None:
+        """
+        Stores an extraction result under the image's fingerprint.
+
+        Args:
+            fingerprint: The fingerprint of the uploaded image.
+            raw_text: The raw model output.
+            items: The structured menu items.
+        """
+        entry = {
+            "sha256": fingerprint.sha256,
+            "phash": f"{fingerprint.phash:0{HASH_SIZE * HASH_SIZE // 4}x}",
+            "thumbnail": base64.b64encode(fingerprint.thumbnail).decode("ascii"),
+            "raw_text": raw_text,
+            "items": items,
+            "created": time.time()
+        }
+        with self._lock:
+            self._load()
+            self._entries.append(entry)
+            self._append(entry)
+            # Keep the newest entries when the index grows past its limit
+            if len(self._entries) > self.max_entries:
+                self._entries = self._entries[-self.max_entries:]
+            if self._file_lines - len(self._entries) >= _COMPACT_AFTER:
+                self._compact()
+
+
+# Process-wide index shared by all sessions
+menu_index = MenuIndex()
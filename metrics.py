@@ -0,0 +1,233 @@
+"""
+Per-stage latency, error and in-flight metrics.
+
+Every instrumented stage (upload, extract, generate, the S3 operations, ...) records:
+
+- menuviz_stage_duration_seconds: a summary with p50/p95/p99 over the most recent
+  METRICS_WINDOW calls, plus the running sum and count,
+- menuviz_stage_errors_total: calls that raised or returned a failure,
+- menuviz_stage_in_flight: calls currently running.
+
+Metrics are process-wide (shared by every Streamlit session) and can be scraped in
+Prometheus text format from a small HTTP server when METRICS_PORT is set.
+"""
+import time
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Deque, Dict, Iterator, Optional
+
+from config import get_settings
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+settings = get_settings()
+
+METRICS_PORT = settings.metrics_port  # 0 disables the metrics endpoint
+METRICS_WINDOW = settings.metrics_window  # Recent durations kept per stage for the quantiles
+
+QUANTILES = (0.5, 0.95, 0.99)
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# --- Stage Metrics ---
+
+class StageMetrics:
+    """Thread-safe latency window, error counter and in-flight gauge of one stage."""
+
+    def __init__(self, window: int = METRICS_WINDOW):
+        self._durations: Deque[float] = deque(maxlen=max(1, window))
+        self._lock = threading.Lock()
+        self.count = 0
+        self.total = 0.0
+        self.errors = 0
+        self.in_flight = 0
+
+    def start(self) -> None:
+        with self._lock:
+            self.in_flight += 1
+
+    def finish(self, duration: float, failed: bool = False) -> None:
+        with self._lock:
+            self.in_flight -= 1
+            self.count += 1
+            self.total += duration
+            self._durations.append(duration)
+            if failed:
+                self.errors += 1
+
+    def quantiles(self) -> Dict[float, float]:
+        """Returns the QUANTILES of the recent durations (nearest rank), empty if none were recorded."""
+        with self._lock:
+            durations = sorted(self._durations)
+        if not durations:
+            return {}
+        return {q: durations[min(len(durations) - 1, int(q * len(durations)))] for q in QUANTILES}
+
+
+class _Span:
+    """Handle of one tracked call; lets the caller mark a failure that raised no exception."""
+
+    def __init__(self):
+        self.failed = False
+
+    def fail(self) -> None:
+        self.failed = True
+
+
+_stages: Dict[str, StageMetrics] = {}
+_stages_lock = threading.Lock()
+
+def stage_metrics(stage: str) -> StageMetrics:
+    """Returns the metrics of a stage, creating them on first use."""
+    with _stages_lock:
+        metrics = _stages.get(stage)
+        if metrics is None:
+            metrics = _stages[stage] = StageMetrics()
+        return metrics
+
+@contextmanager
+def track(stage: str) -> Iterator[_Span]:
+    """
+    Times the enclosed block as one call of a stage.
+
+    An exception counts as an error (and is re-raised); call span.fail() to count
+    a failure that is reported through the return value instead.
+
+    Example:
+        with track("generate") as span:
+            url = request_dish_image(name, description)
+            if url is None:
+                span.fail()
+    """
+    metrics = stage_metrics(stage)
+    span = _Span()
+    metrics.start()
+    started = time.perf_counter()
+    try:
+        yield span
+    except BaseException:
+        span.failed = True
+        raise
+    finally:
+        metrics.finish(time.perf_counter() - started, span.failed)
+
+def timed(stage: str, failed: Optional[Callable[[object], bool]] = None):
+    """
+    Decorator that tracks every call of a function as a stage.
+
+    Args:
+        stage: The stage name (the `stage` label of the exported metrics).
+        failed: Optional predicate on the return value, for functions that report
+            failure by returning e.g. None instead of raising.
+    """
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with track(stage) as span:
+                result = fn(*args, **kwargs)
+                if failed is not None and failed(result):
+                    span.fail()
+                return result
+        return wrapper
+    return decorator
+
+def is_none(result) -> bool:
+    """Failure predicate for functions that return None on failure."""
+    return result is None
+
+# --- Export ---
+
+def snapshot() -> Dict[str, Dict]:
+    """Returns the current metrics of every stage as plain data (e.g. for logs or the batch summary)."""
+    with _stages_lock:
+        stages = dict(_stages)
+    return {
+        stage: {
+            "count": metrics.count,
+            "errors": metrics.errors,
+            "in_flight": metrics.in_flight,
+            "sum_seconds": round(metrics.total, 6),
+            **{f"p{int(q * 100)}": round(value, 6) for q, value in metrics.quantiles().items()},
+        }
+        for stage, metrics in sorted(stages.items())
+    }
+
+def render_prometheus() -> str:
+    """Renders every stage's metrics in the Prometheus text exposition format."""
+    with _stages_lock:
+        stages = sorted(_stages.items())
+
+    lines = [
+        "# HELP menuviz_stage_duration_seconds Duration of pipeline stages.",
+        "# TYPE menuviz_stage_duration_seconds summary",
+    ]
+    for stage, metrics in stages:
+        for q, value in metrics.quantiles().items():
+            lines.append(f'menuviz_stage_duration_seconds{{stage="{stage}",quantile="{q}"}} {value:.6f}')
+        lines.append(f'menuviz_stage_duration_seconds_sum{{stage="{stage}"}} {metrics.total:.6f}')
+        lines.append(f'menuviz_stage_duration_seconds_count{{stage="{stage}"}} {metrics.count}')
+
+    lines += [
+        "# HELP menuviz_stage_errors_total Failed calls of pipeline stages.",
+        "# TYPE menuviz_stage_errors_total counter",
+    ]
+    lines += [f'menuviz_stage_errors_total{{stage="{stage}"}} {metrics.errors}' for stage, metrics in stages]
+
+    lines += [
+        "# HELP menuviz_stage_in_flight Calls of pipeline stages currently running.",
+        "# TYPE menuviz_stage_in_flight gauge",
+    ]
+    lines += [f'menuviz_stage_in_flight{{stage="{stage}"}} {metrics.in_flight}' for stage, metrics in stages]
+
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", PROMETHEUS_CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Scrapes every few seconds would flood the app's output
+        pass
+
+
+_server: Optional[ThreadingHTTPServer] = None
+_server_lock = threading.Lock()
+
+def start_metrics_server(port: int = METRICS_PORT) -> bool:
+    """
+    Serves /metrics in Prometheus text format from a daemon thread, once per process.
+
+    Streamlit re-runs the app script on every interaction, so repeated calls are no-ops.
+
+    Args:
+        port: The port to listen on; 0 leaves the endpoint disabled.
+
+    Returns:
+        True if the endpoint is running.
+    """
+    global _server
+    if not port:
+        return False
+
+    with _server_lock:
+        if _server is None:
+            try:
+                _server = ThreadingHTTPServer(("0.0.0.0", port), _MetricsHandler)
+            except OSError as e:
+                logger.error("Could not start the metrics endpoint on port %s: %s", port, e)
+                return False
+            threading.Thread(target=_server.serve_forever, name="metrics-server", daemon=True).start()
+    return True
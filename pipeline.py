@@ -0,0 +1,258 @@
+import queue
+import threading
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, Iterator, Optional, Tuple
+
+from ai_utils import request_dish_image
+from config import get_settings
+
+# --- Configuration ---
+settings = get_settings()
+
+# Per-run limits
+PIPELINE_QUEUE_SIZE = settings.pipeline_queue_size
+PIPELINE_GENERATION_WORKERS = settings.pipeline_generation_workers
+
+# Process-wide limits, shared by every session running a pipeline
+PIPELINE_MAX_EXTRACTIONS = settings.pipeline_max_extractions
+PIPELINE_MAX_GENERATIONS = settings.pipeline_max_generations
+
+_extraction_slots = threading.BoundedSemaphore(PIPELINE_MAX_EXTRACTIONS)
+_generation_slots = threading.BoundedSemaphore(PIPELINE_MAX_GENERATIONS)
+
+_POLL_INTERVAL = 0.1  # Seconds between checks for cancellation while blocked on a queue
+
+# Marks the end of a stream on the work and event queues
+_DONE = object()
+
+
+@dataclass
+class PipelineEvent:
+    """
+    A result published by the pipeline's render stage.
+
+    kind is one of:
+        "item": a new menu item was extracted (index, item)
+        "preview": a low-resolution preview for an item is ready (index, image_url);
+            only in progressive runs, and always followed by an "image" event
+        "image": the final image for an item is ready (index, image_url; None on failure)
+        "error": extraction failed (error); items already published remain valid
+    """
+    kind: str
+    index: int = -1
+    item: Optional[Dict] = None
+    image_url: Optional[str] = None
+    error: Optional[Exception] = None
+
+
+class MenuPipeline:
+    """
+    Bounded producer/consumer pipeline from menu extraction to rendered dish images.
+
+    Three stages overlap their network waits:
+
+    1. Extract: one thread pulls items from the item source (e.g. a streaming
+       extraction) and puts them on the work queue.
+    2. Generate: worker threads take items off the work queue and request images.
+    3. Render: the caller iterates run() on its own thread (the Streamlit script
+       thread) and receives events in the order they happen.
+
+    Both queues are bounded, so a slow stage holds back the one before it instead
+    of buffering without limit. Process-wide semaphores cap how many extractions
+    and generations run at once across all sessions.
+
+    With a preview function, the generation workers request quick previews instead,
+    and an equal number of refine workers replace each preview with the full image.
+    Every card then shows something after one fast request, and previews of later
+    items do not wait behind full renders of earlier ones.
+    """
+
+    def __init__(
+        self,
+        generate: Callable[[str, str], Optional[str]] = request_dish_image,
+        generation_workers: int = PIPELINE_GENERATION_WORKERS,
+        queue_size: int = PIPELINE_QUEUE_SIZE,
+        preview: Optional[Callable[[str, str], Tuple[Optional[str], bool]]] = None
+    ):
+        self.generate = generate
+        self.generation_workers = max(1, generation_workers)
+        self.queue_size = max(1, queue_size)
+        # Returns (url, is_final); e.g. ai_utils.request_dish_preview
+        self.preview = preview
+
+    def run(self, items: Callable[[], Iterable[Dict]]) -> Iterator[PipelineEvent]:
+        """
+        Runs the pipeline over the items produced by a source.
+
+        Args:
+            items: A callable returning an iterable of menu items; it is invoked on
+                the extraction thread, so it may block on network I/O.
+
+        Yields:
+            PipelineEvent objects. Every "item" event precedes the "preview" and "image"
+            events for the same index. Closing the generator early cancels the remaining work.
+        """
+        work_queue: queue.Queue = queue.Queue(maxsize=self.queue_size)
+        event_queue: queue.Queue = queue.Queue(maxsize=self.queue_size)
+        stop = threading.Event()
+
+        # Items waiting for their full image after a preview. Unbounded, so the preview
+        # workers never block on the slower refine stage; it holds at most one entry per item.
+        refine_queue: Optional[queue.Queue] = queue.Queue() if self.preview is not None else None
+        generators_left = [self.generation_workers]
+        generators_lock = threading.Lock()
+
+        def generator_finished() -> None:
+            # The last generation worker to finish tells the refine workers no more work is coming
+            with generators_lock:
+                generators_left[0] -= 1
+                last = generators_left[0] == 0
+            if last and refine_queue is not None:
+                for _ in range(self.generation_workers):
+                    refine_queue.put(_DONE)
+
+        threads = [threading.Thread(target=self._extract, args=(items, work_queue, event_queue, stop), name="pipeline-extract", daemon=True)]
+        threads += [
+            threading.Thread(target=self._generate, args=(work_queue, event_queue, stop, refine_queue, generator_finished), name=f"pipeline-generate-{n}", daemon=True)
+            for n in range(self.generation_workers)
+        ]
+        if refine_queue is not None:
+            threads += [
+                threading.Thread(target=self._refine, args=(refine_queue, event_queue, stop), name=f"pipeline-refine-{n}", daemon=True)
+                for n in range(self.generation_workers)
+            ]
+        for thread in threads:
+            thread.start()
+
+        # One _DONE from the extractor and one from each generation and refine worker
+        remaining = len(threads)
+        try:
+            while remaining:
+                event = event_queue.get()
+                if event is _DONE:
+                    remaining -= 1
+                    continue
+                yield event
+        finally:
+            stop.set()
+
+    # --- Stages ---
+
+    @staticmethod
+    def _put(target: queue.Queue, value, stop: threading.Event) -> bool:
+        """Puts a value on a bounded queue, giving up if the run is cancelled."""
+        while not stop.is_set():
+            try:
+                target.put(value, timeout=_POLL_INTERVAL)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _extract(self, items, work_queue, event_queue, stop) -> None:
+        index = 0
+        try:
+            for item in self._pull(items, stop):
+                # Skip unnamed items and echoes of the prompt's placeholder
+                if not item.get("name") or item.get("name") == "Dish Name":
+                    continue
+                if not self._put(event_queue, PipelineEvent("item", index=index, item=item), stop):
+                    break
+                if not self._put(work_queue, (index, item), stop):
+                    break
+                index += 1
+        except Exception as e:
+            self._put(event_queue, PipelineEvent("error", error=e), stop)
+        finally:
+            for _ in range(self.generation_workers):
+                self._put(work_queue, _DONE, stop)
+            self._put(event_queue, _DONE, stop)
+
+    @staticmethod
+    def _pull(items, stop: threading.Event) -> Iterator[Dict]:
+        """
+        Yields the source's items, holding an extraction slot while a lazy source is read.
+
+        Items that were extracted beforehand (a list or tuple) need no slot, so a run
+        over them never keeps other sessions from extracting. A lazy source (e.g. a
+        streaming extraction) holds one slot from its first item to its last. The slot
+        is taken once, before any provider limit the source acquires, so the two are
+        always taken in the same order and cannot deadlock.
+        """
+        source = items()
+        if isinstance(source, (list, tuple)):
+            for item in source:
+                if stop.is_set():
+                    return
+                yield item
+            return
+
+        iterator = iter(source)
+        try:
+            with _extraction_slots:
+                for item in iterator:
+                    if stop.is_set():
+                        return
+                    yield item
+        finally:
+            # A cancelled streaming source releases its connection (and rate limit slot) now
+            close = getattr(iterator, "close", None)
+            if close is not None:
+                close()
+
+    def _generate(self, work_queue, event_queue, stop, refine_queue=None, on_finished=None) -> None:
+        try:
+            while not stop.is_set():
+                try:
+                    work = work_queue.get(timeout=_POLL_INTERVAL)
+                except queue.Empty:
+                    continue
+                if work is _DONE:
+                    break
+
+                index, item = work
+                if refine_queue is None:
+                    image_url = self._generate_image(item)
+                    self._put(event_queue, PipelineEvent("image", index=index, image_url=image_url), stop)
+                    continue
+
+                with _generation_slots:
+                    try:
+                        preview_url, final = self.preview(item["name"], item.get("description", ""))
+                    except Exception:
+                        preview_url, final = None, False
+
+                if final:
+                    # The full image was already stored; nothing left to refine
+                    self._put(event_queue, PipelineEvent("image", index=index, image_url=preview_url), stop)
+                    continue
+                if preview_url:
+                    self._put(event_queue, PipelineEvent("preview", index=index, image_url=preview_url), stop)
+                refine_queue.put((index, item))
+        finally:
+            if on_finished is not None:
+                on_finished()
+            self._put(event_queue, _DONE, stop)
+
+    def _refine(self, refine_queue, event_queue, stop) -> None:
+        try:
+            while not stop.is_set():
+                try:
+                    work = refine_queue.get(timeout=_POLL_INTERVAL)
+                except queue.Empty:
+                    continue
+                if work is _DONE:
+                    break
+
+                index, item = work
+                image_url = self._generate_image(item)
+                self._put(event_queue, PipelineEvent("image", index=index, image_url=image_url), stop)
+        finally:
+            self._put(event_queue, _DONE, stop)
+
+    def _generate_image(self, item: Dict) -> Optional[str]:
+        with _generation_slots:
+            try:
+                return self.generate(item["name"], item.get("description", ""))
+            except Exception:
+                return None
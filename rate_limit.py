@@ -0,0 +1,393 @@
+"""
+Provider-aware rate limiting for the Groq and Together APIs.
+
+Every call to a provider goes through its RateLimiter, which combines:
+
+- token buckets for requests per minute and tokens per minute,
+- an AIMD concurrency limit (additive increase on success, multiplicative
+  decrease when the provider throttles us),
+- retries of throttled and transient failures, honoring Retry-After and
+  otherwise backing off exponentially with full jitter.
+
+A Retry-After from one call pauses the whole provider, so parallel workers do
+not keep hammering it while it is throttling.
+
+Streaming calls go through RateLimiter.stream(), which keeps the call's
+concurrency slot until the stream has been read to the end.
+"""
+import time
+import random
+import threading
+from typing import Callable, Dict, Iterable, Iterator, Optional, Tuple, TypeVar
+
+from config import get_settings
+
+T = TypeVar("T")
+
+# HTTP statuses worth retrying: throttling and temporary server trouble
+RETRYABLE_STATUSES = {408, 409, 429, 500, 502, 503, 504}
+
+# Provider pauses shorter than this are not worth a shared pause
+_MIN_PAUSE = 0.05
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket holding up to `capacity` tokens, refilled at `rate` tokens per second.
+
+    Callers may take more than is left (e.g. when actual usage exceeds an estimate),
+    which puts the bucket into debt that later callers wait out.
+    """
+
+    def __init__(self, capacity: float, rate: float):
+        self.capacity = capacity
+        self.rate = rate
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, amount: float = 1) -> None:
+        """Blocks until `amount` tokens are available, then takes them."""
+        # A request larger than the bucket could never run; let it through once the bucket is full
+        amount = min(amount, self.capacity)
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= amount:
+                    self._tokens -= amount
+                    return
+                wait_time = (amount - self._tokens) / self.rate
+            time.sleep(wait_time)
+
+    def adjust(self, amount: float) -> None:
+        """Takes (positive) or returns (negative) tokens without waiting, e.g. to correct an estimate."""
+        with self._lock:
+            self._refill()
+            self._tokens = min(self.capacity, self._tokens - amount)
+
+
+class AdaptiveConcurrency:
+    """
+    Concurrency limit that follows the AIMD pattern.
+
+    Each success raises the limit by 1/limit (about +1 per round of `limit` calls);
+    each throttle multiplies it by `decrease`, at most once per `cooldown` seconds
+    so a burst of 429s from calls already in flight counts as one signal.
+    """
+
+    def __init__(self, max_limit: int, min_limit: int = 1, decrease: float = 0.5, cooldown: float = 1.0):
+        self.max_limit = max(1, max_limit)
+        self.min_limit = max(1, min(min_limit, self.max_limit))
+        self.decrease = decrease
+        self.cooldown = cooldown
+        self.limit = float(self.max_limit)
+        self._in_flight = 0
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+
+    def acquire(self) -> None:
+        with self._condition:
+            while self._in_flight >= int(self.limit):
+                self._condition.wait()
+            self._in_flight += 1
+
+    def release(self) -> None:
+        with self._condition:
+            self._in_flight -= 1
+            self._condition.notify()
+
+    def on_success(self) -> None:
+        with self._condition:
+            before = int(self.limit)
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            if int(self.limit) > before:
+                self._condition.notify()
+
+    def on_throttle(self) -> None:
+        with self._condition:
+            now = time.monotonic()
+            if now - self._last_decrease >= self.cooldown:
+                self.limit = max(self.min_limit, self.limit * self.decrease)
+                self._last_decrease = now
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+
+class RateLimitExceeded(Exception):
+    """Raised when a call is still throttled after every retry."""
+
+
+class RateLimiter:
+    """
+    Shared limiter for one provider.
+
+    Args:
+        name: The provider name (used in error messages).
+        requests_per_minute: The request budget, or None for no request limit.
+        tokens_per_minute: The token budget, or None for no token limit.
+        max_concurrency: The upper bound of the adaptive concurrency limit.
+        min_concurrency: The lower bound of the adaptive concurrency limit.
+        max_retries: How many times a throttled or transient failure is retried.
+        base_delay: The first backoff delay in seconds (doubled per attempt).
+        max_delay: The longest single backoff delay in seconds.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        requests_per_minute: Optional[float] = None,
+        tokens_per_minute: Optional[float] = None,
+        max_concurrency: int = 8,
+        min_concurrency: int = 1,
+        max_retries: int = 5,
+        base_delay: float = 0.5,
+        max_delay: float = 30.0
+    ):
+        self.name = name
+        self.requests = TokenBucket(requests_per_minute, requests_per_minute / 60) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute, tokens_per_minute / 60) if tokens_per_minute else None
+        self.concurrency = AdaptiveConcurrency(max_concurrency, min_concurrency)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._paused_until = 0.0
+        self._pause_lock = threading.Lock()
+
+    def call(self, fn: Callable[[], T], tokens: int = 0, usage: Optional[Callable[[T], Optional[int]]] = None) -> T:
+        """
+        Runs a provider call within the limits, retrying throttled and transient failures.
+
+        Args:
+            fn: The call to make; it should raise on HTTP errors (e.g. via raise_for_status).
+            tokens: The estimated number of tokens the call consumes.
+            usage: An optional function returning the actual tokens used from the result,
+                to correct the estimate.
+
+        Returns:
+            The result of fn.
+
+        Raises:
+            RateLimitExceeded: If the provider still throttles after max_retries retries.
+            Exception: Any non-retryable error raised by fn, or the last transient error.
+        """
+        attempt = 0
+        while True:
+            self._acquire_budget(tokens)
+            self.concurrency.acquire()
+            try:
+                result = fn()
+            except Exception as e:
+                delay = self._on_failure(e, attempt)
+                attempt += 1
+            else:
+                self.concurrency.on_success()
+                if usage is not None:
+                    self._correct_tokens(tokens, usage, result)
+                return result
+            finally:
+                self.concurrency.release()
+
+            time.sleep(delay)
+
+    def stream(self, open_stream: Callable[[], Iterable[T]], tokens: int = 0, usage: Optional[Callable[[T], Optional[int]]] = None) -> Iterator[T]:
+        """
+        Runs a streaming provider call within the limits, holding its concurrency slot until the stream ends.
+
+        Failures before the first chunk are retried like call() retries them. A failure
+        after chunks were yielded cannot be retried transparently, since the caller has
+        already consumed them; it still counts as a throttle (and pauses the provider on
+        Retry-After) before it is raised.
+
+        Args:
+            open_stream: The call that opens the stream; it should raise on HTTP errors.
+            tokens: The estimated number of tokens the call consumes.
+            usage: An optional function returning the actual tokens used from a chunk, or
+                None for chunks that do not report usage; the last reported value is used.
+
+        Yields:
+            The chunks of the stream.
+
+        Raises:
+            RateLimitExceeded: If the provider still throttles after max_retries retries.
+            Exception: Any non-retryable error, an error after the first chunk, or the last
+                transient error.
+        """
+        attempt = 0
+        while True:
+            self._acquire_budget(tokens)
+            self.concurrency.acquire()
+            started = False
+            try:
+                actual = None
+                for chunk in open_stream():
+                    started = True
+                    if usage is not None:
+                        actual = _safe_usage(usage, chunk) or actual
+                    yield chunk
+            except Exception as e:
+                if started:
+                    self._record_throttle(e)
+                    raise
+                delay = self._on_failure(e, attempt)
+                attempt += 1
+            else:
+                self.concurrency.on_success()
+                if actual is not None and self.tokens is not None:
+                    self.tokens.adjust(actual - tokens)
+                return
+            finally:
+                # Also runs when the caller stops iterating early (GeneratorExit)
+                self.concurrency.release()
+
+            time.sleep(delay)
+
+    def _acquire_budget(self, tokens: int) -> None:
+        self._wait_for_pause()
+        if self.requests is not None:
+            self.requests.acquire(1)
+        if self.tokens is not None and tokens:
+            self.tokens.acquire(tokens)
+
+    def _on_failure(self, error: Exception, attempt: int) -> float:
+        """
+        Feeds a failed attempt back into the limits and returns how long to wait before retrying.
+
+        Raises:
+            Exception: The error itself if it is not retryable or attempt used up the retries.
+        """
+        if not _is_retryable(error, _status_code(error)):
+            raise error
+
+        throttled, retry_after = self._record_throttle(error)
+        if attempt >= self.max_retries:
+            if throttled:
+                raise RateLimitExceeded(f"{self.name} is still rate limiting after {attempt} retries") from error
+            raise error
+
+        if retry_after is not None:
+            return 0.0
+        # Full jitter spreads the retries of parallel callers apart
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def _record_throttle(self, error: Exception) -> Tuple[bool, Optional[float]]:
+        """Shrinks the concurrency limit on a 429 and pauses the provider on Retry-After."""
+        throttled = _status_code(error) == 429
+        if throttled:
+            self.concurrency.on_throttle()
+
+        retry_after = _retry_after(error)
+        if retry_after is not None:
+            # The provider told us when to come back; hold every caller until then
+            self._pause(retry_after)
+        return throttled, retry_after
+
+    def _correct_tokens(self, tokens: int, usage: Callable[[T], Optional[int]], result: T) -> None:
+        actual = _safe_usage(usage, result)
+        if actual is not None and self.tokens is not None:
+            self.tokens.adjust(actual - tokens)
+
+    def _pause(self, seconds: float) -> None:
+        if seconds < _MIN_PAUSE:
+            return
+        with self._pause_lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + min(seconds, self.max_delay))
+
+    def _wait_for_pause(self) -> None:
+        while True:
+            with self._pause_lock:
+                remaining = self._paused_until - time.monotonic()
+            if remaining <= 0:
+                return
+            time.sleep(remaining)
+
+
+def _safe_usage(usage: Callable[[T], Optional[int]], result: T) -> Optional[int]:
+    try:
+        return usage(result)
+    except Exception:
+        return None
+
+
+# --- Error Classification ---
+
+def _status_code(error: Exception) -> Optional[int]:
+    """Returns the HTTP status of a failed call (requests, httpx and SDK errors all carry one)."""
+    status = getattr(error, "status_code", None)
+    if status is None:
+        response = getattr(error, "response", None)
+        status = getattr(response, "status_code", None)
+    return status if isinstance(status, int) else None
+
+def _is_retryable(error: Exception, status: Optional[int]) -> bool:
+    if status is not None:
+        return status in RETRYABLE_STATUSES
+    # No HTTP response at all: connection resets, timeouts and similar transport failures
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    name = type(error).__name__
+    return "Timeout" in name or "Connection" in name
+
+def _retry_after(error: Exception) -> Optional[float]:
+    """Reads the Retry-After (or retry-after-ms) header of a failed call, in seconds."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+
+    try:
+        value = headers.get("retry-after-ms")
+        if value is not None:
+            return max(0.0, float(value) / 1000)
+        value = headers.get("retry-after")
+        if value is not None:
+            return max(0.0, float(value))
+    except (TypeError, ValueError):
+        # An HTTP date instead of seconds; fall back to our own backoff
+        pass
+    return None
+
+
+# --- Provider Limiters ---
+
+_limiters: Dict[str, RateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+def get_rate_limiter(provider: str) -> RateLimiter:
+    """
+    Returns the process-wide limiter for a provider ("groq" or "together"), creating it on first use.
+    """
+    with _limiters_lock:
+        limiter = _limiters.get(provider)
+        if limiter is None:
+            settings = get_settings()
+            common = dict(
+                max_retries=settings.rate_limit_max_retries,
+                base_delay=settings.rate_limit_base_delay,
+                max_delay=settings.rate_limit_max_delay
+            )
+            if provider == "groq":
+                limiter = RateLimiter(
+                    "Groq",
+                    requests_per_minute=settings.groq_rpm,
+                    tokens_per_minute=settings.groq_tpm,
+                    max_concurrency=settings.groq_max_concurrency,
+                    **common
+                )
+            elif provider == "together":
+                limiter = RateLimiter(
+                    "Together AI",
+                    requests_per_minute=settings.together_rpm,
+                    max_concurrency=settings.together_max_concurrency,
+                    **common
+                )
+            else:
+                raise ValueError(f"Unknown provider: {provider}")
+            _limiters[provider] = limiter
+        return limiter
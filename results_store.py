@@ -0,0 +1,145 @@
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Tuple
+
+from config import get_settings
+
+# --- Configuration ---
+settings = get_settings()
+
+# Menus whose results a session keeps (least recently viewed are dropped first)
+SESSION_RESULTS_MAX_MENUS = max(1, settings.session_results_max_menus)
+
+# Per-dish status
+PENDING = "pending"
+PREVIEW = "preview"  # Showing a low-resolution preview; the full image is still missing
+READY = "ready"
+FAILED = "failed"
+
+
+def _key(dish_name: Optional[str], description: Optional[str]) -> Tuple[str, str]:
+    # The same defaults the cards use, so a dish matches however its caller filled in gaps
+    return dish_name or "N/A", description or "No description provided."
+
+
+@dataclass
+class DishResult:
+    """One extracted dish and the state of its image."""
+    item: Dict
+    status: str = PENDING
+    image_url: Optional[str] = None
+
+    @property
+    def key(self) -> Tuple[str, str]:
+        return _key(self.item.get("name"), self.item.get("description"))
+
+
+@dataclass
+class MenuResults:
+    """
+    Everything computed for one menu: the extracted items, their images and their status.
+
+    Attributes:
+        menu: The SHA-256 of the uploaded menu image.
+        extracted_text: The raw model output, if any.
+        dishes: The extracted dishes, in menu order.
+        complete: Whether extraction finished (a streaming extraction cut short by a rerun is not).
+        page: The gallery page on screen (paginated gallery mode).
+    """
+    menu: str
+    extracted_text: Optional[str] = None
+    dishes: List[DishResult] = field(default_factory=list)
+    complete: bool = False
+    page: int = 0
+
+    @property
+    def items(self) -> List[Dict]:
+        return [dish.item for dish in self.dishes]
+
+    def set_items(self, items: List[Dict], extracted_text: Optional[str] = None) -> None:
+        """Records a finished extraction."""
+        self.dishes = [DishResult(item) for item in items]
+        self.extracted_text = extracted_text
+        self.complete = True
+
+    def add_item(self, item: Dict) -> int:
+        """Records one streamed item and returns its index."""
+        self.dishes.append(DishResult(item))
+        return len(self.dishes) - 1
+
+    def record_preview(self, index: int, image_url: Optional[str]) -> None:
+        dish = self.dishes[index]
+        if image_url and dish.status != READY:
+            dish.status, dish.image_url = PREVIEW, image_url
+
+    def record_image(self, index: int, image_url: Optional[str]) -> None:
+        """Records the final image of a dish; a failure keeps any preview on screen but stays retryable."""
+        dish = self.dishes[index]
+        if image_url:
+            dish.status, dish.image_url = READY, image_url
+        else:
+            dish.status = FAILED
+
+    def missing(self) -> List[int]:
+        """Returns the indexes of dishes that still need their full image."""
+        return [index for index, dish in enumerate(self.dishes) if dish.status != READY]
+
+    def ready_images(self) -> Dict[Tuple[str, str], str]:
+        """Returns the finished image URL of every ready dish, by (name, description)."""
+        return {dish.key: dish.image_url for dish in self.dishes if dish.status == READY}
+
+    def cached_generate(self, generate: Callable[[str, str], Optional[str]]) -> Callable[[str, str], Optional[str]]:
+        """Wraps an image generator so dishes that are already ready are answered from memory."""
+        ready = self.ready_images()
+        return lambda dish_name, description: ready.get(_key(dish_name, description)) or generate(dish_name, description)
+
+    def cached_preview(self, preview: Callable[[str, str], Tuple[Optional[str], bool]]) -> Callable[[str, str], Tuple[Optional[str], bool]]:
+        """Wraps a preview function so ready dishes skip both requests and previewed ones skip the preview."""
+        ready = self.ready_images()
+        previews = {dish.key: dish.image_url for dish in self.dishes if dish.status == PREVIEW}
+
+        def preview_or_ready(dish_name: str, description: str) -> Tuple[Optional[str], bool]:
+            key = _key(dish_name, description)
+            if key in ready:
+                return ready[key], True
+            if key in previews:
+                return previews[key], False
+            return preview(dish_name, description)
+
+        return preview_or_ready
+
+
+class ResultsStore:
+    """
+    A session's results, by menu content hash.
+
+    Kept in st.session_state, so widget interactions and other reruns re-render
+    from memory instead of extracting and generating everything again.
+    """
+
+    def __init__(self, max_menus: int = SESSION_RESULTS_MAX_MENUS):
+        self.max_menus = max_menus
+        self._menus: "OrderedDict[str, MenuResults]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, menu: str) -> Optional[MenuResults]:
+        """Returns the results of a menu, or None if it was not processed in this session."""
+        with self._lock:
+            results = self._menus.get(menu)
+            if results is not None:
+                self._menus.move_to_end(menu)
+            return results
+
+    def start(self, menu: str) -> MenuResults:
+        """Starts (or restarts) the results of a menu, dropping the oldest menus beyond max_menus."""
+        with self._lock:
+            results = self._menus[menu] = MenuResults(menu)
+            self._menus.move_to_end(menu)
+            while len(self._menus) > self.max_menus:
+                self._menus.popitem(last=False)
+            return results
+
+    def discard(self, menu: str) -> None:
+        with self._lock:
+            self._menus.pop(menu, None)
@@ -1,43 +1,153 @@
 import os
+import sys
 import json
+import logging
+import time
+import hashlib
+import mimetypes
+import threading
+from collections import OrderedDict
 import boto3
 from botocore.client import Config
-import streamlit as st
-from typing import Optional, Dict, List, Union, BinaryIO
+from botocore.exceptions import ClientError
+from boto3.s3.transfer import TransferConfig
+from typing import Optional, Dict, List, Union, BinaryIO, Iterator, Iterable
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime, timedelta, timezone
 import io
 
+from config import get_settings, project_ref
+from metrics import timed, is_none
+
+logger = logging.getLogger(__name__)
+
 # --- Configuration ---
+settings = get_settings()
+
 # Access keys from environment variables or Streamlit secrets
-SUPABASE_URL = os.environ.get("SUPABASE_URL") or st.secrets.get("SUPABASE_URL", "")
-SUPABASE_KEY = os.environ.get("SUPABASE_ANON_KEY") or st.secrets.get("SUPABASE_ANON_KEY", "")
+SUPABASE_URL = settings.supabase_url or ""
+SUPABASE_KEY = settings.supabase_key or ""
 SUPABASE_BUCKET_NAME = "menuviz"  # Default bucket name
 
 # Extract project reference from Supabase URL
 # Example: https://bxtluxytxmydgmztplrt.supabase.co -> bxtluxytxmydgmztplrt
 def get_project_ref() -> str:
     """Extract project reference from Supabase URL."""
-    if not SUPABASE_URL:
-        return ""
-
-    # Extract the subdomain from the URL
-    try:
-        # Remove https:// and split by dots
-        parts = SUPABASE_URL.replace("https://", "").split(".")
-        return parts[0]
-    except Exception:
-        return ""
+    return project_ref(SUPABASE_URL)
 
 PROJECT_REF = get_project_ref()
 
-# Get S3 endpoint and region from environment variables or construct from Supabase URL
-S3_ENDPOINT = os.environ.get("S3_ENDPOINT") or st.secrets.get("S3_ENDPOINT", f"https://{PROJECT_REF}.supabase.co/storage/v1/s3")
-REGION = os.environ.get("S3_REGION") or st.secrets.get("S3_REGION", "us-east-1")  # Default region
+# S3 endpoint and region (the endpoint defaults to the project's storage endpoint)
+S3_ENDPOINT = settings.s3_endpoint
+REGION = settings.s3_region
+
+# Client tuning: shared clients serve many threads, so the connection pool must be larger
+# than botocore's default of 10, and retries back off adaptively under throttling
+S3_MAX_POOL_CONNECTIONS = settings.s3_max_pool_connections
+S3_MAX_ATTEMPTS = settings.s3_max_attempts
+S3_RETRY_MODE = settings.s3_retry_mode
+S3_CONNECT_TIMEOUT = settings.s3_connect_timeout
+S3_READ_TIMEOUT = settings.s3_read_timeout
+S3_TCP_KEEPALIVE = settings.s3_tcp_keepalive
+S3_CLIENT_REGISTRY_SIZE = settings.s3_client_registry_size
+
+# Multipart upload settings (S3 requires parts of at least 5 MB)
+S3_MULTIPART_PART_SIZE = settings.s3_multipart_part_size
+S3_MULTIPART_CONCURRENCY = settings.s3_multipart_concurrency
+MIN_MULTIPART_PART_SIZE = 5 * 1024 * 1024
+
+# Bulk delete settings (delete_objects accepts at most 1000 keys per request)
+S3_DELETE_CONCURRENCY = settings.s3_delete_concurrency
+MAX_DELETE_BATCH_SIZE = 1000
+
+# How long a verified bucket is trusted before it is probed again (seconds)
+BUCKET_CACHE_TTL = settings.bucket_cache_ttl
+
+# --- Error Reporting ---
+
+def _streamlit():
+    """Returns the streamlit module if the app has loaded it, so batch jobs never import it."""
+    return sys.modules.get("streamlit")
+
+def _report_error(message: str) -> None:
+    """Shows an error in the app, or logs it when running outside Streamlit."""
+    st = _streamlit()
+    if st is not None:
+        st.error(message)
+    else:
+        logger.error(message)
 
 # --- S3 Client Creation Functions ---
 
+def build_client_config() -> Config:
+    """Returns the tuned botocore configuration shared by all S3 clients."""
+    return Config(
+        s3={'addressing_style': 'path'},
+        max_pool_connections=S3_MAX_POOL_CONNECTIONS,
+        retries={'max_attempts': S3_MAX_ATTEMPTS, 'mode': S3_RETRY_MODE},
+        connect_timeout=S3_CONNECT_TIMEOUT,
+        read_timeout=S3_READ_TIMEOUT,
+        tcp_keepalive=S3_TCP_KEEPALIVE
+    )
+
+# Process-wide client registry: credential fingerprint -> client, least recently used first.
+# boto3 clients are thread-safe, so one client per credential set serves every session.
+_client_registry: "OrderedDict[str, boto3.client]" = OrderedDict()
+_client_registry_lock = threading.Lock()
+
+def get_s3_client(access_key_id: str, secret_access_key: str, session_token: Optional[str] = None) -> boto3.client:
+    """
+    Return the shared S3 client for a set of credentials, creating it on first use.
+
+    Args:
+        access_key_id: The access key ID
+        secret_access_key: The secret access key
+        session_token: An optional session token (JWT)
+
+    Returns:
+        An S3 client
+
+    Raises:
+        Exception: If the client cannot be created
+    """
+    # Fingerprint the credentials so secrets are not kept as dictionary keys
+    fingerprint = hashlib.sha256(
+        "\0".join([S3_ENDPOINT, REGION, access_key_id, secret_access_key, session_token or ""]).encode("utf-8")
+    ).hexdigest()
+
+    with _client_registry_lock:
+        client = _client_registry.get(fingerprint)
+        if client is not None:
+            _client_registry.move_to_end(fingerprint)
+            return client
+
+        # Client creation through the default session is not thread-safe; use a private session
+        client = boto3.session.Session().client(
+            's3',
+            endpoint_url=S3_ENDPOINT,
+            aws_access_key_id=access_key_id,
+            aws_secret_access_key=secret_access_key,
+            aws_session_token=session_token,
+            region_name=REGION,
+            config=build_client_config()
+        )
+        _client_registry[fingerprint] = client
+
+        # Session tokens are per user, so bound the registry
+        while len(_client_registry) > S3_CLIENT_REGISTRY_SIZE:
+            _client_registry.popitem(last=False)
+
+        return client
+
+def clear_s3_client_registry() -> None:
+    """Drop all shared clients (e.g. after rotating credentials)."""
+    with _client_registry_lock:
+        _client_registry.clear()
+
 def create_s3_client_with_access_keys(access_key_id: str, secret_access_key: str) -> Optional[boto3.client]:
     """
     Create an S3 client using Supabase S3 access keys (server-side use only).
+    Clients are shared process-wide per credential set (see get_s3_client).
 
     Args:
         access_key_id: The S3 access key ID from Supabase
@@ -47,27 +157,20 @@ def create_s3_client_with_access_keys(access_key_id: str, secret_access_key: str
         An S3 client or None if creation fails
     """
     if not access_key_id or not secret_access_key:
-        st.error("S3 access keys not provided")
+        _report_error("S3 access keys not provided")
         return None
 
     try:
-        s3_client = boto3.client(
-            's3',
-            endpoint_url=S3_ENDPOINT,
-            aws_access_key_id=access_key_id,
-            aws_secret_access_key=secret_access_key,
-            region_name=REGION,
-            config=Config(s3={'addressing_style': 'path'})
-        )
-        return s3_client
+        return get_s3_client(access_key_id, secret_access_key)
     except Exception as e:
-        st.error(f"Error creating S3 client with access keys: {e}")
+        _report_error(f"Error creating S3 client with access keys: {e}")
         return None
 
 def create_s3_client_with_session_token(jwt_token: str) -> Optional[boto3.client]:
     """
     Create an S3 client using a JWT token for user-authenticated access.
-    This respects RLS policies set in Supabase.
+    This respects RLS policies set in Supabase. Clients are shared process-wide
+    per token (see get_s3_client).
 
     Args:
         jwt_token: A valid JWT token from Supabase auth
@@ -76,26 +179,173 @@ def create_s3_client_with_session_token(jwt_token: str) -> Optional[boto3.client
         An S3 client or None if creation fails
     """
     if not PROJECT_REF or not SUPABASE_KEY or not jwt_token:
-        st.error("Missing required credentials for S3 session token authentication")
+        _report_error("Missing required credentials for S3 session token authentication")
         return None
 
     try:
-        s3_client = boto3.client(
-            's3',
-            endpoint_url=S3_ENDPOINT,
-            aws_access_key_id=PROJECT_REF,
-            aws_secret_access_key=SUPABASE_KEY,
-            aws_session_token=jwt_token,
-            region_name=REGION,
-            config=Config(s3={'addressing_style': 'path'})
-        )
-        return s3_client
+        return get_s3_client(PROJECT_REF, SUPABASE_KEY, session_token=jwt_token)
     except Exception as e:
-        st.error(f"Error creating S3 client with session token: {e}")
+        _report_error(f"Error creating S3 client with session token: {e}")
         return None
 
 # --- S3 Operations ---
 
+class _SilentElement:
+    """Stand-in for Streamlit progress/status elements when UI feedback is suppressed."""
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+class _TransferProgress:
+    """Byte counter fed by boto3's transfer callback (called from transfer threads)."""
+    def __init__(self, total_bytes: Optional[int]):
+        self.total_bytes = total_bytes
+        self.transferred = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, bytes_amount: int) -> None:
+        with self._lock:
+            self.transferred += bytes_amount
+
+    def percent(self) -> int:
+        if not self.total_bytes:
+            return 0
+        return min(100, int(self.transferred * 100 / self.total_bytes))
+
+def _stream_size(file_data: Union[bytes, BinaryIO, str]) -> Optional[int]:
+    """Returns the number of bytes left to upload, or None if it cannot be known up front."""
+    if isinstance(file_data, str):
+        return os.path.getsize(file_data)
+    if isinstance(file_data, (bytes, bytearray, memoryview)):
+        return len(file_data)
+    try:
+        position = file_data.tell()
+        end = file_data.seek(0, io.SEEK_END)
+        file_data.seek(position)
+        return end - position
+    except (AttributeError, OSError, ValueError):
+        return None
+
+def _multipart_upload(
+    s3_client: boto3.client,
+    file_data: Union[bytes, BinaryIO, str],
+    bucket_name: str,
+    object_name: str,
+    extra_args: Dict,
+    part_size: int,
+    max_concurrency: int,
+    progress_bar,
+    status_placeholder
+) -> None:
+    """
+    Streams a file to S3 with boto3's managed transfer.
+
+    Paths and file-like objects are read part by part rather than loaded whole.
+    The transfer runs on a helper thread while this (script) thread turns the
+    byte-level callback into progress bar updates.
+    """
+    part_size = max(part_size, MIN_MULTIPART_PART_SIZE)
+    transfer_config = TransferConfig(
+        multipart_threshold=part_size,
+        multipart_chunksize=part_size,
+        max_concurrency=max(1, max_concurrency),
+        use_threads=True
+    )
+    progress = _TransferProgress(_stream_size(file_data))
+
+    def transfer():
+        if isinstance(file_data, str):
+            s3_client.upload_file(file_data, bucket_name, object_name, ExtraArgs=extra_args, Callback=progress, Config=transfer_config)
+        else:
+            fileobj = io.BytesIO(file_data) if isinstance(file_data, (bytes, bytearray)) else file_data
+            s3_client.upload_fileobj(fileobj, bucket_name, object_name, ExtraArgs=extra_args, Callback=progress, Config=transfer_config)
+
+    errors = []
+
+    def run():
+        try:
+            transfer()
+        except Exception as e:
+            errors.append(e)
+
+    worker = threading.Thread(target=run, name="s3-multipart-upload", daemon=True)
+    worker.start()
+    while worker.is_alive():
+        worker.join(timeout=0.2)
+        if progress.total_bytes:
+            progress_bar.progress(progress.percent())
+            status_placeholder.info(f"Uploading to {bucket_name}/{object_name}... {progress.transferred / (1024 * 1024):.1f} MB of {progress.total_bytes / (1024 * 1024):.1f} MB")
+        else:
+            status_placeholder.info(f"Uploading to {bucket_name}/{object_name}... {progress.transferred / (1024 * 1024):.1f} MB")
+
+    if errors:
+        raise errors[0]
+
+def _sha256_of(file_data: Union[bytes, BinaryIO, str]) -> str:
+    """Hashes bytes, a file path or a seekable file-like object without loading files whole."""
+    digest = hashlib.sha256()
+    if isinstance(file_data, (bytes, bytearray, memoryview)):
+        digest.update(file_data)
+    elif isinstance(file_data, str):
+        with open(file_data, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+    else:
+        position = file_data.tell()
+        for chunk in iter(lambda: file_data.read(1024 * 1024), b''):
+            digest.update(chunk)
+        file_data.seek(position)
+    return digest.hexdigest()
+
+def content_addressed_key(file_data: Union[bytes, BinaryIO, str], prefix: str = "", content_type: str = "") -> str:
+    """
+    Build an object key from the SHA-256 of the content, so identical files share one key.
+
+    Args:
+        file_data: The file data as bytes, seekable file-like object, or path to file
+        prefix: A "directory" to place the key under (e.g. "menu_uploads")
+        content_type: Used to pick a file extension (e.g. "image/jpeg" -> ".jpg")
+
+    Returns:
+        The object key, e.g. "menu_uploads/<sha256>.jpg"
+    """
+    extension = (mimetypes.guess_extension(content_type) or "") if content_type else ""
+    name = f"{_sha256_of(file_data)}{extension}"
+    return f"{prefix.rstrip('/')}/{name}" if prefix else name
+
+@timed("s3_head")
+def object_exists(
+    object_name: str,
+    bucket_name: str = SUPABASE_BUCKET_NAME,
+    s3_client: Optional[boto3.client] = None,
+    access_key_id: str = "",
+    secret_access_key: str = "",
+    jwt_token: str = ""
+) -> bool:
+    """
+    Check whether an object exists with a single HEAD request.
+
+    Args:
+        object_name: The name of the object
+        bucket_name: The name of the bucket
+        s3_client: An existing S3 client (optional)
+        access_key_id: S3 access key ID (if s3_client not provided)
+        secret_access_key: S3 secret access key (if s3_client not provided)
+        jwt_token: JWT token for user authentication (if s3_client not provided)
+
+    Returns:
+        True if the object exists, False if it does not or the check fails
+    """
+    s3_client = _resolve_s3_client(s3_client, access_key_id, secret_access_key, jwt_token)
+    if s3_client is None:
+        return False
+
+    try:
+        s3_client.head_object(Bucket=bucket_name, Key=object_name)
+        return True
+    except Exception:
+        return False
+
+@timed("s3_upload", failed=is_none)
 def upload_file(
     file_data: Union[bytes, BinaryIO, str],
     object_name: str,
@@ -104,7 +354,14 @@ def upload_file(
     content_type: str = "application/octet-stream",
     access_key_id: str = "",
     secret_access_key: str = "",
-    jwt_token: str = ""
+    jwt_token: str = "",
+    quiet: bool = False,
+    multipart: bool = False,
+    part_size: int = S3_MULTIPART_PART_SIZE,
+    max_concurrency: int = S3_MULTIPART_CONCURRENCY,
+    content_addressed: bool = False,
+    skip_if_exists: bool = False,
+    cache_control: Optional[str] = None
 ) -> Optional[str]:
     """
     Upload a file to Supabase Storage using S3 API.
@@ -118,13 +375,22 @@ def upload_file(
         access_key_id: S3 access key ID (if s3_client not provided)
         secret_access_key: S3 secret access key (if s3_client not provided)
         jwt_token: JWT token for user authentication (if s3_client not provided)
+        quiet: Suppress progress and error UI (for background and worker-thread use)
+        multipart: Stream the file in parts with boto3's managed transfer instead of one put_object
+        part_size: Size of each multipart part in bytes (at least 5 MB)
+        max_concurrency: Number of parts uploaded in parallel
+        content_addressed: Treat object_name as a prefix and name the object after the
+            SHA-256 of its content (see content_addressed_key); implies skip_if_exists
+        skip_if_exists: Skip the upload if an object with the final key already exists
+        cache_control: Cache-Control header served with the object (e.g. for immutable assets)
 
     Returns:
         The public URL of the uploaded file or None if upload fails
     """
-    # Create a progress bar
-    progress_bar = st.progress(0)
-    status_placeholder = st.empty()
+    # Create a progress bar (only inside the app; batch jobs and worker threads pass quiet=True)
+    st = None if quiet else _streamlit()
+    progress_bar = _SilentElement() if st is None else st.progress(0)
+    status_placeholder = _SilentElement() if st is None else st.empty()
     status_placeholder.info("Preparing to upload file...")
 
     try:
@@ -144,35 +410,61 @@ def upload_file(
             progress_bar.empty()
             return None
 
-        # Update progress
-        progress_bar.progress(25)
-        status_placeholder.info("Preparing file data...")
-
-        # Handle different file_data types
-        if isinstance(file_data, str):
-            # Assume it's a file path
-            with open(file_data, 'rb') as f:
-                file_bytes = f.read()
-        elif isinstance(file_data, bytes):
-            file_bytes = file_data
+        if content_addressed:
+            object_name = content_addressed_key(file_data, prefix=object_name, content_type=content_type)
+            skip_if_exists = True
+
+        extra_args = {'ContentType': content_type}
+        if cache_control:
+            extra_args['CacheControl'] = cache_control
+
+        if skip_if_exists and object_exists(object_name, bucket_name, s3_client=s3_client):
+            # The object is already stored; skip the upload entirely
+            status_placeholder.info(f"{bucket_name}/{object_name} already exists; skipping upload...")
+        elif multipart:
+            # Stream the file part by part; progress follows the bytes actually sent
+            _multipart_upload(
+                s3_client,
+                file_data,
+                bucket_name,
+                object_name,
+                extra_args,
+                part_size,
+                max_concurrency,
+                progress_bar,
+                status_placeholder
+            )
         else:
-            # Assume it's a file-like object
-            file_bytes = file_data.read()
+            # Update progress
+            progress_bar.progress(25)
+            status_placeholder.info("Preparing file data...")
+
+            # Handle different file_data types
+            if isinstance(file_data, str):
+                # Assume it's a file path
+                with open(file_data, 'rb') as f:
+                    file_bytes = f.read()
+            elif isinstance(file_data, bytes):
+                file_bytes = file_data
+            else:
+                # Assume it's a file-like object
+                file_bytes = file_data.read()
 
-        # Update progress
-        progress_bar.progress(50)
-        status_placeholder.info(f"Uploading to {bucket_name}/{object_name}...")
+            # Update progress
+            progress_bar.progress(50)
+            status_placeholder.info(f"Uploading to {bucket_name}/{object_name}...")
 
-        # Upload the file
-        s3_client.put_object(
-            Bucket=bucket_name,
-            Key=object_name,
-            Body=file_bytes,
-            ContentType=content_type
-        )
+            # Upload the file
+            s3_client.put_object(
+                Bucket=bucket_name,
+                Key=object_name,
+                Body=file_bytes,
+                **extra_args
+            )
 
         # Update progress
-        progress_bar.progress(75)
+        if not multipart:
+            progress_bar.progress(75)
         status_placeholder.info("Generating public URL...")
 
         # Generate the public URL
@@ -190,24 +482,153 @@ def upload_file(
         progress_bar.empty()
         error_msg = str(e)
         status_placeholder.error(f"Upload failed: {error_msg}")
+        if st is None and not quiet:
+            logger.error(f"Upload failed: {error_msg}")
 
         # Debug output
-        with st.expander("Error Details", expanded=False):
-            st.error(f"Error type: {type(e).__name__}")
-            st.error(f"Error message: {error_msg}")
+        if st is not None:
+            with st.expander("Error Details", expanded=False):
+                st.error(f"Error type: {type(e).__name__}")
+                st.error(f"Error message: {error_msg}")
 
         return None
 
-def list_files(
+def _resolve_s3_client(
+    s3_client: Optional[boto3.client],
+    access_key_id: str,
+    secret_access_key: str,
+    jwt_token: str
+) -> Optional[boto3.client]:
+    """Returns the given client, or creates one from the credentials (None if that is not possible)."""
+    if s3_client is not None:
+        return s3_client
+    if jwt_token:
+        return create_s3_client_with_session_token(jwt_token)
+    if access_key_id and secret_access_key:
+        return create_s3_client_with_access_keys(access_key_id, secret_access_key)
+    return None
+
+def iter_object_pages(
+    bucket_name: str = SUPABASE_BUCKET_NAME,
+    prefix: str = "",
+    delimiter: str = "",
+    max_keys: Optional[int] = None,
+    page_size: int = 1000,
+    continuation_token: Optional[str] = None,
+    s3_client: Optional[boto3.client] = None,
+    access_key_id: str = "",
+    secret_access_key: str = "",
+    jwt_token: str = ""
+) -> Iterator[Dict]:
+    """
+    Lazily list a bucket one page at a time using S3 API.
+
+    Only one page is held in memory at a time, so arbitrarily large prefixes can be
+    walked. Each page carries the token to resume from, so an interrupted walk can be
+    continued by passing it back as continuation_token.
+
+    Args:
+        bucket_name: The name of the bucket to list
+        prefix: Filter results to objects with this prefix
+        delimiter: Group keys into "directories" on this character (e.g. "/")
+        max_keys: Stop after this many objects and prefixes in total (None for no limit)
+        page_size: Number of keys requested per call (at most 1000)
+        continuation_token: Token from a previous page to resume listing after it
+        s3_client: An existing S3 client (optional)
+        access_key_id: S3 access key ID (if s3_client not provided)
+        secret_access_key: S3 secret access key (if s3_client not provided)
+        jwt_token: JWT token for user authentication (if s3_client not provided)
+
+    Yields:
+        Dicts with "objects" (the page's object entries), "prefixes" (its common
+        prefixes when a delimiter is used) and "next_token" (None on the last page)
+
+    Raises:
+        RuntimeError: If no S3 client can be created
+        botocore.exceptions.ClientError: If a list call fails
+    """
+    s3_client = _resolve_s3_client(s3_client, access_key_id, secret_access_key, jwt_token)
+    if s3_client is None:
+        raise RuntimeError("No authentication method provided")
+
+    remaining = max_keys
+    token = continuation_token
+
+    while remaining is None or remaining > 0:
+        request = {
+            'Bucket': bucket_name,
+            'Prefix': prefix,
+            # Ask for no more than the limit so the returned token resumes exactly after it
+            'MaxKeys': min(page_size, 1000) if remaining is None else min(page_size, 1000, remaining)
+        }
+        if delimiter:
+            request['Delimiter'] = delimiter
+        if token:
+            request['ContinuationToken'] = token
+
+        response = s3_client.list_objects_v2(**request)
+
+        objects = response.get('Contents', [])
+        prefixes = [entry['Prefix'] for entry in response.get('CommonPrefixes', [])]
+        token = response.get('NextContinuationToken') if response.get('IsTruncated') else None
+
+        yield {"objects": objects, "prefixes": prefixes, "next_token": token}
+
+        if remaining is not None:
+            remaining -= len(objects) + len(prefixes)
+        if token is None:
+            break
+
+def iter_objects(
     bucket_name: str = SUPABASE_BUCKET_NAME,
     prefix: str = "",
+    delimiter: str = "",
+    max_keys: Optional[int] = None,
+    continuation_token: Optional[str] = None,
     s3_client: Optional[boto3.client] = None,
     access_key_id: str = "",
     secret_access_key: str = "",
     jwt_token: str = ""
+) -> Iterator[Dict]:
+    """
+    Lazily list the objects in a bucket using S3 API, across as many pages as needed.
+
+    With a delimiter, each "directory" is yielded once as {"Prefix": ..., "IsDirectory": True}
+    alongside the objects directly under prefix. See iter_object_pages for the arguments
+    and for resuming with a continuation token.
+
+    Yields:
+        Object entries as returned by list_objects_v2 (Key, Size, LastModified, ...)
+    """
+    for page in iter_object_pages(
+        bucket_name=bucket_name,
+        prefix=prefix,
+        delimiter=delimiter,
+        max_keys=max_keys,
+        continuation_token=continuation_token,
+        s3_client=s3_client,
+        access_key_id=access_key_id,
+        secret_access_key=secret_access_key,
+        jwt_token=jwt_token
+    ):
+        for common_prefix in page["prefixes"]:
+            yield {"Prefix": common_prefix, "IsDirectory": True}
+        yield from page["objects"]
+
+@timed("s3_list", failed=is_none)
+def list_files(
+    bucket_name: str = SUPABASE_BUCKET_NAME,
+    prefix: str = "",
+    s3_client: Optional[boto3.client] = None,
+    access_key_id: str = "",
+    secret_access_key: str = "",
+    jwt_token: str = "",
+    max_keys: Optional[int] = None
 ) -> Optional[List[Dict]]:
     """
     List files in a Supabase Storage bucket using S3 API.
+    Follows continuation tokens, so results are not capped at 1000 keys; use
+    iter_objects to walk large prefixes without holding them all in memory.
 
     Args:
         bucket_name: The name of the bucket to list files from
@@ -216,6 +637,7 @@ def list_files(
         access_key_id: S3 access key ID (if s3_client not provided)
         secret_access_key: S3 secret access key (if s3_client not provided)
         jwt_token: JWT token for user authentication (if s3_client not provided)
+        max_keys: Maximum number of objects to return (None for all)
 
     Returns:
         A list of objects or None if operation fails
@@ -228,36 +650,34 @@ def list_files(
             elif access_key_id and secret_access_key:
                 s3_client = create_s3_client_with_access_keys(access_key_id, secret_access_key)
             else:
-                st.error("No authentication method provided")
+                _report_error("No authentication method provided")
                 return None
 
         if s3_client is None:
-            st.error("Failed to create S3 client")
+            _report_error("Failed to create S3 client")
             return None
 
-        # List objects
-        response = s3_client.list_objects_v2(
-            Bucket=bucket_name,
-            Prefix=prefix
-        )
-
-        # Extract and return the objects
-        if 'Contents' in response:
-            return response['Contents']
-        else:
-            return []
+        # List objects across all pages
+        return list(iter_objects(
+            bucket_name=bucket_name,
+            prefix=prefix,
+            max_keys=max_keys,
+            s3_client=s3_client
+        ))
 
     except Exception as e:
-        st.error(f"Error listing files: {e}")
+        _report_error(f"Error listing files: {e}")
         return None
 
+@timed("s3_download", failed=is_none)
 def download_file(
     object_name: str,
     bucket_name: str = SUPABASE_BUCKET_NAME,
     s3_client: Optional[boto3.client] = None,
     access_key_id: str = "",
     secret_access_key: str = "",
-    jwt_token: str = ""
+    jwt_token: str = "",
+    quiet: bool = False
 ) -> Optional[bytes]:
     """
     Download a file from Supabase Storage using S3 API.
@@ -269,6 +689,7 @@ def download_file(
         access_key_id: S3 access key ID (if s3_client not provided)
         secret_access_key: S3 secret access key (if s3_client not provided)
         jwt_token: JWT token for user authentication (if s3_client not provided)
+        quiet: Suppress error UI (for background and worker-thread use)
 
     Returns:
         The file content as bytes or None if download fails
@@ -281,11 +702,11 @@ def download_file(
             elif access_key_id and secret_access_key:
                 s3_client = create_s3_client_with_access_keys(access_key_id, secret_access_key)
             else:
-                st.error("No authentication method provided")
+                _report_error("No authentication method provided")
                 return None
 
         if s3_client is None:
-            st.error("Failed to create S3 client")
+            _report_error("Failed to create S3 client")
             return None
 
         # Download the file
@@ -298,9 +719,11 @@ def download_file(
         return response['Body'].read()
 
     except Exception as e:
-        st.error(f"Error downloading file: {e}")
+        if not quiet:
+            _report_error(f"Error downloading file: {e}")
         return None
 
+@timed("s3_delete", failed=lambda deleted: not deleted)
 def delete_file(
     object_name: str,
     bucket_name: str = SUPABASE_BUCKET_NAME,
@@ -331,11 +754,11 @@ def delete_file(
             elif access_key_id and secret_access_key:
                 s3_client = create_s3_client_with_access_keys(access_key_id, secret_access_key)
             else:
-                st.error("No authentication method provided")
+                _report_error("No authentication method provided")
                 return False
 
         if s3_client is None:
-            st.error("Failed to create S3 client")
+            _report_error("Failed to create S3 client")
             return False
 
         # Delete the file
@@ -347,11 +770,187 @@ def delete_file(
         return True
 
     except Exception as e:
-        st.error(f"Error deleting file: {e}")
+        _report_error(f"Error deleting file: {e}")
         return False
 
+def _delete_batch(s3_client: boto3.client, bucket_name: str, keys: List[str]) -> Dict:
+    """Deletes up to 1000 keys in one delete_objects request and reports the outcome."""
+    try:
+        response = s3_client.delete_objects(
+            Bucket=bucket_name,
+            Delete={'Objects': [{'Key': key} for key in keys], 'Quiet': True}
+        )
+    except Exception as e:
+        return {"deleted": 0, "errors": [{"Key": key, "Code": type(e).__name__, "Message": str(e)} for key in keys]}
+
+    # In quiet mode only failures are listed
+    errors = response.get('Errors', [])
+    return {"deleted": len(keys) - len(errors), "errors": errors}
+
+@timed("s3_delete_batch", failed=lambda result: result is None or bool(result["errors"]))
+def delete_files(
+    object_names: Iterable[str],
+    bucket_name: str = SUPABASE_BUCKET_NAME,
+    batch_size: int = MAX_DELETE_BATCH_SIZE,
+    max_workers: int = S3_DELETE_CONCURRENCY,
+    s3_client: Optional[boto3.client] = None,
+    access_key_id: str = "",
+    secret_access_key: str = "",
+    jwt_token: str = ""
+) -> Optional[Dict]:
+    """
+    Delete many files from Supabase Storage using S3 API bulk deletes.
+
+    Keys are grouped into delete_objects batches of up to 1000, and several batches
+    run concurrently. The keys are consumed lazily (e.g. straight from iter_objects),
+    with only a few batches in memory at a time.
+
+    Args:
+        object_names: The names of the objects to delete
+        bucket_name: The name of the bucket containing the objects
+        batch_size: Number of keys per delete request (at most 1000)
+        max_workers: Number of delete requests in flight
+        s3_client: An existing S3 client (optional)
+        access_key_id: S3 access key ID (if s3_client not provided)
+        secret_access_key: S3 secret access key (if s3_client not provided)
+        jwt_token: JWT token for user authentication (if s3_client not provided)
+
+    Returns:
+        A dict with "deleted" (count) and "errors" (list of {"Key", "Code", "Message"}),
+        or None if no S3 client could be created
+    """
+    s3_client = _resolve_s3_client(s3_client, access_key_id, secret_access_key, jwt_token)
+    if s3_client is None:
+        _report_error("Failed to create S3 client")
+        return None
+
+    batch_size = max(1, min(batch_size, MAX_DELETE_BATCH_SIZE))
+    max_workers = max(1, max_workers)
+    result = {"deleted": 0, "errors": []}
+
+    def collect(done_futures):
+        for future in done_futures:
+            outcome = future.result()
+            result["deleted"] += outcome["deleted"]
+            result["errors"].extend(outcome["errors"])
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        in_flight = set()
+        batch = []
+
+        for key in object_names:
+            batch.append(key)
+            if len(batch) < batch_size:
+                continue
+            in_flight.add(executor.submit(_delete_batch, s3_client, bucket_name, batch))
+            batch = []
+            # Bound the number of queued batches so huge key streams stay in constant memory
+            if len(in_flight) >= max_workers * 2:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                collect(done)
+
+        if batch:
+            in_flight.add(executor.submit(_delete_batch, s3_client, bucket_name, batch))
+
+        done, _ = wait(in_flight)
+        collect(done)
+
+    return result
+
+def purge_objects(
+    prefix: str,
+    older_than: Optional[timedelta] = None,
+    bucket_name: str = SUPABASE_BUCKET_NAME,
+    dry_run: bool = False,
+    batch_size: int = MAX_DELETE_BATCH_SIZE,
+    max_workers: int = S3_DELETE_CONCURRENCY,
+    s3_client: Optional[boto3.client] = None,
+    access_key_id: str = "",
+    secret_access_key: str = "",
+    jwt_token: str = ""
+) -> Optional[Dict]:
+    """
+    Delete every object under a prefix, optionally only those older than a given age.
+
+    The prefix is walked with the paginated listing and matching keys are streamed
+    into delete_files, so retention cleanup of very large prefixes runs in constant memory.
+
+    Args:
+        prefix: Only objects under this prefix are considered (e.g. "menu_uploads/")
+        older_than: Only delete objects last modified longer ago than this (None for all)
+        bucket_name: The name of the bucket to purge
+        dry_run: Count matching objects without deleting them
+        batch_size: Number of keys per delete request (at most 1000)
+        max_workers: Number of delete requests in flight
+        s3_client: An existing S3 client (optional)
+        access_key_id: S3 access key ID (if s3_client not provided)
+        secret_access_key: S3 secret access key (if s3_client not provided)
+        jwt_token: JWT token for user authentication (if s3_client not provided)
+
+    Returns:
+        A dict with "scanned", "matched", "deleted" and "errors", or None if the purge
+        could not run
+
+    Raises:
+        ValueError: If neither a prefix nor an age is given (which would empty the bucket)
+    """
+    if not prefix and older_than is None:
+        raise ValueError("Refusing to purge a whole bucket: give a prefix or an age")
+
+    s3_client = _resolve_s3_client(s3_client, access_key_id, secret_access_key, jwt_token)
+    if s3_client is None:
+        _report_error("Failed to create S3 client")
+        return None
+
+    cutoff = datetime.now(timezone.utc) - older_than if older_than is not None else None
+    counts = {"scanned": 0, "matched": 0}
+
+    def matching_keys():
+        for obj in iter_objects(bucket_name=bucket_name, prefix=prefix, s3_client=s3_client):
+            counts["scanned"] += 1
+            if cutoff is not None and obj['LastModified'] >= cutoff:
+                continue
+            counts["matched"] += 1
+            yield obj['Key']
+
+    try:
+        if dry_run:
+            for _ in matching_keys():
+                pass
+            outcome = {"deleted": 0, "errors": []}
+        else:
+            outcome = delete_files(
+                matching_keys(),
+                bucket_name=bucket_name,
+                batch_size=batch_size,
+                max_workers=max_workers,
+                s3_client=s3_client
+            )
+    except Exception as e:
+        _report_error(f"Error purging files: {e}")
+        return None
+
+    return {**counts, **outcome}
+
 # --- Helper Functions ---
 
+# Process-wide cache of buckets known to exist: bucket name -> time verified
+_verified_buckets: Dict[str, float] = {}
+_verified_buckets_lock = threading.Lock()
+
+def invalidate_bucket_cache(bucket_name: Optional[str] = None) -> None:
+    """
+    Forget verified buckets so the next check probes storage again.
+
+    Args:
+        bucket_name: The bucket to forget, or None to clear the whole cache
+    """
+    with _verified_buckets_lock:
+        if bucket_name is None:
+            _verified_buckets.clear()
+        else:
+            _verified_buckets.pop(bucket_name, None)
+
 def check_bucket_exists(
     bucket_name: str = SUPABASE_BUCKET_NAME,
     s3_client: Optional[boto3.client] = None,
@@ -361,6 +960,7 @@ def check_bucket_exists(
 ) -> bool:
     """
     Check if a bucket exists in Supabase Storage using S3 API.
+    Positive results are cached process-wide for BUCKET_CACHE_TTL seconds.
 
     Args:
         bucket_name: The name of the bucket to check
@@ -372,6 +972,12 @@ def check_bucket_exists(
     Returns:
         True if the bucket exists, False otherwise
     """
+    # Buckets verified within the TTL are trusted without a round trip
+    with _verified_buckets_lock:
+        verified_at = _verified_buckets.get(bucket_name)
+    if verified_at is not None and time.monotonic() - verified_at < BUCKET_CACHE_TTL:
+        return True
+
     try:
         # Create S3 client if not provided
         if s3_client is None:
@@ -380,25 +986,27 @@ def check_bucket_exists(
             elif access_key_id and secret_access_key:
                 s3_client = create_s3_client_with_access_keys(access_key_id, secret_access_key)
             else:
-                st.error("No authentication method provided")
+                _report_error("No authentication method provided")
                 return False
 
         if s3_client is None:
-            st.error("Failed to create S3 client")
+            _report_error("Failed to create S3 client")
             return False
 
-        # List buckets
-        response = s3_client.list_buckets()
-
-        # Check if the bucket exists
-        for bucket in response['Buckets']:
-            if bucket['Name'] == bucket_name:
-                return True
+        # A HEAD probe on the one bucket is much cheaper than listing every bucket
+        try:
+            s3_client.head_bucket(Bucket=bucket_name)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchBucket', 'NotFound'):
+                return False
+            raise
 
-        return False
+        with _verified_buckets_lock:
+            _verified_buckets[bucket_name] = time.monotonic()
+        return True
 
     except Exception as e:
-        st.error(f"Error checking if bucket exists: {e}")
+        _report_error(f"Error checking if bucket exists: {e}")
         return False
 
 def create_bucket(
@@ -428,11 +1036,11 @@ def create_bucket(
             if access_key_id and secret_access_key:
                 s3_client = create_s3_client_with_access_keys(access_key_id, secret_access_key)
             else:
-                st.error("S3 access keys required to create a bucket")
+                _report_error("S3 access keys required to create a bucket")
                 return False
 
         if s3_client is None:
-            st.error("Failed to create S3 client")
+            _report_error("Failed to create S3 client")
             return False
 
         # Create the bucket
@@ -458,8 +1066,11 @@ def create_bucket(
                 Policy=json.dumps(policy)
             )
 
+        with _verified_buckets_lock:
+            _verified_buckets[bucket_name] = time.monotonic()
+
         return True
 
     except Exception as e:
-        st.error(f"Error creating bucket: {e}")
+        _report_error(f"Error creating bucket: {e}")
         return False
@@ -0,0 +1,84 @@
+"""
+Process-wide request coalescing ("singleflight").
+
+Streamlit runs every session in the same process, so when several users process
+the same menu, or the same dish shows up in many menus, identical calls overlap.
+A SingleFlight lets the first caller for a key make the upstream request while
+concurrent callers with the same key wait for it and share its result or error.
+Nothing is cached: once the call finishes, the next caller starts a new one.
+"""
+import threading
+from typing import Any, Callable, Dict, Hashable, Tuple, TypeVar
+
+T = TypeVar("T")
+
+
+class _Call:
+    """One in-flight call and the outcome its waiters will share."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: BaseException | None = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls that share a key into a single call.
+
+    Thread-safe; intended to be created once per kind of request at module level.
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, fn: Callable[[], T]) -> Tuple[T, bool]:
+        """
+        Runs fn, unless a call with the same key is already in flight, in which case
+        waits for that call instead.
+
+        Args:
+            key: Identifies identical requests (e.g. a hash of the normalized request).
+            fn: The call to make.
+
+        Returns:
+            A tuple of the result and whether it was shared with other callers. Shared
+            results are the same object for every caller, so copy before mutating them.
+
+        Raises:
+            Exception: Whatever fn raised, re-raised in every caller that shared the call.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+        return call.result, call.waiters > 0
+
+    def in_flight(self) -> int:
+        """Returns the number of distinct calls currently in flight."""
+        with self._lock:
+            return len(self._calls)
@@ -0,0 +1,211 @@
+"""
+Streamlit adapters over the UI-free core.
+
+ai_utils, supabase_utils and s3_utils never render anything themselves (s3_utils
+only when called from the app). The wrappers here add the status messages,
+progress bars and error details the app shows around each step.
+
+Only the script thread may render Streamlit elements, so worker threads (the
+pipeline, the image scheduler, background uploads) and batch_cli.py call the core
+functions directly, never these wrappers.
+"""
+from typing import List, Dict, Tuple
+import streamlit as st
+
+from config import get_settings
+from ai_utils import extract_menu_items, request_dish_image, get_groq_client
+from supabase_utils import (
+    store_image,
+    ensure_bucket,
+    create_public_bucket,
+    get_supabase_client,
+    SUPABASE_BUCKET_NAME,
+)
+
+# --- Configuration ---
+
+def report_configuration_errors() -> None:
+    """Shows an error for every missing credential, once per run of the app script."""
+    settings = get_settings()
+
+    if not settings.groq_api_key:
+        st.error("Groq API Key not set. Please provide it via environment variables or st.secrets.")
+    if not settings.together_api_key:
+        st.error("Together AI API Key not set. Please provide it via environment variables or st.secrets.")
+    if not settings.supabase_url or not settings.supabase_key:
+        st.error("Supabase URL or Key not set. Please provide them via environment variables or st.secrets.")
+
+# --- Menu Extraction ---
+
+@st.cache_data(show_spinner="Analyzing menu...")
+def _cached_menu_items(image_bytes: bytes, tiled: bool) -> Tuple[str, List[Dict] | None]:
+    # Failed extractions raise, and st.cache_data does not cache exceptions, so they are retried
+    return extract_menu_items(image_bytes, tiled=tiled)
+
+def extract_menu_text(image_bytes: bytes, tiled: bool = False) -> Tuple[str | None, List[Dict] | None]:
+    """
+    Processes a menu image using Llama 4 via Groq API and extracts structured menu data.
+    Near-duplicates of previously extracted menus are answered from the menu index.
+
+    Args:
+        image_bytes: The image data as bytes. In tiled mode this should be the original
+            upload; otherwise ideally normalized by image_utils.preprocess_menu_image.
+        tiled: Whether to extract overlapping tiles concurrently (for large, multi-column menus).
+
+    Returns:
+        A tuple containing the raw text (or None on error) and a list of dicts
+        representing menu items (or None/empty list on error).
+    """
+    # Create a placeholder for status updates
+    status_placeholder = st.empty()
+    status_placeholder.info("Analyzing menu items...")
+
+    try:
+        structured_menu_str, valid_items = _cached_menu_items(image_bytes, tiled)
+    except Exception:
+        if get_groq_client() is None:
+            status_placeholder.error("API connection error. Please try again.")
+        else:
+            status_placeholder.error("Could not process menu. Please try again.")
+        return None, []  # Return empty list on API error
+
+    # Display a sample of the extracted text
+    with st.expander("Extracted Menu Text", expanded=False):
+        st.text(structured_menu_str[:1000] + "..." if len(structured_menu_str) > 1000 else structured_menu_str)
+
+    if valid_items is None:
+        status_placeholder.error("Could not process menu. Please try a clearer image.")
+        return structured_menu_str, []  # Return empty list on parse error
+
+    # Clear the status message if successful
+    status_placeholder.empty()
+
+    return structured_menu_str, valid_items
+
+# --- Image Generation ---
+
+# @st.cache_data # Careful caching image generation calls, you might hit API limits or want fresh images
+def generate_dish_image(dish_name: str, description: str) -> str | None:
+    """
+    Generates an image for a dish using Flux via Together AI.
+
+    Args:
+        dish_name: The name of the dish.
+        description: A short description of the dish.
+
+    Returns:
+        The URL (or local cache path) of the generated image, or None if generation failed.
+    """
+    if not get_settings().together_api_key:
+         st.error("Together AI API Key not set.")
+         return None
+
+    # Create a placeholder for status updates
+    status_placeholder = st.empty()
+    status_placeholder.info(f"Generating image for '{dish_name}'...")
+
+    img_url = request_dish_image(dish_name, description)
+
+    if img_url:
+        status_placeholder.empty()  # Clear the status message
+    else:
+        status_placeholder.error(f"Could not generate image for '{dish_name}'")
+
+    return img_url
+
+# --- Storage ---
+
+def upload_image_to_supabase(image_bytes: bytes, filename: str, bucket_name: str = SUPABASE_BUCKET_NAME, use_s3: bool = False, content_addressed: bool = False) -> str | None:
+    """
+    Uploads image data (bytes) to Supabase storage.
+
+    Args:
+        image_bytes: The image data as bytes.
+        filename: The desired filename in the bucket (the folder, in content-addressed mode).
+        bucket_name: The name of the Supabase bucket.
+        use_s3: Whether to use the S3 API instead of the Supabase API.
+        content_addressed: Name the file after the SHA-256 of its bytes and skip the
+            upload if that file is already stored.
+
+    Returns:
+        The public URL of the uploaded image, or None if upload failed.
+    """
+    # Create a progress bar
+    progress_bar = st.progress(0)
+    status_placeholder = st.empty()
+
+    try:
+        # Update progress
+        progress_bar.progress(10)
+        status_placeholder.info("Uploading menu image via S3 API..." if use_s3 else "Uploading menu image...")
+
+        public_url = store_image(image_bytes, filename, bucket_name, use_s3=use_s3, content_addressed=content_addressed)
+
+        # Update progress and clear status
+        progress_bar.progress(100)
+        status_placeholder.empty()
+        progress_bar.empty()
+
+        return public_url
+
+    except Exception as e:
+        # Handle error and update UI
+        progress_bar.empty()
+        error_msg = str(e)
+        status_placeholder.error(f"Upload failed: {error_msg}")
+
+        # Debug output
+        with st.expander("Error Details", expanded=False):
+            st.error(f"Error type: {type(e).__name__}")
+            st.error(f"Error message: {error_msg}")
+
+        return None
+
+# Function to check if the bucket exists
+def check_bucket_exists(bucket_name: str = SUPABASE_BUCKET_NAME) -> bool:
+    """
+    Checks if the specified bucket exists in Supabase storage, creating it if missing.
+    Positive results are cached process-wide for BUCKET_CACHE_TTL seconds.
+
+    Args:
+        bucket_name: The name of the bucket to check.
+
+    Returns:
+        True if the bucket exists, False otherwise.
+    """
+    try:
+        ensure_bucket(bucket_name)
+        return True
+    except Exception as e:
+        st.error(str(e))
+        return False
+
+# Function to create a bucket
+def create_bucket(bucket_name: str) -> bool:
+    """
+    Creates a new bucket in Supabase storage.
+
+    Args:
+        bucket_name: The name of the bucket to create.
+
+    Returns:
+        True if the bucket was created successfully, False otherwise.
+    """
+    if get_supabase_client() is None:
+        st.error("Supabase client not initialized. Check your API keys.")
+        return False
+
+    try:
+        # Create the bucket
+        result = create_public_bucket(bucket_name)
+
+        # Debug output
+        with st.expander("Bucket Creation Result", expanded=False):
+            st.write(result)
+
+        st.success(f"Bucket '{bucket_name}' created successfully.")
+        return True
+
+    except Exception as e:
+        st.error(f"Error creating bucket: {str(e)}")
+        return False
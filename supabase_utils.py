@@ -1,7 +1,13 @@
-import os
-from supabase import create_client, Client
-import streamlit as st # Using st for error display in this utility
+import time
+import hashlib
+import mimetypes
+import threading
 import io
+from concurrent.futures import ThreadPoolExecutor, Future
+
+from config import get_settings
+from metrics import timed
+from image_utils import detect_mime_type
 
 # Optional: Import S3 utilities if available
 try:
@@ -11,77 +17,144 @@ except ImportError:
     S3_AVAILABLE = False
 
 # --- Configuration ---
-# Access keys from environment variables
-# Use st.secrets for Streamlit cloud deployment, os.environ for local
-SUPABASE_URL = os.environ.get("SUPABASE_URL") or st.secrets.get("SUPABASE_URL")
-SUPABASE_KEY = os.environ.get("SUPABASE_ANON_KEY") or st.secrets.get("SUPABASE_ANON_KEY")
+settings = get_settings()
+
+# Access keys
+SUPABASE_URL = settings.supabase_url
+SUPABASE_KEY = settings.supabase_key
 SUPABASE_BUCKET_NAME = "menuviz" # Make sure this bucket exists in Supabase
 
+# How long a verified bucket is trusted before it is checked again (seconds)
+BUCKET_CACHE_TTL = settings.bucket_cache_ttl
+
+# Whether storage goes through the S3 API instead of the Supabase API
+USE_SUPABASE_S3 = settings.use_supabase_s3
+
+# Cache lifetime for objects whose content never changes under their name (one year)
+IMMUTABLE_MAX_AGE = 31536000
+
+# Number of uploads that may run in the background at once
+UPLOAD_WORKERS = settings.upload_workers
+
 # S3 access keys (optional)
-S3_ACCESS_KEY_ID = os.environ.get("S3_ACCESS_KEY_ID") or st.secrets.get("S3_ACCESS_KEY_ID", "")
-S3_SECRET_ACCESS_KEY = os.environ.get("S3_SECRET_ACCESS_KEY") or st.secrets.get("S3_SECRET_ACCESS_KEY", "")
-
-# Check if keys are set and initialize client
-supabase: Client = None
-if not SUPABASE_URL or not SUPABASE_KEY:
-    st.error("Supabase URL or Key not set. Please provide them via environment variables or st.secrets.")
-else:
-    try:
-        supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
-    except Exception as e:
-        st.error(f"Error initializing Supabase client: {e}")
-        supabase = None # Ensure supabase is None if initialization fails
-
-# Initialize S3 client if credentials are available
-s3_client = None
-if S3_AVAILABLE and S3_ACCESS_KEY_ID and S3_SECRET_ACCESS_KEY:
-    try:
-        s3_client = s3_utils.create_s3_client_with_access_keys(
-            access_key_id=S3_ACCESS_KEY_ID,
-            secret_access_key=S3_SECRET_ACCESS_KEY
-        )
-    except Exception as e:
-        st.error(f"Error initializing S3 client: {e}")
-        s3_client = None
+S3_ACCESS_KEY_ID = settings.s3_access_key_id
+S3_SECRET_ACCESS_KEY = settings.s3_secret_access_key
+
+# --- Clients ---
+# Created on first use, so importing this module stays cheap and free of network setup
+_supabase_client = None
+_s3_client = None
+_clients_lock = threading.Lock()
+
+def get_supabase_client():
+    """
+    Returns the process-wide Supabase client, creating it on first use.
+
+    Returns:
+        The client, or None if the URL or key is not set or the client cannot be created.
+    """
+    global _supabase_client
+
+    if _supabase_client is None and SUPABASE_URL and SUPABASE_KEY:
+        with _clients_lock:
+            if _supabase_client is None:
+                try:
+                    from supabase import create_client
+                    _supabase_client = create_client(SUPABASE_URL, SUPABASE_KEY)
+                except Exception:
+                    return None
+
+    return _supabase_client
+
+def get_storage_s3_client():
+    """
+    Returns the S3 client for the app's storage bucket, creating it on first use.
+
+    Returns:
+        The client, or None if no S3 access keys are configured or s3_utils is unavailable.
+    """
+    global _s3_client
+
+    if _s3_client is None and S3_AVAILABLE and S3_ACCESS_KEY_ID and S3_SECRET_ACCESS_KEY:
+        with _clients_lock:
+            if _s3_client is None:
+                try:
+                    _s3_client = s3_utils.get_s3_client(S3_ACCESS_KEY_ID, S3_SECRET_ACCESS_KEY)
+                except Exception:
+                    return None
+
+    return _s3_client
+
+def storage_available(use_s3: bool = False) -> bool:
+    """Returns whether a storage client can be created, without any network call."""
+    if use_s3 and get_storage_s3_client() is not None:
+        return True
+    return get_supabase_client() is not None
+
+# Process-wide pool for background uploads, which nothing on screen waits for
+_upload_executor = ThreadPoolExecutor(max_workers=UPLOAD_WORKERS, thread_name_prefix="storage-upload")
 
 # --- Functions ---
 
-def upload_image_to_supabase(image_bytes: bytes, filename: str, bucket_name: str = SUPABASE_BUCKET_NAME, use_s3: bool = False) -> str | None:
+def content_addressed_filename(image_bytes: bytes, prefix: str, content_type: str) -> str:
+    """
+    Builds a storage path from the SHA-256 of the image, so identical images share one object.
+
+    Args:
+        image_bytes: The image data as bytes.
+        prefix: The folder to place the file in (e.g. "menu_uploads").
+        content_type: Used to pick the file extension.
+
+    Returns:
+        The path, e.g. "menu_uploads/<sha256>.jpg".
+    """
+    extension = mimetypes.guess_extension(content_type) or ""
+    name = f"{hashlib.sha256(image_bytes).hexdigest()}{extension}"
+    return f"{prefix.rstrip('/')}/{name}" if prefix else name
+
+def _supabase_file_exists(bucket_name: str, path: str) -> bool:
+    """Checks whether a file exists in a bucket by searching its folder for the exact name."""
+    folder, _, name = path.rpartition("/")
+    try:
+        entries = get_supabase_client().storage.from_(bucket_name).list(folder, {"search": name})
+    except Exception:
+        return False
+    return any(entry.get("name") == name for entry in entries or [])
+
+@timed("upload")
+def store_image(image_bytes: bytes, filename: str, bucket_name: str = SUPABASE_BUCKET_NAME, use_s3: bool = False, content_addressed: bool = False, skip_if_exists: bool = False, immutable: bool = False) -> str:
     """
-    Uploads image data (bytes) to Supabase storage.
+    Stores image data in Supabase storage without touching the UI.
 
     Args:
         image_bytes: The image data as bytes.
-        filename: The desired filename in the bucket.
+        filename: The desired filename in the bucket (the folder, in content-addressed mode).
         bucket_name: The name of the Supabase bucket.
         use_s3: Whether to use the S3 API instead of the Supabase API.
+        content_addressed: Name the file after the SHA-256 of its bytes and skip the
+            upload if that file is already stored.
+        skip_if_exists: Skip the upload if a file with this name is already stored.
+        immutable: Serve the file with a long-lived Cache-Control header; only for
+            names whose content never changes.
 
     Returns:
-        The public URL of the uploaded image, or None if upload failed.
+        The public URL of the stored image.
+
+    Raises:
+        RuntimeError: If the client is missing, the bucket is unavailable or the upload fails.
     """
-    # Create a progress bar
-    progress_bar = st.progress(0)
-    status_placeholder = st.empty()
+    content_type = detect_mime_type(image_bytes)
+    if content_addressed:
+        filename = content_addressed_filename(image_bytes, filename, content_type)
+        skip_if_exists = True
 
     try:
-        # Update progress
-        progress_bar.progress(10)
-        status_placeholder.info(f"Checking storage bucket...")
-
         # Determine which method to use
-        if use_s3 and S3_AVAILABLE and s3_client:
-            # Use S3 API
-            status_placeholder.info(f"Using S3 API for upload...")
-
+        s3_client = get_storage_s3_client() if use_s3 else None
+        if s3_client is not None:
             # Check if bucket exists using S3 API
             if not s3_utils.check_bucket_exists(bucket_name, s3_client=s3_client):
-                progress_bar.empty()
-                status_placeholder.error(f"Bucket '{bucket_name}' not found. Please create it in your Supabase dashboard.")
-                return None
-
-            # Update progress
-            progress_bar.progress(25)
-            status_placeholder.info(f"Uploading menu image via S3 API...")
+                raise RuntimeError(f"Bucket '{bucket_name}' not found. Please create it in your Supabase dashboard.")
 
             # Upload using S3 API
             public_url = s3_utils.upload_file(
@@ -89,154 +162,172 @@ def upload_image_to_supabase(image_bytes: bytes, filename: str, bucket_name: str
                 object_name=filename,
                 bucket_name=bucket_name,
                 s3_client=s3_client,
-                content_type="image/jpeg"
+                content_type=content_type,
+                skip_if_exists=skip_if_exists,
+                cache_control=f"public, max-age={IMMUTABLE_MAX_AGE}, immutable" if immutable else None,
+                quiet=True
             )
-
-            # Update progress and clear status
-            progress_bar.progress(100)
-            status_placeholder.empty()
+            if public_url is None:
+                raise RuntimeError(f"Could not upload '{filename}' via S3 API.")
 
             return public_url
 
-        else:
-            # Use standard Supabase API
-            if supabase is None:
-                progress_bar.empty()
-                status_placeholder.error("Supabase client not initialized. Check your API keys.")
-                return None
-
-            # First check if the bucket exists
-            if not check_bucket_exists(bucket_name):
-                progress_bar.empty()
-                status_placeholder.error(f"Bucket '{bucket_name}' not found. Please create it in your Supabase dashboard.")
-                return None
-
-            # Update progress
-            progress_bar.progress(25)
-            status_placeholder.info(f"Uploading menu image...")
-
-            # Create a file-like object from bytes
-            file = io.BytesIO(image_bytes)
-            file.seek(0)  # Reset file pointer to beginning
-
-            # Try with file-like object
-            try:
-                result = supabase.storage.from_(bucket_name).upload(
-                    path=filename,
-                    file=file,
-                    file_options={"content-type": "image/jpeg"}
-                )
-            except Exception as upload_error:
-                # If that fails, try with raw bytes
-                with st.expander("First upload attempt failed", expanded=False):
-                    st.error(f"First upload attempt error: {str(upload_error)}")
-
-                result = supabase.storage.from_(bucket_name).upload(
-                    path=filename,
-                    file=image_bytes,
-                    file_options={"content-type": "image/jpeg"}
-                )
-
-            # Debug output (hidden in production)
-            with st.expander("Debug Info", expanded=False):
-                st.write(f"Upload result: {result}")
-
-            # Update progress
-            progress_bar.progress(75)
-
-            # If successful, get the public URL
-            public_url = supabase.storage.from_(bucket_name).get_public_url(filename)
-
-            # Update progress and clear status
-            progress_bar.progress(100)
-            status_placeholder.empty()
+        # Use standard Supabase API
+        supabase = get_supabase_client()
+        if supabase is None:
+            raise RuntimeError("Supabase client not initialized. Check your API keys.")
+
+        # First check if the bucket exists
+        ensure_bucket(bucket_name)
+
+        # Identical content is already stored; no upload needed
+        if skip_if_exists and _supabase_file_exists(bucket_name, filename):
+            return supabase.storage.from_(bucket_name).get_public_url(filename)
+
+        # Content-addressed files never change, so a concurrent duplicate upload may safely overwrite
+        file_options = {"content-type": content_type}
+        if content_addressed:
+            file_options["upsert"] = "true"
+        if immutable:
+            # Supabase serves this as "max-age=<seconds>"
+            file_options["cache-control"] = str(IMMUTABLE_MAX_AGE)
+
+        # Try with file-like object
+        try:
+            supabase.storage.from_(bucket_name).upload(
+                path=filename,
+                file=io.BytesIO(image_bytes),
+                file_options=file_options
+            )
+        except Exception:
+            # If that fails, try with raw bytes
+            supabase.storage.from_(bucket_name).upload(
+                path=filename,
+                file=image_bytes,
+                file_options=file_options
+            )
 
-            return public_url
+        # If successful, get the public URL
+        return supabase.storage.from_(bucket_name).get_public_url(filename)
 
-    except Exception as e:
-        # Handle error and update UI
-        progress_bar.empty()
-        error_msg = str(e)
-        status_placeholder.error(f"Upload failed: {error_msg}")
+    except Exception:
+        # The bucket may have been removed since it was verified; check again next time
+        invalidate_bucket_cache(bucket_name)
+        raise
 
-        # Debug output
-        with st.expander("Error Details", expanded=False):
-            st.error(f"Error type: {type(e).__name__}")
-            st.error(f"Error message: {error_msg}")
+def find_stored_image(filename: str, bucket_name: str = SUPABASE_BUCKET_NAME, use_s3: bool = False) -> str | None:
+    """
+    Returns the public URL of a stored file without uploading anything.
 
+    Args:
+        filename: The path of the file in the bucket.
+        bucket_name: The name of the Supabase bucket.
+        use_s3: Whether to use the S3 API instead of the Supabase API.
+
+    Returns:
+        The public URL, or None if the file is not stored (or storage is unavailable).
+    """
+    s3_client = get_storage_s3_client() if use_s3 else None
+    if s3_client is not None:
+        if s3_utils.object_exists(filename, bucket_name, s3_client=s3_client):
+            return f"{SUPABASE_URL}/storage/v1/object/public/{bucket_name}/{filename}"
+        return None
+
+    supabase = get_supabase_client()
+    if supabase is None or not _supabase_file_exists(bucket_name, filename):
         return None
+    return supabase.storage.from_(bucket_name).get_public_url(filename)
 
-# Function to check if the bucket exists
-def check_bucket_exists(bucket_name: str = SUPABASE_BUCKET_NAME) -> bool:
+def upload_image_in_background(image_bytes: bytes, filename: str, bucket_name: str = SUPABASE_BUCKET_NAME, use_s3: bool = False, content_addressed: bool = False, skip_if_exists: bool = False, immutable: bool = False) -> Future:
     """
-    Checks if the specified bucket exists in Supabase storage.
+    Starts storing image data in Supabase storage on a background thread.
 
-    Args:
-        bucket_name: The name of the bucket to check.
+    Takes the same arguments as store_image. The caller keeps working and reports the
+    outcome whenever it is ready (see Future.done()/result()).
 
     Returns:
-        True if the bucket exists, False otherwise.
+        A Future resolving to the public URL, or raising the upload error.
     """
-    if supabase is None:
-        st.error("Supabase client not initialized. Check your API keys.")
-        return False
+    return _upload_executor.submit(store_image, image_bytes, filename, bucket_name, use_s3, content_addressed, skip_if_exists, immutable)
 
-    try:
-        # List all buckets
-        buckets = supabase.storage.list_buckets()
+# Process-wide cache of buckets known to exist: bucket name -> time verified
+_verified_buckets = {}
+_verified_buckets_lock = threading.Lock()
 
-        # Debug output
-        with st.expander("Supabase Buckets", expanded=False):
-            st.write(buckets)
-
-        # Check if our bucket exists
-        bucket_exists = any(bucket.get('name') == bucket_name for bucket in buckets)
+def invalidate_bucket_cache(bucket_name: str | None = None) -> None:
+    """
+    Forgets verified buckets so the next check asks storage again.
 
-        if not bucket_exists:
-            # Try to create the bucket
-            if create_bucket(bucket_name):
-                return True
-            else:
-                st.error(f"Bucket '{bucket_name}' not found and could not be created.")
-                return False
+    Args:
+        bucket_name: The bucket to forget, or None to clear the whole cache.
+    """
+    with _verified_buckets_lock:
+        if bucket_name is None:
+            _verified_buckets.clear()
+        else:
+            _verified_buckets.pop(bucket_name, None)
 
-        return bucket_exists
+    # The S3 path keeps its own cache
+    if S3_AVAILABLE:
+        s3_utils.invalidate_bucket_cache(bucket_name)
 
-    except Exception as e:
-        st.error(f"Error checking buckets: {str(e)}")
-        return False
+def _mark_bucket_verified(bucket_name: str) -> None:
+    with _verified_buckets_lock:
+        _verified_buckets[bucket_name] = time.monotonic()
 
-# Function to create a bucket
-def create_bucket(bucket_name: str) -> bool:
+def create_public_bucket(bucket_name: str):
     """
-    Creates a new bucket in Supabase storage.
+    Creates a new public bucket in Supabase storage without touching the UI.
 
     Args:
         bucket_name: The name of the bucket to create.
 
     Returns:
-        True if the bucket was created successfully, False otherwise.
+        The API response.
+
+    Raises:
+        RuntimeError: If the Supabase client is not initialized.
+        Exception: Any error raised by the Supabase API.
     """
+    supabase = get_supabase_client()
     if supabase is None:
-        st.error("Supabase client not initialized. Check your API keys.")
-        return False
+        raise RuntimeError("Supabase client not initialized. Check your API keys.")
+
+    result = supabase.storage.create_bucket(
+        id=bucket_name,
+        options={
+            "public": True  # Make the bucket public
+        }
+    )
+    _mark_bucket_verified(bucket_name)
+    return result
+
+def ensure_bucket(bucket_name: str = SUPABASE_BUCKET_NAME) -> None:
+    """
+    Makes sure a bucket exists, creating it if missing, without touching the UI.
+    Positive results are cached process-wide for BUCKET_CACHE_TTL seconds.
 
-    try:
-        # Create the bucket
-        result = supabase.storage.create_bucket(
-            id=bucket_name,
-            options={
-                "public": True  # Make the bucket public
-            }
-        )
-
-        # Debug output
-        with st.expander("Bucket Creation Result", expanded=False):
-            st.write(result)
-
-        st.success(f"Bucket '{bucket_name}' created successfully.")
-        return True
+    Raises:
+        RuntimeError: If the bucket does not exist and cannot be created.
+    """
+    # Buckets verified within the TTL are trusted without a round trip
+    with _verified_buckets_lock:
+        verified_at = _verified_buckets.get(bucket_name)
+    if verified_at is not None and time.monotonic() - verified_at < BUCKET_CACHE_TTL:
+        return
+
+    supabase = get_supabase_client()
+    if supabase is None:
+        raise RuntimeError("Supabase client not initialized. Check your API keys.")
 
-    except Exception as e:
-        st.error(f"Error creating bucket: {str(e)}")
-        return False
\ No newline at end of file
+    try:
+        # Fetch just this bucket instead of listing all of them
+        supabase.storage.get_bucket(bucket_name)
+    except Exception:
+        # Try to create the bucket
+        try:
+            create_public_bucket(bucket_name)
+        except Exception as e:
+            raise RuntimeError(f"Bucket '{bucket_name}' not found and could not be created: {e}") from e
+
+    _mark_bucket_verified(bucket_name)
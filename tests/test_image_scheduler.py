@@ -0,0 +1,108 @@
+import threading
+
+from image_scheduler import ImageScheduler
+
+
+class RecordingGenerator:
+    """Generates URLs in the order it is asked, blocking the first request until released."""
+
+    def __init__(self, fail=()):
+        self.order = []
+        self.release = threading.Event()
+        self.fail = set(fail)
+
+    def __call__(self, dish_name, description):
+        self.order.append(dish_name)
+        if len(self.order) == 1:
+            self.release.wait(5)
+        if dish_name in self.fail:
+            self.fail.discard(dish_name)
+            return None
+        return f"https://images.test/{dish_name}"
+
+
+def _busy_scheduler(generate):
+    """A one-worker scheduler whose worker is held by a first request."""
+    scheduler = ImageScheduler(generate=generate, max_workers=1)
+    first = scheduler.request("Blocker", "test", priority=(0, 0))
+    while not first.running():
+        pass
+    return scheduler, first
+
+
+def test_visible_page_is_generated_before_prefetched_ones():
+    generate = RecordingGenerator()
+    scheduler, _ = _busy_scheduler(generate)
+
+    prefetched = [scheduler.request(f"Next {i}", "test", priority=(1, i)) for i in range(3)]
+    visible = [scheduler.request(f"Visible {i}", "test", priority=(0, i)) for i in range(2)]
+    generate.release.set()
+
+    for future in prefetched + visible:
+        future.result(5)
+    assert generate.order == ["Blocker", "Visible 0", "Visible 1", "Next 0", "Next 1", "Next 2"]
+
+
+def test_paging_onto_a_prefetched_page_promotes_it():
+    generate = RecordingGenerator()
+    scheduler, _ = _busy_scheduler(generate)
+
+    page_two = [scheduler.request(f"Page 2 dish {i}", "test", priority=(1, i)) for i in range(2)]
+    page_three = [scheduler.request(f"Page 3 dish {i}", "test", priority=(2, i)) for i in range(2)]
+    # The user pages ahead: page 3 is now visible, page 2 is one page away
+    promoted = [scheduler.request(f"Page 3 dish {i}", "test", priority=(0, i)) for i in range(2)]
+    generate.release.set()
+
+    assert promoted == page_three
+    for future in page_two + page_three:
+        future.result(5)
+    assert generate.order[1:] == ["Page 3 dish 0", "Page 3 dish 1", "Page 2 dish 0", "Page 2 dish 1"]
+
+
+def test_identical_dishes_share_one_generation():
+    generate = RecordingGenerator()
+    generate.release.set()
+    scheduler = ImageScheduler(generate=generate, max_workers=2)
+
+    first = scheduler.request("Soup", "test")
+    second = scheduler.request("soup ", "TEST", priority=(5,))
+
+    assert first is second
+    assert first.result(5) == "https://images.test/Soup"
+    assert generate.order == ["Soup"]
+
+
+def test_failed_generation_is_retried_on_the_next_request():
+    generate = RecordingGenerator(fail={"Soup"})
+    generate.release.set()
+    scheduler = ImageScheduler(generate=generate, max_workers=1)
+
+    assert scheduler.request("Soup", "test").result(5) is None
+    assert scheduler.request("Soup", "test").result(5) == "https://images.test/Soup"
+
+
+def test_request_for_a_dish_being_taken_by_a_worker_returns_its_future():
+    scheduler = ImageScheduler(generate=lambda dish_name, description: dish_name, max_workers=1)
+    # Keep the request from starting a worker, so the test plays the worker's part
+    scheduler._workers = 1
+    future = scheduler.request("Soup", "test", priority=(1,))
+
+    taken, _, _ = scheduler._next()
+
+    assert taken is future
+    assert scheduler.request("Soup", "test", priority=(0,)) is future
+    assert scheduler.pending() == 0
+
+
+def test_workers_exit_when_the_queue_is_empty():
+    scheduler = ImageScheduler(generate=lambda dish_name, description: dish_name, max_workers=2)
+    futures = [scheduler.request(f"Dish {i}", "test") for i in range(5)]
+    for future in futures:
+        future.result(5)
+
+    for _ in range(500):
+        with scheduler._lock:
+            if scheduler._workers == 0:
+                break
+        threading.Event().wait(0.01)
+    assert scheduler._workers == 0
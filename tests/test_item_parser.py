@@ -0,0 +1,39 @@
+from ai_utils import IncrementalItemParser
+
+MENU = '{"menu": [{"name": "Soup {of the day}", "description": "Ask \\"your\\" server"}, {"name": "Tea", "description": "Hot"}]}'
+
+
+def test_items_are_returned_as_soon_as_they_close():
+    parser = IncrementalItemParser()
+
+    assert parser.feed(MENU[:60]) == []
+    first = parser.feed(MENU[60:90])
+    assert first == [{"name": "Soup {of the day}", "description": 'Ask "your" server'}]
+    assert parser.feed(MENU[90:]) == [{"name": "Tea", "description": "Hot"}]
+    assert parser.text == MENU
+
+
+def test_any_chunking_gives_the_same_items():
+    whole = IncrementalItemParser().feed(MENU)
+    for size in (1, 2, 7, 13):
+        parser = IncrementalItemParser()
+        items = []
+        for start in range(0, len(MENU), size):
+            items += parser.feed(MENU[start:start + size])
+        assert items == whole
+
+
+def test_objects_that_are_not_items_are_skipped():
+    parser = IncrementalItemParser()
+
+    assert parser.feed('[{"price": 5}, {"name": "Tea"}, {"name": "Soup", "description": "Hot", "extra": {"a": 1}}]') == [
+        {"name": "Soup", "description": "Hot", "extra": {"a": 1}}
+    ]
+
+
+def test_malformed_objects_do_not_stop_the_stream():
+    parser = IncrementalItemParser()
+
+    assert parser.feed('[{"name": "Broken", "description": oops}, {"name": "Tea", "description": "Hot"}]') == [
+        {"name": "Tea", "description": "Hot"}
+    ]
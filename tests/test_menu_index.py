@@ -0,0 +1,66 @@
+import io
+import random
+
+from PIL import Image, ImageDraw, ImageFont
+
+import menu_index
+from menu_index import MenuIndex
+
+WORDS = "chicken beef soup salad grilled fresh lemon garlic tomato basil pasta rice noodle spicy pork fish tofu".split()
+
+
+def _menu(seed):
+    """A text-heavy menu page; every seed shares the same layout."""
+    rng = random.Random(seed)
+    image = Image.new("L", (900, 1200), 245)
+    draw = ImageDraw.Draw(image)
+    font = ImageFont.load_default(size=24)
+    draw.text((300, 40), "RESTAURANT MENU", fill=20, font=ImageFont.load_default(size=40))
+    for row in range(20):
+        y = 140 + row * 50
+        draw.text((60, y), " ".join(rng.choice(WORDS) for _ in range(rng.randint(2, 4))).title(), fill=20, font=font)
+        draw.text((760, y), f"{rng.randint(5, 30)}.{rng.randint(0, 99):02d}", fill=20, font=font)
+    return _jpeg(image.convert("RGB"), 90)
+
+
+def _jpeg(image, quality):
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+def _recompressed(data):
+    image = Image.open(io.BytesIO(data))
+    return _jpeg(image.resize((image.width * 3 // 4, image.height * 3 // 4)), 60)
+
+
+def test_same_template_menus_do_not_match(tmp_path):
+    index = MenuIndex(path=str(tmp_path / "index.jsonl"))
+    index.add(MenuIndex.fingerprint(_menu(1)), "raw", [{"name": "Soup"}])
+
+    for seed in range(2, 8):
+        assert index.lookup(MenuIndex.fingerprint(_menu(seed))) is None
+
+
+def test_recompressed_menu_matches(tmp_path):
+    index = MenuIndex(path=str(tmp_path / "index.jsonl"))
+    original = _menu(1)
+    index.add(MenuIndex.fingerprint(original), "raw", [{"name": "Soup"}])
+
+    assert index.lookup(MenuIndex.fingerprint(original)) == ("raw", [{"name": "Soup"}])
+    assert index.lookup(MenuIndex.fingerprint(_recompressed(original))) == ("raw", [{"name": "Soup"}])
+
+
+def test_entries_are_appended_and_compacted(tmp_path, monkeypatch):
+    monkeypatch.setattr(menu_index, "_COMPACT_AFTER", 2)
+    path = tmp_path / "index.jsonl"
+    index = MenuIndex(path=str(path), max_entries=2)
+    fingerprints = [MenuIndex.fingerprint(_menu(seed)) for seed in range(4)]
+    for seed, fingerprint in enumerate(fingerprints):
+        index.add(fingerprint, f"raw {seed}", [])
+
+    assert len(path.read_text().splitlines()) == 2
+
+    reloaded = MenuIndex(path=str(path), max_entries=2)
+    assert reloaded.lookup(fingerprints[0]) is None
+    assert reloaded.lookup(fingerprints[3]) == ("raw 3", [])
@@ -0,0 +1,146 @@
+import threading
+import time
+
+import pytest
+
+import pipeline
+from pipeline import MenuPipeline
+from rate_limit import RateLimiter
+
+
+def _dishes(count):
+    for i in range(count):
+        yield {"name": f"Dish {i}", "description": "test"}
+
+
+def _generate(dish_name, description):
+    return f"https://images.test/{dish_name}"
+
+
+@pytest.fixture
+def extraction_slots(monkeypatch):
+    slots = threading.BoundedSemaphore(2)
+    monkeypatch.setattr(pipeline, "_extraction_slots", slots)
+    return slots
+
+
+def test_run_emits_every_item_and_image():
+    events = list(MenuPipeline(generate=_generate, generation_workers=3).run(lambda: _dishes(5)))
+
+    items = [event for event in events if event.kind == "item"]
+    images = {event.index: event.image_url for event in events if event.kind == "image"}
+    assert [event.item["name"] for event in items] == [f"Dish {i}" for i in range(5)]
+    assert images == {i: f"https://images.test/Dish {i}" for i in range(5)}
+
+
+def test_image_never_precedes_its_item():
+    seen = set()
+    for event in MenuPipeline(generate=_generate, generation_workers=4).run(lambda: _dishes(10)):
+        if event.kind == "item":
+            seen.add(event.index)
+        elif event.kind == "image":
+            assert event.index in seen
+
+
+def test_extraction_error_keeps_published_items():
+    def failing():
+        yield {"name": "Soup"}
+        raise ValueError("stream broke")
+
+    events = list(MenuPipeline(generate=_generate, generation_workers=1).run(failing))
+
+    assert [event.kind for event in events if event.kind != "image"] == ["item", "error"]
+    assert isinstance(next(event for event in events if event.kind == "error").error, ValueError)
+    assert [event.image_url for event in events if event.kind == "image"] == ["https://images.test/Soup"]
+
+
+def test_failed_generation_is_reported_as_missing_image():
+    def broken(dish_name, description):
+        raise RuntimeError("provider down")
+
+    events = list(MenuPipeline(generate=broken, generation_workers=1).run(lambda: _dishes(2)))
+
+    assert [event.image_url for event in events if event.kind == "image"] == [None, None]
+
+
+def test_closing_the_run_cancels_the_source_and_frees_its_slot(extraction_slots):
+    closed = threading.Event()
+
+    def endless():
+        try:
+            while True:
+                time.sleep(0.01)
+                yield {"name": "Dish", "description": "test"}
+        finally:
+            closed.set()
+
+    run = MenuPipeline(generate=_generate, generation_workers=1, queue_size=1).run(endless)
+    next(run)
+    run.close()
+
+    assert closed.wait(5)
+    # Both slots are free again once the extraction thread has wound down
+    for _ in range(2):
+        assert extraction_slots.acquire(timeout=5)
+
+
+def test_extracted_lists_hold_no_extraction_slot(extraction_slots):
+    started = threading.Event()
+
+    def slow_generate(dish_name, description):
+        started.set()
+        time.sleep(0.05)
+        return None
+
+    run = MenuPipeline(generate=slow_generate, generation_workers=1, queue_size=1).run(lambda: list(_dishes(20)))
+    next(run)
+    assert started.wait(5)
+
+    # The run is blocked on its full work queue, but both slots are available
+    assert extraction_slots.acquire(blocking=False)
+    assert extraction_slots.acquire(blocking=False)
+    extraction_slots.release()
+    extraction_slots.release()
+    run.close()
+
+
+def test_streaming_sessions_do_not_deadlock_with_the_provider_limit(extraction_slots):
+    # More streaming sessions than extraction slots, and fewer provider slots than either:
+    # extraction slots and the limiter's concurrency slot must always be taken in the same order
+    limiter = RateLimiter("test", max_concurrency=1)
+    finished = []
+
+    def slow_generate(dish_name, description):
+        # Slow enough that each stream waits on its full work queue between items
+        time.sleep(0.02)
+        return _generate(dish_name, description)
+
+    def session():
+        source = lambda: limiter.stream(lambda: _dishes(3))
+        events = list(MenuPipeline(generate=slow_generate, generation_workers=1, queue_size=1).run(source))
+        finished.append(sum(1 for event in events if event.kind == "image"))
+
+    threads = [threading.Thread(target=session, daemon=True) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=10)
+
+    assert finished == [3, 3, 3, 3]
+
+
+def test_progressive_run_previews_before_each_image():
+    def preview(dish_name, description):
+        # A stored full image skips the preview
+        if dish_name == "Dish 0":
+            return "https://images.test/stored", True
+        return f"https://previews.test/{dish_name}", False
+
+    events = list(MenuPipeline(generate=_generate, generation_workers=2, preview=preview).run(lambda: _dishes(4)))
+
+    kinds = {}
+    for event in events:
+        if event.kind in ("preview", "image"):
+            kinds.setdefault(event.index, []).append(event.kind)
+    assert kinds == {0: ["image"], 1: ["preview", "image"], 2: ["preview", "image"], 3: ["preview", "image"]}
+    assert next(event.image_url for event in events if event.kind == "image" and event.index == 0) == "https://images.test/stored"
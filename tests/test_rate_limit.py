@@ -0,0 +1,206 @@
+import threading
+import time
+
+import pytest
+
+from rate_limit import AdaptiveConcurrency, RateLimiter, RateLimitExceeded, TokenBucket
+
+
+class HTTPError(Exception):
+    """A provider error carrying a status code and response headers, like requests and httpx errors."""
+
+    def __init__(self, status_code, headers=None):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+        self.response = type("Response", (), {"status_code": status_code, "headers": headers or {}})()
+
+
+def _failing(*errors, result="ok"):
+    """Returns a call that raises the given errors in turn, then returns result."""
+    remaining = list(errors)
+    calls = []
+
+    def call():
+        calls.append(time.monotonic())
+        if remaining:
+            raise remaining.pop(0)
+        return result
+
+    return call, calls
+
+
+def _limiter(**kwargs):
+    kwargs.setdefault("base_delay", 0.001)
+    kwargs.setdefault("max_retries", 3)
+    return RateLimiter("test", **kwargs)
+
+
+# --- call() ---
+
+def test_retry_after_pauses_before_the_retry():
+    limiter = _limiter()
+    call, calls = _failing(HTTPError(429, {"retry-after": "0.2"}))
+
+    assert limiter.call(call) == "ok"
+    assert len(calls) == 2
+    assert calls[1] - calls[0] >= 0.19
+
+
+def test_retry_after_pauses_every_caller():
+    limiter = _limiter()
+    call, calls = _failing(HTTPError(503, {"retry-after-ms": "200"}))
+    first = threading.Thread(target=limiter.call, args=(call,))
+    first.start()
+    while not calls:
+        time.sleep(0.001)
+    time.sleep(0.02)
+
+    # Another caller arriving during the pause waits it out too
+    other = []
+    limiter.call(lambda: other.append(time.monotonic()))
+    first.join()
+    assert other[0] - calls[0] >= 0.19
+
+
+def test_throttle_halves_the_concurrency_limit():
+    limiter = _limiter(max_concurrency=8)
+    call, _ = _failing(HTTPError(429))
+
+    limiter.call(call)
+
+    # Halved by the 429, then raised by 1/limit for the successful retry
+    assert limiter.concurrency.limit == pytest.approx(4.25)
+
+
+def test_still_throttled_after_every_retry_raises_rate_limit_exceeded():
+    limiter = _limiter(max_retries=2)
+    call, calls = _failing(*[HTTPError(429)] * 5)
+
+    with pytest.raises(RateLimitExceeded):
+        limiter.call(call)
+    assert len(calls) == 3
+
+
+def test_transient_errors_are_retried_and_the_last_one_raised():
+    limiter = _limiter(max_retries=1)
+    call, calls = _failing(ConnectionError("reset"), ConnectionError("reset again"))
+
+    with pytest.raises(ConnectionError, match="again"):
+        limiter.call(call)
+    assert len(calls) == 2
+
+
+def test_non_retryable_errors_are_raised_at_once():
+    limiter = _limiter()
+    call, calls = _failing(HTTPError(400))
+
+    with pytest.raises(HTTPError):
+        limiter.call(call)
+    assert len(calls) == 1
+    assert limiter.concurrency.in_flight == 0
+
+
+def test_usage_corrects_the_token_estimate():
+    limiter = _limiter(tokens_per_minute=6000)
+
+    limiter.call(lambda: 100, tokens=1000, usage=lambda result: result)
+
+    # 1000 were taken up front, 900 given back
+    assert limiter.tokens._tokens == pytest.approx(5900, abs=5)
+
+
+# --- stream() ---
+
+def test_stream_holds_the_slot_until_it_is_read():
+    limiter = _limiter()
+    stream = limiter.stream(lambda: iter([1, 2]))
+
+    assert next(stream) == 1
+    assert limiter.concurrency.in_flight == 1
+    assert list(stream) == [2]
+    assert limiter.concurrency.in_flight == 0
+
+
+def test_stream_closed_early_releases_its_slot():
+    limiter = _limiter(max_concurrency=1)
+    stream = limiter.stream(lambda: iter([1, 2, 3]))
+    next(stream)
+    stream.close()
+
+    assert limiter.concurrency.in_flight == 0
+    # The single slot is free for the next stream
+    assert list(limiter.stream(lambda: iter([4]))) == [4]
+
+
+def test_stream_retries_failures_before_the_first_chunk():
+    limiter = _limiter()
+    opened = []
+
+    def open_stream():
+        opened.append(True)
+        if len(opened) == 1:
+            raise HTTPError(429)
+        return iter([1, 2])
+
+    assert list(limiter.stream(open_stream)) == [1, 2]
+    assert len(opened) == 2
+
+
+def test_stream_failure_after_a_chunk_is_raised_and_counted_as_throttle():
+    limiter = _limiter(max_concurrency=8)
+
+    def broken():
+        yield 1
+        raise HTTPError(429, {"retry-after": "0.1"})
+
+    chunks = []
+    with pytest.raises(HTTPError):
+        for chunk in limiter.stream(broken):
+            chunks.append(chunk)
+
+    assert chunks == [1]
+    assert limiter.concurrency.limit == 4
+    assert limiter.concurrency.in_flight == 0
+    assert limiter._paused_until > time.monotonic()
+
+
+def test_stream_usage_comes_from_the_last_reporting_chunk():
+    limiter = _limiter(tokens_per_minute=6000)
+
+    list(limiter.stream(lambda: iter([None, None, 250]), tokens=1000, usage=lambda chunk: chunk))
+
+    assert limiter.tokens._tokens == pytest.approx(5750, abs=5)
+
+
+# --- Building blocks ---
+
+def test_adaptive_concurrency_decreases_once_per_cooldown():
+    concurrency = AdaptiveConcurrency(16, cooldown=60)
+
+    concurrency.on_throttle()
+    concurrency.on_throttle()
+
+    assert concurrency.limit == 8
+
+
+def test_adaptive_concurrency_increases_additively_up_to_the_maximum():
+    concurrency = AdaptiveConcurrency(4, cooldown=0)
+    concurrency.on_throttle()
+    assert concurrency.limit == 2
+
+    for _ in range(2):
+        concurrency.on_success()
+    assert concurrency.limit == pytest.approx(2.5 + 1 / 2.5)
+
+    for _ in range(20):
+        concurrency.on_success()
+    assert concurrency.limit == 4
+
+
+def test_token_bucket_waits_for_refill():
+    bucket = TokenBucket(capacity=10, rate=100)
+    bucket.acquire(10)
+
+    started = time.monotonic()
+    bucket.acquire(5)
+    assert time.monotonic() - started >= 0.04
@@ -0,0 +1,86 @@
+import threading
+
+import pytest
+
+from singleflight import SingleFlight
+
+
+def _run_concurrently(flight, key, count, target):
+    """Starts count callers and returns once all of them have joined the call in flight."""
+    threads = [threading.Thread(target=target) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    while True:
+        with flight._lock:
+            call = flight._calls.get(key)
+            if call is not None and call.waiters == count - 1:
+                return threads
+
+
+def test_concurrent_callers_share_one_call():
+    flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+    results = []
+
+    def slow():
+        calls.append(True)
+        release.wait(5)
+        return {"items": []}
+
+    threads = _run_concurrently(flight, "menu", 8, lambda: results.append(flight.do("menu", slow)))
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(calls) == 1
+    assert len(results) == 8
+    assert all(result is results[0][0] for result, _ in results)
+    assert all(shared for _, shared in results)
+
+
+def test_errors_are_shared_with_every_waiter():
+    flight = SingleFlight()
+    release = threading.Event()
+    errors = []
+
+    def failing():
+        release.wait(5)
+        raise ValueError("provider down")
+
+    def caller():
+        try:
+            flight.do("menu", failing)
+        except ValueError as e:
+            errors.append(e)
+
+    threads = _run_concurrently(flight, "menu", 4, caller)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(errors) == 4
+
+
+def test_finished_calls_are_not_cached():
+    flight = SingleFlight()
+    results = iter([1, 2])
+
+    assert flight.do("key", lambda: next(results)) == (1, False)
+    assert flight.do("key", lambda: next(results)) == (2, False)
+    assert flight.in_flight() == 0
+
+
+def test_different_keys_do_not_coalesce():
+    flight = SingleFlight()
+
+    assert flight.do("a", lambda: "a") == ("a", False)
+    assert flight.do("b", lambda: "b") == ("b", False)
+
+
+def test_error_does_not_stick_to_the_key():
+    flight = SingleFlight()
+
+    with pytest.raises(RuntimeError):
+        flight.do("key", lambda: (_ for _ in ()).throw(RuntimeError("once")))
+    assert flight.do("key", lambda: "ok") == ("ok", False)